@@ -1,17 +1,32 @@
 # SPDX-License-Identifier: GPL-3.0+
 
 from __future__ import unicode_literals
+from itertools import chain
 
-from flask import Blueprint, jsonify, request
+from flask import (
+    Blueprint, Response, request, current_app, url_for, stream_with_context)
+from six import string_types
 from werkzeug.exceptions import NotFound
 from neomodel import db
 
 from estuary import version
 from estuary.models import story_flow_list
 from estuary.models.base import EstuaryStructuredNode
+from estuary.error import ValidationError
 
 from estuary.utils.general import (
-    str_to_bool, get_neo4j_node, _order_story_results, create_story_query, story_flow)
+    str_to_bool, str_to_int, str_to_set, get_neo4j_node, get_neo4j_nodes, get_resource_model_info,
+    get_neo4j_nodes_by_id, get_node_model, iter_json, encode_cursor, decode_cursor, join_choices)
+from estuary.utils.story import (
+    _order_story_results, _merge_story_results, story_resources, get_unique_path_indexes,
+    get_story_graph, format_artifact_story, get_batch_stories, get_path_sibling_counts)
+from estuary.utils.queries import create_story_query, create_full_story_query
+from estuary.utils.cache import cached_response
+from estuary.utils.materialization import get_materialized_story
+from estuary.utils.snapshot import (
+    get_story_snapshot, get_snapshot_sibling_counts, get_snapshot_story_paths)
+from estuary.utils.serialization import (
+    json_response, negotiated_response, get_response_mimetype, JSON_MIMETYPE)
 
 api_v1 = Blueprint('api_v1', __name__)
 
@@ -23,34 +38,186 @@ def about():
 
     :rtype: flask.Response
     """
-    return jsonify({'version': version})
+    return json_response({'version': version})
 
 
 @api_v1.route('/<resource>/<uid>')
+@cached_response
 def get_resource(resource, uid):
     """
     Get a resource from Neo4j.
 
+    The response is encoded in JSON, MessagePack or CBOR based on the Accept header. The
+    "stream=true" query parameter only applies to /allstories since the response of a resource is
+    bounded by the limit of nodes per relationship and built before it's encoded.
+
+    The "fields" query parameter limits the properties of the node to the comma-separated list of
+    property names and the "include" query parameter limits its relationships to the
+    comma-separated list of relationship names. The relationships that aren't included aren't
+    queried at all.
+
+    Each relationship has at most "limit" nodes. When a relationship has more nodes, its total
+    number of nodes and the URL of the next nodes are returned in the "meta" key.
+
     :param str resource: a resource name that maps to a neomodel class
     :param str uid: the value of the UniqueIdProperty to query with
-    :return: a Flask JSON response
+    :return: a Flask response
     :rtype: flask.Response
     :raises NotFound: if the item is not found
-    :raises ValidationError: if an invalid resource was requested
+    :raises ValidationError: if an invalid resource or query parameter was requested
     """
     # Default the relationship flag to True
     relationship = True
     if request.args.get('relationship'):
         relationship = str_to_bool(request.args['relationship'])
+    if not relationship and 'include' in request.args:
+        raise ValidationError('The include parameter can\'t be used with relationship=false')
+    max_limit = current_app.config['MAX_RELATIONSHIPS_PER_PAGE']
+    limit = max_limit
+    if request.args.get('limit'):
+        limit = str_to_int(request.args['limit'], 'limit', 1, max_limit)
+
+    item = get_neo4j_node(resource, uid)
+    if not item:
+        raise NotFound('This item does not exist')
+
+    fields = None
+    if 'fields' in request.args:
+        fields = str_to_set(
+            request.args['fields'], 'fields', item.get_model_info().db_properties.values())
+    include = None
+    if 'include' in request.args:
+        include = str_to_set(
+            request.args['include'], 'include', item.get_relationship_info().property_names)
+    elif not relationship:
+        include = set()
+
+    truncated = {}
+    serialized = item.serialize_sparse(fields, include, limit, truncated)
+    if truncated:
+        totals = item.count_related(truncated.keys())
+        serialized['meta'] = {'relationships': {
+            property_name: {
+                'total': totals[property_name],
+                'next': url_for(
+                    '.get_resource_relationship', resource=resource, uid=uid,
+                    relationship=property_name, limit=limit, cursor=encode_cursor(after_id)),
+            }
+            for property_name, after_id in truncated.items()
+        }}
+
+    return negotiated_response(serialized)
+
+
+@api_v1.route('/<resource>/<uid>/<relationship>')
+@cached_response
+def get_resource_relationship(resource, uid, relationship):
+    """
+    Get the nodes related to a resource through one of its relationships.
+
+    The nodes are paginated with the "limit" and "cursor" query parameters. The total number of
+    nodes is returned in the X-Total-Count header and the URL of the next page in the Link header.
+
+    :param str resource: a resource name that maps to a neomodel class
+    :param str uid: the value of the UniqueIdProperty to query with
+    :param str relationship: the name of a relationship of the resource
+    :return: a Flask response
+    :rtype: flask.Response
+    :raises NotFound: if the item is not found
+    :raises ValidationError: if an invalid resource, relationship or pagination parameter was
+    requested
+    """
+    max_limit = current_app.config['MAX_RELATIONSHIPS_PER_PAGE']
+    limit = max_limit
+    if request.args.get('limit'):
+        limit = str_to_int(request.args['limit'], 'limit', 1, max_limit)
+    after_id = None
+    if request.args.get('cursor'):
+        after_id = decode_cursor(request.args['cursor'])
 
     item = get_neo4j_node(resource, uid)
     if not item:
         raise NotFound('This item does not exist')
 
+    relationships = item.get_relationship_info().property_names
+    if relationship not in relationships:
+        raise ValidationError(
+            'The requested relationship "{0}" is invalid. Choose from the following: {1}.'.format(
+                relationship, join_choices(relationships)))
+
+    nodes, total, next_after_id = item.get_related_page(relationship, limit, after_id)
+    response = negotiated_response(nodes)
+    response.headers['X-Total-Count'] = str(total)
+    if next_after_id is not None:
+        next_url = url_for('.get_resource_relationship', resource=resource, uid=uid,
+                           relationship=relationship, limit=limit,
+                           cursor=encode_cursor(next_after_id))
+        response.headers['Link'] = '<{0}>; rel="next"'.format(next_url)
+    return response
+
+
+@api_v1.route('/batch', methods=['POST'])
+def get_batch():
+    """
+    Get several resources or their stories from Neo4j in a single request.
+
+    The request body is a JSON object with the "items" key containing a list of objects with the
+    "resource" and "uid" keys. With "story" set to true, the stories of the resources are returned
+    instead of the resources. With "relationship" set to false, the resources are returned without
+    their relationships. The nodes of each kind of resource are queried together.
+
+    :return: a Flask response with the results keyed by resource and then by UID, which are null
+    for the resources that don't exist
+    :rtype: flask.Response
+    :raises ValidationError: if the request body is invalid or an invalid resource was requested
+    """
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or not isinstance(payload.get('items'), list):
+        raise ValidationError('The request body must be a JSON object with an "items" list')
+    max_items = current_app.config['MAX_BATCH_SIZE']
+    if len(payload['items']) > max_items:
+        raise ValidationError('At most {0} items can be requested at once'.format(max_items))
+    story = payload.get('story', False)
+    relationship = payload.get('relationship', True)
+    if not isinstance(story, bool) or not isinstance(relationship, bool):
+        raise ValidationError('The "story" and "relationship" keys must be booleans')
+
+    # A mapping of the requested resources to the set of their requested UIDs
+    uids_by_resource = {}
+    for item in payload['items']:
+        if not isinstance(item, dict) or not isinstance(item.get('resource'), string_types) or \
+                not isinstance(item.get('uid'), string_types):
+            raise ValidationError(
+                'Each item must be an object with the "resource" and "uid" keys as strings')
+        uids_by_resource.setdefault(item['resource'], set()).add(item['uid'])
+
+    # Validate the whole request before querying Neo4j
+    for resource in uids_by_resource:
+        model_info = get_resource_model_info(resource)
+        if story:
+            create_full_story_query(model_info.model.__label__, batch=True)
+
+    results = {
+        resource: {uid: None for uid in uids} for resource, uids in uids_by_resource.items()}
+    if story:
+        # The stories of different kinds of resources often share nodes
+        identity_map = {}
+        for resource, uids in uids_by_resource.items():
+            results[resource].update(get_batch_stories(resource, uids, identity_map))
+        return negotiated_response(results)
+
+    nodes = {}
+    for resource, uids in uids_by_resource.items():
+        for uid, node in get_neo4j_nodes(resource, uids).items():
+            nodes[(resource, uid)] = node
     if relationship:
-        return jsonify(item.serialized_all)
-    else:
-        return jsonify(item.serialized)
+        serialized_nodes = EstuaryStructuredNode.serialize_nodes_all(list(nodes.values()))
+    for (resource, uid), node in nodes.items():
+        if relationship:
+            results[resource][uid] = serialized_nodes[node.id]
+        else:
+            results[resource][uid] = get_node_model(node).serialize_raw_node(node)
+    return negotiated_response(results)
 
 
 @api_v1.route('/story')
@@ -61,154 +228,233 @@ def get_available_resources():
     :return: a Flask JSON response
     :rtype: flask.Response
     """
-    return jsonify({label.lower(): story_flow(label)['uid_name'] for label in story_flow_list})
+    return json_response(story_resources)
 
 
 @api_v1.route('/story/<resource>/<uid>')
+@cached_response
 def get_resource_story(resource, uid):
     """
     Get the story of a resource from Neo4j.
 
+    The response is encoded in JSON, MessagePack or CBOR based on the Accept header.
+
     :param str resource: a resource name that maps to a neomodel class
     :param str uid: the value of the UniqueIdProperty to query with
-    :return: a Flask JSON response
+    :return: a Flask response
     :rtype: flask.Response
     :raises NotFound: if the item is not found
     :raises ValidationError: if an invalid resource was requested
     """
+    label = get_resource_model_info(resource).model.__label__
+    # The materialized stories are stored in compact JSON, so the other formats and the indented
+    # JSON of the debug mode are always computed to be the same as when no story is stored
+    if current_app.config['USE_MATERIALIZED_STORIES'] and label in story_flow_list and \
+            get_response_mimetype() == JSON_MIMETYPE and not current_app.debug:
+        document = get_materialized_story(label, uid)
+        if document is not None:
+            response = Response(document, mimetype=JSON_MIMETYPE)
+            response.vary.add('Accept')
+            return response
+
     item = get_neo4j_node(resource, uid)
     if not item:
         raise NotFound('This item does not exist')
 
-    uid_name = item.unique_id_property
-    forward_query = create_story_query(item, uid_name, uid, limit=True)
-    backward_query = create_story_query(item, uid_name, uid, reverse=True,
-                                        limit=True)
-
-    def _get_partial_story(query, resources_to_expand):
-        results, _ = db.cypher_query(query)
-
+    # The longest path in each direction and the counts of the nodes related to them are
+    # retrieved in a single round trip to Neo4j, unless they are found in the story snapshot. The
+    # query is created either way since it validates that the story is available.
+    query = create_full_story_query(item.__label__)
+    story_paths = None
+    snapshot = get_story_snapshot()
+    if snapshot is not None:
+        story_paths = get_snapshot_story_paths(snapshot, item)
+    if story_paths is None:
+        results, _ = db.cypher_query(query, {'uid': uid})
         if not results:
-            return {}
-
-        # Assuming that if Path is the first result, then that's all we want to process.
-        results = [list(results[0][0].nodes)]
-
-        return EstuaryStructuredNode.inflate_results(results, resources_to_expand)[0]
-
+            raise NotFound('This item does not exist')
+        forward_path, backward_path, raw_sibling_counts = results[0]
+        story_paths = (
+            list(forward_path.nodes) if forward_path else None,
+            list(backward_path.nodes) if backward_path else None,
+            {
+                (node_label, node_uid): (backward_count, forward_count)
+                for node_label, node_uid, backward_count, forward_count in raw_sibling_counts
+            },
+        )
+    forward_nodes, backward_nodes, sibling_counts = story_paths
+
+    # The requested node is part of both paths, so only serialize it once
+    identity_map = {}
     results_unordered = {}
-    if forward_query:
-        results_unordered = _get_partial_story(forward_query, [resource])
+    if forward_nodes:
+        results_unordered = EstuaryStructuredNode.inflate_results(
+            [forward_nodes], [resource], identity_map)[0]
 
-    if backward_query:
-        results_unordered.update(
-            _get_partial_story(backward_query, [resource]))
+    if backward_nodes:
+        results_unordered.update(EstuaryStructuredNode.inflate_results(
+            [backward_nodes], [resource], identity_map)[0])
 
     # Adding the artifact itself if it's story is not available
     if len(results_unordered) == 0:
-        results = {'data': [], 'meta': {}}
-        results['meta']['related_nodes'] = {key: 0 for key in story_flow_list}
-        results['data'].append(item.serialized_all)
-        results['data'][0]['resource_type'] = item.__label__
-        return jsonify(results)
+        return negotiated_response(format_artifact_story(item.serialized_all, item.__label__))
 
-    return jsonify(_order_story_results(results_unordered))
+    return negotiated_response(_order_story_results(results_unordered, sibling_counts))
 
 
 @api_v1.route('/allstories/<resource>/<uid>')
+@cached_response
 def get_resource_all_stories(resource, uid):
     """
     Get all unique stories of an artifact from Neo4j.
 
+    The stories are paginated with the "limit" and "cursor" query parameters. The total number of
+    stories is returned in the X-Total-Count header and the URL of the next page in the Link header.
+    With the "format=graph" query parameter, the nodes shared by the stories are only returned once.
+    The response is encoded in JSON, MessagePack or CBOR based on the Accept header. With the
+    "stream=true" query parameter, the stories of a JSON response are streamed to the client as
+    they are generated. Only the story paths of the requested page are serialized, and the stories
+    of an artifact with more story paths in one direction than MAX_STORY_PATHS can't be listed.
+
     :param str resource: a resource name that maps to a neomodel class
     :param str uid: the value of the UniqueIdProperty to query with
-    :return: a Flask JSON response
+    :return: a Flask response
     :rtype: flask.Response
     :raises NotFound: if the item is not found
-    :raises ValidationError: if an invalid resource was requested
+    :raises ValidationError: if an invalid resource or pagination parameter was requested
     """
+    max_limit = current_app.config['MAX_STORIES_PER_PAGE']
+    limit = max_limit
+    if request.args.get('limit'):
+        limit = str_to_int(request.args['limit'], 'limit', 1, max_limit)
+    cursor = 0
+    if request.args.get('cursor'):
+        cursor = str_to_int(request.args['cursor'], 'cursor')
+    response_format = request.args.get('format', 'list')
+    if response_format not in ('list', 'graph'):
+        raise ValidationError('The format must be "list" or "graph"')
+    stream = str_to_bool(request.args.get('stream'))
+
     item = get_neo4j_node(resource, uid)
     if not item:
         raise NotFound('This item does not exist')
 
-    uid_name = item.unique_id_property
-    forward_query = create_story_query(item, uid_name, uid)
-    backward_query = create_story_query(item, uid_name, uid, reverse=True)
-
-    def _get_partial_stories(query, resources_to_expand):
-
-        results_list = []
-        results, _ = db.cypher_query(query)
-
-        if not results:
-            return [results_list]
-
-        # Creating a list of lists where each list is a collection of node IDs
-        # of the nodes present in that particular story path.
-        # Paths are re-sorted in ascending order to simplify the logic below
-        path_nodes_id = []
-        for path in reversed(results):
-            path_nodes_id.append([node.id for node in path[0].nodes])
-
-        unique_paths = []
-        for index, node_set in enumerate(path_nodes_id[:-1]):
-            unique = True
-            for alternate_set in path_nodes_id[index + 1:]:
-                # If the node_set is a subset of alternate_set,
-                # we know they are the same path except the alternate_set is longer.
-                # If alternate_set and node_set only have one node ID of difference,
-                # we know it's the same path but from the perspective of different siblings.
-                if set(node_set).issubset(set(alternate_set)) or len(
-                        set(alternate_set).difference(set(node_set))) == 1:
-                    unique = False
-                    break
-            if unique:
-                # Since results is from longest to shortest, we need to get the opposite index.
-                unique_paths.append(results[(len(path_nodes_id) - index) - 1][0])
-        # While traversing, the outer for loop only goes until the second to last element
-        # because the inner for loop always starts one element ahead of the outer for loop.
-        # Hence, all the subsets of the last element will not be added to the unique_paths
-        # list as the for loops will eliminate them. So we add the last element
-        # since we are sure it is unique.
-        unique_paths.append(results[0][0])
-        unique_paths_nodes = [path.nodes for path in unique_paths]
-
-        return EstuaryStructuredNode.inflate_results(unique_paths_nodes, resources_to_expand)
-
-    if forward_query:
-        results_unordered_forward = _get_partial_stories(forward_query, [resource])
-    else:
-        results_unordered_forward = []
-
-    if backward_query:
-        results_unordered_backward = _get_partial_stories(backward_query, [resource])
-    else:
-        results_unordered_backward = []
-
-    all_results = []
-    if not results_unordered_backward or not results_unordered_forward:
-        if results_unordered_forward:
-            results_unordered_unidir = results_unordered_forward
+    forward_query = create_story_query(item.__label__, paths_limit=True)
+    backward_query = create_story_query(item.__label__, reverse=True, paths_limit=True)
+    # The paths share many nodes, such as the requested node which is expanded with an additional
+    # query, so they are only serialized once per request
+    identity_map = {}
+    snapshot = get_story_snapshot()
+    if snapshot is not None and not snapshot.has_node(item.__label__, item.id):
+        snapshot = None
+    # The counts of the nodes related to the story nodes from the snapshot or the story counters
+    sibling_counts = {}
+
+    max_paths = current_app.config['MAX_STORY_PATHS']
+
+    def _get_unique_paths(query, reverse):
+        if not query:
+            return [], {}
+        if snapshot is not None:
+            # The paths are enumerated in memory and only the nodes of the paths on the requested
+            # page are fetched from Neo4j
+            path_nodes_id = snapshot.get_all_paths(
+                item.__label__, item.id, reverse=reverse, limit=max_paths + 1)
+            nodes = None
         else:
-            results_unordered_unidir = results_unordered_backward
-
-        for result in results_unordered_unidir:
-            all_results.append(_order_story_results(result))
+            results, _ = db.cypher_query(query, {'uid': uid, 'limit': max_paths + 1})
+            # Creating a list of lists where each list is a collection of node IDs
+            # of the nodes present in that particular story path.
+            # Paths are re-sorted in ascending order to simplify the logic below
+            path_nodes_id = []
+            nodes = {}
+            for path, in reversed(results):
+                path_nodes_id.append([node.id for node in path.nodes])
+                nodes.update((node.id, node) for node in path.nodes)
+
+        if not path_nodes_id:
+            return [], nodes
+        if len(path_nodes_id) > max_paths:
+            raise ValidationError(
+                'The stories of this item can\'t be listed since it has more than {0} story paths '
+                'in one direction'.format(max_paths))
+        unique_paths = [path_nodes_id[index]
+                        for index in get_unique_path_indexes(path_nodes_id)]
+        return unique_paths, nodes
+
+    def _get_partial_stories(paths, nodes, indexes, reverse):
+        # Only the paths on the requested page are serialized
+        page_paths = [paths[index] for index in indexes]
+        if nodes is None:
+            nodes = get_neo4j_nodes_by_id(set(chain.from_iterable(page_paths)))
+            sibling_counts.update(get_snapshot_sibling_counts(
+                snapshot, item.__label__, page_paths, nodes, reverse))
+        page_paths_nodes = [[nodes[node_id] for node_id in path] for path in page_paths]
+        if snapshot is None:
+            # The story counters of the nodes are used instead of counting their relationships
+            for path in page_paths_nodes:
+                sibling_counts.update(get_path_sibling_counts(item.__label__, path, reverse))
+
+        return dict(zip(indexes, EstuaryStructuredNode.inflate_results(
+            page_paths_nodes, [resource], identity_map)))
+
+    forward_paths, forward_nodes = _get_unique_paths(forward_query, False)
+    backward_paths, backward_nodes = _get_unique_paths(backward_query, True)
+
+    if not backward_paths or not forward_paths:
+        if forward_paths:
+            unidir_paths, unidir_nodes, reverse = forward_paths, forward_nodes, False
+        else:
+            unidir_paths, unidir_nodes, reverse = backward_paths, backward_nodes, True
 
+        total = len(unidir_paths)
+        indexes = list(range(cursor, min(cursor + limit, total)))
+        results_unordered = _get_partial_stories(unidir_paths, unidir_nodes, indexes, reverse)
+        page = (results_unordered[index] for index in indexes)
+    else:
+        # Combining all the backward and forward paths to generate all the possible full paths.
+        # The combinations are in the order of itertools.product and only the ones on the
+        # requested page are merged and ordered.
+        total = len(forward_paths) * len(backward_paths)
+        combinations = [divmod(index, len(backward_paths))
+                        for index in range(cursor, min(cursor + limit, total))]
+        results_unordered_forward = _get_partial_stories(
+            forward_paths, forward_nodes, sorted(set(index for index, _ in combinations)), False)
+        results_unordered_backward = _get_partial_stories(
+            backward_paths, backward_nodes, sorted(set(index for _, index in combinations)), True)
+        page = (_merge_story_results(results_unordered_forward[forward_index],
+                                     results_unordered_backward[backward_index])
+                for forward_index, backward_index in combinations)
+
+    story_available = total > 0
+    if not story_available:
+        # The artifact itself is returned instead
+        total = 1
+
+    def _get_stories():
+        for results_unordered in page:
+            yield _order_story_results(results_unordered, sibling_counts)
+
+        # Adding the artifact itself if its story is not available
+        if not story_available and cursor == 0:
+            yield format_artifact_story(item.serialized_all, item.__label__)
+
+    if response_format == 'graph':
+        response = negotiated_response(get_story_graph(_get_stories()))
+    elif stream and get_response_mimetype() == JSON_MIMETYPE:
+        # Each story is sent as soon as it's ordered instead of building the whole response first
+        response = Response(stream_with_context(iter_json(_get_stories(), depth=1)),
+                            mimetype=JSON_MIMETYPE)
+        response.vary.add('Accept')
     else:
-        # Combining all the backward and forward paths to generate all the possible full paths
-        for result_forward in results_unordered_forward:
-            for result_backward in results_unordered_backward:
-                results_unordered = result_forward.copy()
-                results_unordered.update(result_backward)
-                all_results.append(_order_story_results(results_unordered))
-
-    # Adding the artifact itself if its story is not available
-    if len(all_results) == 0:
-        results = {'data': [], 'meta': {}}
-        results['meta']['related_nodes'] = {key: 0 for key in story_flow_list}
-        results['data'].append(item.serialized_all)
-        results['data'][0]['resource_type'] = item.__label__
-        all_results.append(results)
-
-    return jsonify(all_results)
+        response = negotiated_response(list(_get_stories()))
+    response.headers['X-Total-Count'] = str(total)
+    if cursor + limit < total:
+        next_args = {'limit': limit, 'cursor': cursor + limit}
+        if response_format != 'list':
+            next_args['format'] = response_format
+        if stream:
+            next_args['stream'] = 'true'
+        next_url = url_for('.get_resource_all_stories', resource=resource, uid=uid, **next_args)
+        response.headers['Link'] = '<{0}>; rel="next"'.format(next_url)
+    return response
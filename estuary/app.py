@@ -4,7 +4,7 @@ from __future__ import unicode_literals
 
 import os
 
-from flask import Flask, current_app
+from flask import Flask, current_app, request
 from werkzeug.exceptions import default_exceptions
 from neomodel import config as neomodel_config
 from neo4j.exceptions import ServiceUnavailable, AuthError
@@ -12,6 +12,10 @@ from neo4j.exceptions import ServiceUnavailable, AuthError
 from estuary.logger import init_logging
 from estuary.error import json_error, ValidationError
 from estuary.api.v1 import api_v1
+from estuary.utils.cache import init_cache
+from estuary.utils.compression import (
+    get_response_encoding, compress, is_compressible, set_compressed_data)
+from estuary.utils.snapshot import init_story_snapshot
 
 
 def load_config(app):
@@ -51,6 +55,58 @@ def insert_headers(response):
         response.headers['Access-Control-Allow-Origin'] = cors_url
         response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
         response.headers['Access-Control-Allow-Method'] = 'GET, OPTIONS'
+        response.headers['Access-Control-Expose-Headers'] = 'Link, X-Total-Count'
+    return response
+
+
+def insert_cache_headers(response):
+    """
+    Insert the ETag and Cache-Control headers into the Flask response and handle If-None-Match.
+
+    :param flask.Response response: the response to insert headers into
+    :return: modified Flask response or a 304 response if the client has the same content
+    :rtype: flask.Response
+    """
+    if request.method != 'GET' or response.status_code != 200 or response.is_streamed:
+        return response
+
+    # The ETag is already set if the response comes from the response cache
+    response.add_etag()
+    resource = (request.view_args or {}).get('resource')
+    max_age = current_app.config['DEFAULT_CACHE_CONTROL_MAX_AGE']
+    if resource:
+        max_age = current_app.config['CACHE_CONTROL_MAX_AGE'].get(resource.lower(), max_age)
+    if max_age:
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+    else:
+        # Clients must check with the ETag that their copy is still valid before using it
+        response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+def compress_response(response):
+    """
+    Compress the Flask response based on the Accept-Encoding header.
+
+    :param flask.Response response: the response to compress
+    :return: modified Flask response
+    :rtype: flask.Response
+    """
+    if response.status_code != 200 or response.is_streamed or \
+            'Content-Encoding' in response.headers:
+        return response
+
+    data = response.get_data()
+    if is_compressible(len(data)):
+        # Shared caches must not serve this response to clients with another Accept-Encoding
+        # header, whether it's compressed or not
+        response.vary.add('Accept-Encoding')
+    encoding = get_response_encoding(len(data))
+    if encoding:
+        # Compute the ETag before compressing so that it's the same as the one of cached responses
+        response.add_etag()
+        set_compressed_data(response, compress(data, encoding), encoding)
     return response
 
 
@@ -74,6 +130,8 @@ def create_app(config_obj=None):
     neomodel_config.DATABASE_URL = app.config.get('NEO4J_URI')
 
     init_logging(app)
+    init_cache(app)
+    init_story_snapshot(app)
 
     for status_code in default_exceptions.keys():
         app.register_error_handler(status_code, json_error)
@@ -83,5 +141,8 @@ def create_app(config_obj=None):
     app.register_blueprint(api_v1, url_prefix='/api/v1')
 
     app.after_request(insert_headers)
+    app.after_request(insert_cache_headers)
+    # This must be registered last so that it runs before insert_cache_headers
+    app.after_request(compress_response)
 
     return app
@@ -11,5 +11,7 @@ all_models = (Advisory, AdvisoryState, BugzillaBug, ContainerKojiBuild, DistGitB
               DistGitCommit, DistGitPush, DistGitRepo, FreshmakerEvent, KojiBuild,
               KojiTag, KojiTask, User)
 names_to_model = {model.__label__: model for model in all_models}
+# A mapping of the lower-cased resource names used in the API to the information about their model
+model_registry = {model.__label__.lower(): model.get_model_info() for model in all_models}
 story_flow_list = ['BugzillaBug', 'DistGitCommit', 'KojiBuild',
                    'Advisory', 'FreshmakerEvent', 'ContainerKojiBuild']
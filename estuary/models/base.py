@@ -1,12 +1,160 @@
 # SPDX-License-Identifier: GPL-3.0+
 
 from __future__ import unicode_literals
-from datetime import datetime
+from collections import namedtuple
 
-from neomodel import StructuredNode, One, ZeroOrOne, OUTGOING, INCOMING, EITHER, UniqueIdProperty
+from neomodel import (
+    StructuredNode, One, ZeroOrOne, ZeroOrMore, OUTGOING, INCOMING, EITHER, UniqueIdProperty,
+    StringProperty, IntegerProperty, FloatProperty, db)
+# This is how neomodel reads the properties of a node regardless of the neo4j-driver version
+from neomodel.util import _get_node_properties
+from six import text_type
 
 from estuary import log
-from estuary.utils.general import inflate_node
+from estuary.utils.general import get_node_model
+
+
+# The inflate methods of these properties only coerce the type of the value returned by Neo4j
+_simple_inflate_functions = {
+    FloatProperty: float,
+    IntegerProperty: int,
+    UniqueIdProperty: text_type,
+}
+
+
+def _get_inflate_function(prop_def):
+    """
+    Get a function that converts a value returned by Neo4j to its Python value.
+
+    :param neomodel.Property prop_def: the property definition of the value
+    :return: a function that accepts the value returned by Neo4j
+    :rtype: function
+    """
+    prop_type = type(prop_def)
+    if prop_type is StringProperty and prop_def.choices is None:
+        return text_type
+    elif prop_type in _simple_inflate_functions:
+        return _simple_inflate_functions[prop_type]
+    return prop_def.inflate
+
+
+ModelInfo = namedtuple('ModelInfo', [
+    'model',
+    # The name of the UniqueIdProperty on the model (e.g. "id_") and its name in Neo4j (e.g. "id")
+    'uid_name',
+    'uid_db_property',
+    # A mapping of the model's property names to their names in Neo4j
+    'db_properties',
+    # A tuple of (db_property, inflate_function, property_definition) tuples used to serialize
+    # the nodes returned by Neo4j without inflating them
+    'projection',
+])
+
+RelationshipInfo = namedtuple('RelationshipInfo', [
+    # A mapping of Neo4j relationship names in the format of:
+    # {
+    #     node_label: {
+    #         relationship_name: {direction: (property_name, cardinality_class) ...},
+    #     }
+    # }
+    'relationship_map',
+    # The names of all the relationship properties on the model
+    'property_names',
+    # The names of the relationship properties with a cardinality of One or ZeroOrOne
+    'single_property_names',
+])
+
+
+class StoryRelationshipMixin(object):
+    """
+    Keep the story counters of the nodes up to date when a relationship of the story flow changes.
+
+    This must come before the cardinality class in the bases of the relationship manager.
+    """
+
+    def connect(self, node, properties=None):
+        """
+        Connect a node and update the story counters of both nodes.
+
+        :param neomodel.StructuredNode node: the node to connect
+        :kwarg dict properties: the properties of the new relationship
+        :return: the return value of the connect method of the cardinality class
+        """
+        rv = super(StoryRelationshipMixin, self).connect(node, properties)
+        _update_story_counts([self.source.id, node.id])
+        return rv
+
+    def disconnect(self, node):
+        """
+        Disconnect a node and update the story counters of both nodes.
+
+        :param neomodel.StructuredNode node: the node to disconnect
+        """
+        super(StoryRelationshipMixin, self).disconnect(node)
+        _update_story_counts([self.source.id, node.id])
+
+    def disconnect_all(self):
+        """Disconnect all the nodes and update the story counters of all the nodes involved."""
+        node_ids = [node.id for node in self.all()]
+        super(StoryRelationshipMixin, self).disconnect_all()
+        _update_story_counts(node_ids + [self.source.id])
+
+    def reconnect(self, old_node, new_node):
+        """
+        Replace a connected node and update the story counters of all the nodes involved.
+
+        :param neomodel.StructuredNode old_node: the node to disconnect
+        :param neomodel.StructuredNode new_node: the node to connect
+        """
+        super(StoryRelationshipMixin, self).reconnect(old_node, new_node)
+        _update_story_counts([self.source.id, old_node.id, new_node.id])
+
+
+class StoryZeroOrMore(StoryRelationshipMixin, ZeroOrMore):
+    """A relationship of the story flow to zero or more nodes."""
+
+    pass
+
+
+class StoryZeroOrOne(StoryRelationshipMixin, ZeroOrOne):
+    """A relationship of the story flow to zero or one node."""
+
+    pass
+
+
+def _update_story_counts(node_ids):
+    """
+    Update the story counters of nodes.
+
+    :param list node_ids: the internal Neo4j IDs of the nodes
+    """
+    # To avoid circular imports
+    from estuary.utils.queries import create_story_counts_query
+
+    db.cypher_query(create_story_counts_query(), {'node_ids': node_ids})
+
+
+def _get_related_node_condition(node_class, variable):
+    """
+    Get the cypher condition that leaves out the nodes of the subclasses of a model.
+
+    The nodes of a subclass, such as ContainerKojiBuild nodes which also have the KojiBuild label,
+    are serialized with their own model, which isn't the one of the relationship.
+
+    :param type node_class: the model of the nodes on the other end of a relationship
+    :param str variable: the variable of the nodes in the query
+    :return: the cypher condition or None if the model has no subclasses
+    :rtype: str
+    """
+    # To avoid circular imports
+    from estuary.models import all_models
+
+    excluded_labels = sorted(
+        model.__label__ for model in all_models
+        if model is not node_class and issubclass(model, node_class))
+    if not excluded_labels:
+        return None
+    return ' AND '.join('NOT {0}:{1}'.format(variable, label) for label in excluded_labels)
 
 
 class EstuaryStructuredNode(StructuredNode):
@@ -14,25 +162,103 @@ class EstuaryStructuredNode(StructuredNode):
 
     __abstract_node__ = True
 
+    @classmethod
+    def get_model_info(cls):
+        """
+        Get the static information about the model that is needed to query and serialize it.
+
+        The information is computed once per model class.
+
+        :return: the information about the model
+        :rtype: ModelInfo
+        """
+        # Don't use getattr since a subclass must not reuse the information of its parent class
+        model_info = cls.__dict__.get('_model_info')
+        if model_info is None:
+            uid_name = None
+            uid_db_property = None
+            db_properties = {}
+            projection = []
+            for property_name, prop_def in cls.__all_properties__:
+                db_property = prop_def.db_property or property_name
+                db_properties[property_name] = db_property
+                projection.append((db_property, _get_inflate_function(prop_def), prop_def))
+                if isinstance(prop_def, UniqueIdProperty):
+                    uid_name = property_name
+                    uid_db_property = db_property
+            model_info = ModelInfo(
+                cls, uid_name, uid_db_property, db_properties, tuple(projection))
+            cls._model_info = model_info
+        return model_info
+
+    @classmethod
+    def get_relationship_info(cls):
+        """
+        Get the static information about the model's relationships needed to serialize it.
+
+        The information is computed once per model class. This can't happen when the class is
+        defined since the classes on the other end of the relationships may not be defined yet.
+
+        :return: the information about the model's relationships
+        :rtype: RelationshipInfo
+        """
+        # Don't use getattr since a subclass must not reuse the information of its parent class
+        relationship_info = cls.__dict__.get('_relationship_info')
+        if relationship_info is None:
+            relationship_map = {}
+            property_names = set()
+            single_property_names = set()
+            for property_name, relationship in cls.__all_relationships__:
+                if 'node_class' not in relationship.definition:
+                    # neomodel only resolves the class when a node with the relationship is
+                    # instantiated, which never happens when nodes are serialized with
+                    # serialize_raw_node
+                    relationship._lookup_node_class()
+                node_label = relationship.definition['node_class'].__label__
+                relationship_name = relationship.definition['relation_type']
+                if node_label not in relationship_map:
+                    relationship_map[node_label] = {}
+
+                relationship_direction = relationship.definition['direction']
+                if relationship_direction == EITHER:
+                    # The direction can be coming from either direction, so map both
+                    properties = {
+                        INCOMING: (property_name, relationship.manager),
+                        OUTGOING: (property_name, relationship.manager),
+                    }
+                else:
+                    properties = {relationship_direction: (property_name, relationship.manager)}
+
+                if relationship_name not in relationship_map[node_label]:
+                    relationship_map[node_label][relationship_name] = properties
+                else:
+                    relationship_map[node_label][relationship_name].update(properties)
+                property_names.add(property_name)
+                if issubclass(relationship.manager, (One, ZeroOrOne)):
+                    single_property_names.add(property_name)
+
+            relationship_info = RelationshipInfo(
+                relationship_map, frozenset(property_names), frozenset(single_property_names))
+            cls._relationship_info = relationship_info
+        return relationship_info
+
     @property
     def serialized(self):
         """
         Convert a model to serialized form.
 
+        The datetime values are left as is since the API's JSON encoder handles them.
+
         :return: a serialized form of the node
         :rtype: dictionary
         """
         rv = {}
+        db_properties = self.get_model_info().db_properties
         for key, value in self.__properties__.items():
             # id is the internal Neo4j ID that we don't want to display to the user
             if key == 'id':
                 continue
-            actual_key = getattr(self.__class__, key).db_property or key
-
-            if isinstance(value, datetime):
-                rv[actual_key] = value.isoformat()
-            else:
-                rv[actual_key] = value
+            rv[db_properties[key]] = value
 
         return rv
 
@@ -45,79 +271,381 @@ class EstuaryStructuredNode(StructuredNode):
         :rtype: dictionary
         :raises RuntimeError: if the label of a Neo4j node can't be mapped back to a neomodel class
         """
-        # A set that will keep track of all properties on the node that weren't returned from Neo4j
-        null_properties = set()
-        # A mapping of Neo4j relationship names in the format of:
-        # {
-        #     node_label: {
-        #         relationship_name: {direction: (property_name, cardinality_class) ...},
-        #     }
-        # }
-        relationship_map = {}
-        for property_name, relationship in self.__all_relationships__:
-            node_label = relationship.definition['node_class'].__label__
-            relationship_name = relationship.definition['relation_type']
-            if node_label not in relationship_map:
-                relationship_map[node_label] = {}
-
-            relationship_direction = relationship.definition['direction']
-            if relationship_direction == EITHER:
-                # The direction can be coming from either direction, so map both
-                properties = {
-                    INCOMING: (property_name, relationship.manager),
-                    OUTGOING: (property_name, relationship.manager),
-                }
+        return self._serialize_relationships(self.id, self.serialized)
+
+    def serialize_sparse(self, fields=None, include=None, limit=None, truncated=None):
+        """
+        Generate a serialized form of the node with only some of its properties and relationships.
+
+        The relationships that aren't included aren't queried from Neo4j at all.
+
+        :kwarg fields: the names of the properties in Neo4j to include or None to include all of
+        them
+        :kwarg include: the names of the relationship properties to include or None to include all
+        of them
+        :kwarg int limit: the maximum number of nodes of each relationship to include or None to
+        include all of them; the nodes with the lowest internal Neo4j IDs are included
+        :kwarg dict truncated: a dictionary that is filled with the names of the relationship
+        properties that have more nodes than the limit as keys and the internal Neo4j ID of the
+        last node included as values, which can be passed to get_related_page to get the next nodes
+        :return: a serialized form of the node
+        :rtype: dictionary
+        :raises RuntimeError: if the label of a Neo4j node can't be mapped back to a neomodel class
+        """
+        serialized = self.serialized
+        if fields is not None:
+            serialized = {key: value for key, value in serialized.items() if key in fields}
+        if include is not None and not include:
+            return serialized
+        if limit is not None:
+            return self._serialize_limited_relationships(
+                self.id, serialized, limit, include, truncated)
+        return self._serialize_relationships(self.id, serialized, include=include)
+
+    def get_related_page(self, property_name, limit, after_id=None):
+        """
+        Get a page of the nodes related to the node through a relationship property.
+
+        The nodes are ordered by their internal Neo4j ID, which is used as a keyset cursor so that
+        getting a page doesn't require skipping the nodes of the previous pages.
+
+        :param str property_name: the name of the relationship property
+        :param int limit: the maximum number of nodes to return
+        :kwarg int after_id: only return the nodes with an internal Neo4j ID greater than this
+        :return: a tuple of the serialized nodes, the total number of related nodes and the
+        internal Neo4j ID to pass as after_id to get the next page or None if it's the last page
+        :rtype: tuple
+        :raises RuntimeError: if the label of a Neo4j node can't be mapped back to a neomodel class
+        """
+        conditions = ['id(all) > $after_id']
+        node_condition = self._get_relationship_condition(property_name, 'all')
+        if node_condition:
+            conditions.append(node_condition)
+        results, _ = db.cypher_query(
+            'MATCH (a) WHERE id(a)=$node_id WITH a, {0} AS total '
+            'OPTIONAL MATCH {1} WHERE {2} '
+            'WITH total, all ORDER BY id(all) LIMIT $limit '
+            'RETURN total, collect(all)'.format(
+                self._get_relationship_count(property_name),
+                self._get_relationship_pattern(property_name, 'all'),
+                ' AND '.join(conditions)),
+            {'node_id': self.id, 'after_id': -1 if after_id is None else after_id,
+             # Get an extra node to know if there is a next page
+             'limit': limit + 1})
+        total, nodes = results[0]
+        next_after_id = None
+        if len(nodes) > limit:
+            nodes = nodes[:limit]
+            next_after_id = nodes[-1].id
+        return ([get_node_model(node).serialize_raw_node(node) for node in nodes], total,
+                next_after_id)
+
+    def count_related(self, property_names):
+        """
+        Count the nodes related to the node through relationship properties.
+
+        :param property_names: the names of the relationship properties
+        :return: a dictionary with the names of the relationship properties as keys and the number
+        of related nodes as values
+        :rtype: dict
+        """
+        property_names = sorted(property_names)
+        if not property_names:
+            return {}
+
+        results, _ = db.cypher_query(
+            'MATCH (a) WHERE id(a)=$node_id RETURN {0}'.format(', '.join(
+                self._get_relationship_count(property_name)
+                for property_name in property_names)),
+            {'node_id': self.id})
+        return dict(zip(property_names, results[0]))
+
+    @classmethod
+    def serialize_raw_node(cls, node, relationships=False):
+        """
+        Serialize a node returned by Neo4j without inflating it to a model object.
+
+        This returns the same dictionary as the serialized and serialized_all properties.
+
+        :param neo4j.v1.types.Node node: a node of this model from a cypher query result
+        :kwarg bool relationships: include all the relationships of the node
+        :return: a serialized form of the node
+        :rtype: dictionary
+        :raises RuntimeError: if the label of a Neo4j node can't be mapped back to a neomodel class
+        """
+        node_properties = _get_node_properties(node)
+        serialized = {}
+        for db_property, inflate, prop_def in cls.get_model_info().projection:
+            if db_property in node_properties:
+                serialized[db_property] = inflate(node_properties[db_property])
+            elif prop_def.has_default:
+                serialized[db_property] = prop_def.default_value()
             else:
-                properties = {relationship_direction: (property_name, relationship.manager)}
+                serialized[db_property] = None
+
+        if relationships:
+            return cls._serialize_relationships(node.id, serialized)
+        return serialized
+
+    @staticmethod
+    def serialize_nodes_all(nodes):
+        """
+        Serialize several nodes with all their relationships using a single query.
+
+        :param list nodes: the model objects or the nodes from a cypher query result to serialize
+        :return: a dictionary with the internal Neo4j IDs of the nodes as keys and the same
+        dictionaries as the serialized_all property as values
+        :rtype: dict
+        :raises RuntimeError: if the label of a Neo4j node can't be mapped back to a neomodel class
+        """
+        node_ids = list(set(node.id for node in nodes))
+        if not node_ids:
+            return {}
 
-            if relationship_name not in relationship_map[node_label]:
-                relationship_map[node_label][relationship_name] = properties
+        # Get all the direct relationships in both directions of all the nodes
+        node_relationships = {node_id: [] for node_id in node_ids}
+        results, _ = db.cypher_query(
+            'UNWIND $node_ids AS node_id MATCH (a) WHERE id(a)=node_id '
+            'MATCH (a)-[r]-(all) RETURN node_id, r, all',
+            {'node_ids': node_ids})
+        for node_id, relationship, related_node in results:
+            node_relationships[node_id].append((relationship, related_node))
+
+        serialized_nodes = {}
+        for node in nodes:
+            if node.id in serialized_nodes:
+                continue
+
+            if isinstance(node, EstuaryStructuredNode):
+                node_model = type(node)
+                serialized = node.serialized
             else:
-                relationship_map[node_label][relationship_name].update(properties)
-            null_properties.add(property_name)
+                node_model = get_node_model(node)
+                serialized = node_model.serialize_raw_node(node)
+            serialized_nodes[node.id] = node_model._serialize_relationships(
+                node.id, serialized, node_relationships[node.id])
 
-        # This variable will contain the current node as serialized + all relationships
-        serialized = self.serialized
-        # Get all the direct relationships in both directions
-        results, _ = self.cypher('MATCH (a) WHERE id(a)={self} MATCH (a)-[r]-(all) RETURN r, all')
-        for relationship, node in results:
+        return serialized_nodes
+
+    @classmethod
+    def _get_relationship_pattern(cls, property_name, variable):
+        """
+        Get the cypher pattern of a relationship property from the node "a" to the related nodes.
+
+        :param str property_name: the name of the relationship property
+        :param str variable: the variable of the related nodes in the pattern, which can be empty
+        :return: the cypher pattern
+        :rtype: str
+        """
+        relationship = dict(cls.__all_relationships__)[property_name]
+        if 'node_class' not in relationship.definition:
+            relationship._lookup_node_class()
+        node = '({0}:{1})'.format(variable, relationship.definition['node_class'].__label__)
+        relationship_type = relationship.definition['relation_type']
+        if relationship.definition['direction'] == OUTGOING:
+            return '(a)-[:{0}]->{1}'.format(relationship_type, node)
+        elif relationship.definition['direction'] == INCOMING:
+            return '(a)<-[:{0}]-{1}'.format(relationship_type, node)
+        return '(a)-[:{0}]-{1}'.format(relationship_type, node)
+
+    @classmethod
+    def _get_relationship_condition(cls, property_name, variable):
+        """
+        Get the cypher condition on the related nodes of a relationship property.
+
+        :param str property_name: the name of the relationship property
+        :param str variable: the variable of the related nodes in the pattern
+        :return: the cypher condition or None if all the nodes of the pattern are related
+        :rtype: str
+        """
+        relationship = dict(cls.__all_relationships__)[property_name]
+        if 'node_class' not in relationship.definition:
+            relationship._lookup_node_class()
+        return _get_related_node_condition(relationship.definition['node_class'], variable)
+
+    @classmethod
+    def _get_relationship_count(cls, property_name):
+        """
+        Get the cypher expression that counts the nodes related to the node "a".
+
+        :param str property_name: the name of the relationship property
+        :return: the cypher expression
+        :rtype: str
+        """
+        condition = cls._get_relationship_condition(property_name, 'all')
+        if not condition:
+            return 'size({0})'.format(cls._get_relationship_pattern(property_name, ''))
+        return 'size([{0} WHERE {1} | all])'.format(
+            cls._get_relationship_pattern(property_name, 'all'), condition)
+
+    @classmethod
+    def _serialize_limited_relationships(cls, node_id, serialized, limit, include=None,
+                                         truncated=None):
+        """
+        Add the relationships of a node to its serialized form with a limit of nodes on each one.
+
+        :param int node_id: the internal Neo4j ID of the node
+        :param dict serialized: the serialized form of the node without relationships
+        :param int limit: the maximum number of nodes of each relationship to add
+        :kwarg include: the names of the relationship properties to add or None to add all of them
+        :kwarg dict truncated: a dictionary that is filled with the names of the relationship
+        properties that have more nodes than the limit as keys and the internal Neo4j ID of the
+        last node added as values
+        :return: the serialized form of the node with relationships
+        :rtype: dictionary
+        :raises RuntimeError: if the label of a Neo4j node can't be mapped back to a neomodel class
+        """
+        relationship_info = cls.get_relationship_info()
+        if include is None:
+            include = relationship_info.property_names
+        include = sorted(include)
+
+        # A single query returns the first nodes of every relationship. This bounds the size of
+        # the response, but Neo4j still sorts all the nodes of a relationship to find the first
+        # ones.
+        queries = []
+        for property_name in include:
+            condition = cls._get_relationship_condition(property_name, 'all')
+            queries.append(
+                'MATCH (a) WHERE id(a)=$node_id MATCH {0}{1} RETURN "{2}" AS property_name, all '
+                'ORDER BY id(all) LIMIT $limit'.format(
+                    cls._get_relationship_pattern(property_name, 'all'),
+                    ' WHERE {0}'.format(condition) if condition else '', property_name))
+        # Get an extra node per relationship to know if there are more nodes than the limit
+        results, _ = db.cypher_query(
+            ' UNION ALL '.join(queries), {'node_id': node_id, 'limit': limit + 1})
+        related_nodes = {property_name: [] for property_name in include}
+        for property_name, node in results:
+            related_nodes[property_name].append(node)
+
+        for property_name, nodes in related_nodes.items():
+            if property_name in relationship_info.single_property_names:
+                if nodes:
+                    serialized[property_name] = get_node_model(nodes[0]).serialize_raw_node(
+                        nodes[0])
+                else:
+                    serialized[property_name] = None
+                continue
+
+            if len(nodes) > limit:
+                nodes = nodes[:limit]
+                if truncated is not None:
+                    truncated[property_name] = nodes[-1].id
+            serialized[property_name] = [
+                get_node_model(node).serialize_raw_node(node) for node in nodes]
+
+        return serialized
+
+    @classmethod
+    def _get_relationships_query(cls, include=None):
+        """
+        Get the query of the direct relationships of a node and the nodes on the other end.
+
+        :kwarg include: the names of the relationship properties to query or None to query all the
+        relationships in both directions
+        :return: a cypher query that expects the node_id parameter
+        :rtype: str
+        """
+        if include is None:
+            return 'MATCH (a) WHERE id(a)=$node_id MATCH (a)-[r]-(all) RETURN r, all'
+
+        relationship_types = set()
+        conditions = []
+        for property_name, relationship in cls.__all_relationships__:
+            if property_name not in include:
+                continue
+            if 'node_class' not in relationship.definition:
+                relationship._lookup_node_class()
+            relationship_type = relationship.definition['relation_type']
+            relationship_types.add(relationship_type)
+            condition = 'type(r) = "{0}" AND all:{1}'.format(
+                relationship_type, relationship.definition['node_class'].__label__)
+            node_condition = _get_related_node_condition(
+                relationship.definition['node_class'], 'all')
+            if node_condition:
+                condition += ' AND ' + node_condition
+            if relationship.definition['direction'] == OUTGOING:
+                condition += ' AND startNode(r) = a'
+            elif relationship.definition['direction'] == INCOMING:
+                condition += ' AND endNode(r) = a'
+            conditions.append('({0})'.format(condition))
+
+        # Filtering on the relationship types in the pattern avoids expanding the other
+        # relationships of the node, which can be numerous
+        return (
+            'MATCH (a) WHERE id(a)=$node_id MATCH (a)-[r:{0}]-(all) WHERE {1} RETURN r, all'
+            .format('|'.join(sorted(relationship_types)), ' OR '.join(conditions)))
+
+    @classmethod
+    def _serialize_relationships(cls, node_id, serialized, relationships=None, include=None):
+        """
+        Add the relationships of a node to its serialized form.
+
+        :param int node_id: the internal Neo4j ID of the node
+        :param dict serialized: the serialized form of the node without relationships
+        :kwarg list relationships: the (relationship, node) tuples of all the direct relationships
+        of the node; they are queried from Neo4j if this isn't set
+        :kwarg include: the names of the relationship properties to add or None to add all of them
+        :return: the serialized form of the node with relationships
+        :rtype: dictionary
+        :raises RuntimeError: if the label of a Neo4j node can't be mapped back to a neomodel class
+        """
+        relationship_info = cls.get_relationship_info()
+        relationship_map = relationship_info.relationship_map
+        # A set that will keep track of all properties on the node that weren't returned from Neo4j
+        if include is None:
+            null_properties = set(relationship_info.property_names)
+        else:
+            null_properties = set(include)
+
+        if relationships is None:
+            # Get the direct relationships in both directions
+            relationships, _ = db.cypher_query(
+                cls._get_relationships_query(include), {'node_id': node_id})
+        # The nodes of each relationship are in the order of their internal Neo4j ID, like when
+        # the relationships are limited
+        for relationship, node in sorted(relationships, key=lambda result: result[1].id):
             # If the starting node in the relationship is the same as the node being serialized,
             # we know that the relationship is outgoing
-            if relationship.start == self.id:
+            if relationship.start == node_id:
                 direction = OUTGOING
             else:
                 direction = INCOMING
 
-            # Convert the Neo4j result into a model object
-            inflated_node = inflate_node(node)
+            node_model = get_node_model(node)
             try:
                 property_name, cardinality_class = \
-                    relationship_map[inflated_node.__label__][relationship.type][direction]
+                    relationship_map[node_model.__label__][relationship.type][direction]
             except KeyError:
                 if direction == OUTGOING:
                     direction_text = 'outgoing'
                 else:
                     direction_text = 'incoming'
                 log.warn(
-                    'An {0} {1} relationship of {2!r} with {3!r} is not mapped in the models and '
-                    'will be ignored'.format(direction_text, relationship.type, self, inflate_node))
+                    'An {0} {1} relationship of the {2} node with the ID {3} with a {4} node is '
+                    'not mapped in the models and will be ignored'.format(
+                        direction_text, relationship.type, cls.__label__, node_id,
+                        node_model.__label__))
+                continue
+
+            if include is not None and property_name not in include:
+                # The relationship type is shared with an included relationship property
                 continue
 
             if not serialized.get(property_name):
                 null_properties.remove(property_name)
 
-            if cardinality_class in (One, ZeroOrOne):
-                serialized[property_name] = inflated_node.serialized
+            if issubclass(cardinality_class, (One, ZeroOrOne)):
+                serialized[property_name] = node_model.serialize_raw_node(node)
             else:
                 if not serialized.get(property_name):
                     serialized[property_name] = []
-                serialized[property_name].append(inflated_node.serialized)
+                serialized[property_name].append(node_model.serialize_raw_node(node))
 
         # Neo4j won't return back relationships it doesn't know about, so just make them empty
         # so that the keys are always consistent
         for property_name in null_properties:
-            prop = getattr(self, property_name)
-            if isinstance(prop, One) or isinstance(prop, ZeroOrOne):
+            if property_name in relationship_info.single_property_names:
                 serialized[property_name] = None
             else:
                 serialized[property_name] = []
@@ -154,36 +682,58 @@ class EstuaryStructuredNode(StructuredNode):
         :return: a string containing name of the unique ID property of a node
         :rtype: str
         """
-        for _, prop_def in self.__all_properties__:
-            if isinstance(prop_def, UniqueIdProperty):
-                return prop_def.name
+        return self.get_model_info().uid_name
 
     @staticmethod
-    def inflate_results(results, resources_to_expand):
+    def inflate_results(results, resources_to_expand, identity_map=None):
         """
-        Inflate and serialize the results.
+        Serialize the results.
+
+        The nodes are serialized directly from the values returned by Neo4j since inflating them
+        to model objects first is costly and the model objects are discarded right away.
 
         :param str results: results obtained from Neo4j
         :param list resources_to_expand: resources to expand
+        :kwarg dict identity_map: a dictionary shared by the calls made while handling a request
+        so that a node that is part of several results is only serialized once; it is keyed by the
+        internal Neo4j ID of the node and whether its relationships are included
         :return: a list of dictionaries containing serialized results received from Neo4j
         :rtype: list
         """
+        if identity_map is None:
+            identity_map = {}
+
+        # Get the relationships of all the nodes to expand in a single query
+        nodes_to_expand = {}
+        for raw_result in results:
+            for node in raw_result:
+                if node and (node.id, True) not in identity_map:
+                    node_label = get_node_model(node).__label__
+                    if node_label.lower() in resources_to_expand:
+                        nodes_to_expand[node.id] = (node, node_label)
+        serialized_nodes = EstuaryStructuredNode.serialize_nodes_all(
+            [node for node, _ in nodes_to_expand.values()])
+        for node_id, serialized_node in serialized_nodes.items():
+            serialized_node['resource_type'] = nodes_to_expand[node_id][1]
+            identity_map[(node_id, True)] = serialized_node
+
         results_list = []
         for raw_result in results:
             temp = {}
             for node in raw_result:
                 if node:
-                    inflated_node = inflate_node(node)
-                    node_label = inflated_node.__label__
+                    node_model = get_node_model(node)
+                    node_label = node_model.__label__
                     if node_label not in temp:
                         temp[node_label] = []
 
-                    if node_label.lower() in resources_to_expand:
-                        serialized_node = inflated_node.serialized_all
-                    else:
-                        serialized_node = inflated_node.serialized
+                    expand = node_label.lower() in resources_to_expand
+                    serialized_node = identity_map.get((node.id, expand))
+                    if serialized_node is None:
+                        serialized_node = node_model.serialize_raw_node(node, relationships=expand)
+                        serialized_node['resource_type'] = node_label
+                        identity_map[(node.id, expand)] = serialized_node
 
-                    serialized_node['resource_type'] = node_label
                     if serialized_node not in temp[node_label]:
                         temp[node_label].append(serialized_node)
             results_list.append(temp)
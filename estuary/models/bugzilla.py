@@ -6,7 +6,7 @@ from neomodel import (
     UniqueIdProperty, RelationshipTo, RelationshipFrom, IntegerProperty, StringProperty,
     DateTimeProperty, ZeroOrOne)
 
-from estuary.models.base import EstuaryStructuredNode
+from estuary.models.base import EstuaryStructuredNode, StoryZeroOrMore
 
 
 class BugzillaBug(EstuaryStructuredNode):
@@ -26,7 +26,8 @@ class BugzillaBug(EstuaryStructuredNode):
     related_by_commits = RelationshipFrom('.distgit.DistGitCommit', 'RELATED')
     reporter = RelationshipTo('.user.User', 'REPORTED_BY', cardinality=ZeroOrOne)
     resolution = StringProperty()
-    resolved_by_commits = RelationshipFrom('.distgit.DistGitCommit', 'RESOLVED')
+    resolved_by_commits = RelationshipFrom(
+        '.distgit.DistGitCommit', 'RESOLVED', cardinality=StoryZeroOrMore)
     reverted_by_commits = RelationshipFrom('.distgit.DistGitCommit', 'REVERTED')
     severity = StringProperty()
     short_description = StringProperty()
@@ -6,7 +6,7 @@ from neomodel import (
     UniqueIdProperty, RelationshipTo, RelationshipFrom, StringProperty, DateTimeProperty,
     ZeroOrOne)
 
-from estuary.models.base import EstuaryStructuredNode
+from estuary.models.base import EstuaryStructuredNode, StoryZeroOrMore
 
 
 class DistGitRepo(EstuaryStructuredNode):
@@ -57,10 +57,11 @@ class DistGitCommit(EstuaryStructuredNode):
     # treated as read-only
     children = RelationshipFrom('.distgit.DistGitCommit', 'PARENT')
     committer = RelationshipTo('.user.User', 'COMMITTED_BY', cardinality=ZeroOrOne)
-    koji_builds = RelationshipFrom('.koji.KojiBuild', 'BUILT_FROM')
+    koji_builds = RelationshipFrom('.koji.KojiBuild', 'BUILT_FROM', cardinality=StoryZeroOrMore)
     parent = RelationshipTo('.distgit.DistGitCommit', 'PARENT', cardinality=ZeroOrOne)
     pushes = RelationshipFrom('DistGitPush', 'PUSHED')
     related_bugs = RelationshipTo('.bugzilla.BugzillaBug', 'RELATED')
     repos = RelationshipFrom('DistGitRepo', 'CONTAINS')
-    resolved_bugs = RelationshipTo('.bugzilla.BugzillaBug', 'RESOLVED')
+    resolved_bugs = RelationshipTo(
+        '.bugzilla.BugzillaBug', 'RESOLVED', cardinality=StoryZeroOrMore)
     reverted_bugs = RelationshipTo('.bugzilla.BugzillaBug', 'REVERTED')
@@ -6,7 +6,7 @@ from neomodel import (
     UniqueIdProperty, RelationshipTo, RelationshipFrom, StringProperty, ArrayProperty,
     DateTimeProperty, ZeroOrOne)
 
-from estuary.models.base import EstuaryStructuredNode
+from estuary.models.base import EstuaryStructuredNode, StoryZeroOrMore
 
 
 class Advisory(EstuaryStructuredNode):
@@ -31,11 +31,12 @@ class Advisory(EstuaryStructuredNode):
     updated_at = DateTimeProperty()
     assigned_to = RelationshipTo('.user.User', 'ASSIGNED_TO', cardinality=ZeroOrOne)
     attached_bugs = RelationshipTo('.bugzilla.BugzillaBug', 'ATTACHED')
-    attached_builds = RelationshipTo('.koji.KojiBuild', 'ATTACHED')
+    attached_builds = RelationshipTo('.koji.KojiBuild', 'ATTACHED', cardinality=StoryZeroOrMore)
     package_owner = RelationshipTo('.user.User', 'PACKAGE_OWNED_BY', cardinality=ZeroOrOne)
     reporter = RelationshipTo('.user.User', 'REPORTED_BY', cardinality=ZeroOrOne)
     states = RelationshipFrom('AdvisoryState', 'STATE_OF')
-    triggered_freshmaker_event = RelationshipFrom('.freshmaker.FreshmakerEvent', 'TRIGGERED_BY')
+    triggered_freshmaker_event = RelationshipFrom(
+        '.freshmaker.FreshmakerEvent', 'TRIGGERED_BY', cardinality=StoryZeroOrMore)
 
 
 class AdvisoryState(EstuaryStructuredNode):
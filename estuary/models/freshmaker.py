@@ -2,11 +2,9 @@
 
 from __future__ import unicode_literals
 
-from neomodel import (
-    UniqueIdProperty, RelationshipTo, IntegerProperty, StringProperty,
-    ZeroOrOne)
+from neomodel import UniqueIdProperty, RelationshipTo, IntegerProperty, StringProperty
 
-from estuary.models.base import EstuaryStructuredNode
+from estuary.models.base import EstuaryStructuredNode, StoryZeroOrMore, StoryZeroOrOne
 
 
 class FreshmakerEvent(EstuaryStructuredNode):
@@ -19,6 +17,7 @@ class FreshmakerEvent(EstuaryStructuredNode):
     state_name = StringProperty()
     state_reason = StringProperty()
     triggered_by_advisory = RelationshipTo(
-        '.errata.Advisory', 'TRIGGERED_BY', cardinality=ZeroOrOne)
-    triggered_container_builds = RelationshipTo('.koji.ContainerKojiBuild', 'TRIGGERED')
+        '.errata.Advisory', 'TRIGGERED_BY', cardinality=StoryZeroOrOne)
+    triggered_container_builds = RelationshipTo(
+        '.koji.ContainerKojiBuild', 'TRIGGERED', cardinality=StoryZeroOrMore)
     url = StringProperty(unique=True, required=True)
@@ -6,14 +6,14 @@ from neomodel import (
     StringProperty, IntegerProperty, UniqueIdProperty, DateTimeProperty, FloatProperty,
     RelationshipTo, RelationshipFrom, ZeroOrOne)
 
-from estuary.models.base import EstuaryStructuredNode
+from estuary.models.base import EstuaryStructuredNode, StoryZeroOrMore, StoryZeroOrOne
 
 
 class KojiBuild(EstuaryStructuredNode):
     """Definition of a Koji build in Neo4j."""
 
-    advisories = RelationshipFrom('.errata.Advisory', 'ATTACHED')
-    commit = RelationshipTo('.distgit.DistGitCommit', 'BUILT_FROM', cardinality=ZeroOrOne)
+    advisories = RelationshipFrom('.errata.Advisory', 'ATTACHED', cardinality=StoryZeroOrMore)
+    commit = RelationshipTo('.distgit.DistGitCommit', 'BUILT_FROM', cardinality=StoryZeroOrOne)
     completion_time = DateTimeProperty()
     creation_time = DateTimeProperty()
     epoch = StringProperty()
@@ -34,7 +34,7 @@ class ContainerKojiBuild(KojiBuild):
 
     original_nvr = StringProperty()
     triggered_by_freshmaker_event = RelationshipFrom(
-        '.freshmaker.FreshmakerEvent', 'TRIGGERED', cardinality=ZeroOrOne)
+        '.freshmaker.FreshmakerEvent', 'TRIGGERED', cardinality=StoryZeroOrOne)
 
 
 class KojiTask(EstuaryStructuredNode):
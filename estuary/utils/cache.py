@@ -0,0 +1,527 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+from collections import OrderedDict, namedtuple
+import base64
+import copy
+import errno
+import fcntl
+import functools
+import glob
+import hashlib
+import json
+import os
+import threading
+import time
+
+from flask import current_app, request, Response
+from neomodel import db
+from werkzeug.exceptions import NotFound
+
+from estuary import log
+from estuary.utils.compression import (
+    get_response_encoding, compress, is_compressible, set_compressed_data)
+from estuary.utils.serialization import get_response_mimetype
+
+
+# The label and the name of the node that stores the graph generation. The node isn't a model
+# since it's not related to any other node and must never be returned by the API.
+_generation_node = '(m:EstuaryMetadata {name: "graph"})'
+
+CachedResponse = namedtuple('CachedResponse', [
+    # The description of the NotFound exception raised by the view function or None if it returned
+    # a response. A new exception is raised on every cache hit since raising the same one again
+    # would keep adding the frames of every request to its traceback.
+    'error',
+    'status',
+    # A tuple of the (header, value) tuples set by the view function
+    'headers',
+    'body',
+    # A mapping of content encodings to the compressed bodies, which are added when first requested
+    'compressed_bodies',
+])
+
+
+def get_graph_generation():
+    """
+    Get the graph generation marker from Neo4j.
+
+    :return: the graph generation which is increased every time the scrapers write to Neo4j
+    :rtype: int
+    """
+    results, _ = db.cypher_query('MATCH {0} RETURN m.generation'.format(_generation_node))
+    if not results or results[0][0] is None:
+        return 0
+    return results[0][0]
+
+
+def bump_graph_generation():
+    """
+    Increase the graph generation marker in Neo4j so that the API caches are invalidated.
+
+    :return: the new graph generation
+    :rtype: int
+    """
+    results, _ = db.cypher_query(
+        'MERGE {0} SET m.generation = coalesce(m.generation, 0) + 1 RETURN m.generation'.format(
+            _generation_node))
+    log.debug('Bumped the graph generation to {0}'.format(results[0][0]))
+    return results[0][0]
+
+
+class ResponseCache(object):
+    """An in-process LRU cache of API responses with a TTL that is invalidated by the scrapers."""
+
+    def __init__(self, max_size, ttl, generation_check_interval,
+                 get_generation=get_graph_generation):
+        """
+        Initialize the ResponseCache class.
+
+        :param int max_size: the maximum total size in bytes of the cached values
+        :param int ttl: the number of seconds a response is cached for
+        :param int generation_check_interval: the number of seconds between the checks of the
+        graph generation
+        :kwarg function get_generation: the function that returns the current graph generation
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.generation_check_interval = generation_check_interval
+        self._get_generation = get_generation
+        self._entries = OrderedDict()
+        self._size = 0
+        self._generation = None
+        self._generation_checked_at = 0
+        self._lock = threading.Lock()
+
+    def _check_generation(self):
+        """Clear the cache if the graph generation changed since it was last checked."""
+        now = time.time()
+        if now - self._generation_checked_at < self.generation_check_interval:
+            return
+
+        generation = self._get_generation()
+        with self._lock:
+            self._generation_checked_at = now
+            if generation != self._generation:
+                self._entries.clear()
+                self._size = 0
+                self._generation = generation
+
+    def get(self, key):
+        """
+        Get a cached value.
+
+        :param tuple key: the key of the value
+        :return: the cached value or None if it's not cached or expired
+        """
+        self._check_generation()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires_at, size, value = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                self._size -= size
+                return None
+
+            # Mark the entry as the most recently used
+            del self._entries[key]
+            self._entries[key] = entry
+            return value
+
+    def set(self, key, value, size):
+        """
+        Cache a value and evict the least recently used values if the cache is full.
+
+        :param tuple key: the key of the value
+        :param value: the value to cache
+        :param int size: the size of the value in bytes
+        """
+        if size > self.max_size:
+            return
+
+        self._check_generation()
+        with self._lock:
+            if key in self._entries:
+                self._size -= self._entries.pop(key)[1]
+            self._entries[key] = (time.time() + self.ttl, size, value)
+            self._size += size
+            while self._size > self.max_size:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+
+    def update(self, key, value, size):
+        """
+        Replace a cached value without changing when it expires.
+
+        :param tuple key: the key of the value
+        :param value: the new value
+        :param int size: the size of the new value in bytes
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+
+            expires_at, old_size, _ = entry
+            self._entries[key] = (expires_at, size, value)
+            self._size += size - old_size
+            while self._size > self.max_size:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+
+    def clear(self):
+        """Remove all the cached values."""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+class SingleFlight(object):
+    """Coalesce identical calls that are made concurrently so that only one of them runs."""
+
+    def __init__(self, lock_dir=None):
+        """
+        Initialize the SingleFlight class.
+
+        :kwarg str lock_dir: the directory of the lock files used to coalesce the calls made by
+        other processes or None to only coalesce the calls made by the threads of this process
+        """
+        self.lock_dir = lock_dir
+        self._lock = threading.Lock()
+        # A mapping of the keys of the calls in progress to their _Call objects
+        self._calls = {}
+
+    def do(self, key, func):
+        """
+        Call a function unless a call with the same key is in progress, then wait for its result.
+
+        :param tuple key: the key that identifies identical calls
+        :param function func: the function to call; it must return a CachedResponse or None if the
+        result can't be shared
+        :return: the result of the function
+        :rtype: CachedResponse
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                # The error is copied so that the threads waiting for the call don't all add their
+                # frames to the traceback of the same exception
+                try:
+                    error = copy.copy(call.error)
+                except Exception:
+                    error = call.error
+                raise error
+            return call.result
+
+        try:
+            if self.lock_dir:
+                call.result = self._do_with_file_lock(key, func)
+            else:
+                call.result = func()
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def _do_with_file_lock(self, key, func):
+        """
+        Call a function unless another process called it while waiting for the lock of the key.
+
+        A process that has to wait for the lock leaves a marker file so that the process holding
+        the lock writes its result for it. The last process to release the lock removes the lock
+        and the result files, so the files of a key only exist while its calls are in progress.
+
+        :param tuple key: the key that identifies identical calls
+        :param function func: the function to call
+        :return: the result of the function
+        :rtype: CachedResponse
+        """
+        path = os.path.join(self.lock_dir, hashlib.sha1(repr(key).encode('utf-8')).hexdigest())
+        lock_path = '{0}.lock'.format(path)
+        wait_path = '{0}.{1}-{2}.wait'.format(path, os.getpid(), threading.current_thread().ident)
+        started_at = time.time()
+        waiting = False
+        while True:
+            lock_file = open(lock_path, 'a')
+            try:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except (IOError, OSError) as error:
+                    if error.errno not in (errno.EAGAIN, errno.EACCES):
+                        raise
+                    if not waiting:
+                        open(wait_path, 'a').close()
+                        waiting = True
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+                try:
+                    is_current = os.fstat(lock_file.fileno()).st_ino == os.stat(lock_path).st_ino
+                except OSError:
+                    is_current = False
+                if is_current:
+                    return self._do_locked(path, lock_path, wait_path if waiting else None,
+                                           started_at, func)
+                # The lock file was removed by the process that held the lock before this one, so
+                # the lock must be taken on the new lock file
+            finally:
+                # Closing the file releases the lock
+                lock_file.close()
+
+    def _do_locked(self, path, lock_path, wait_path, started_at, func):
+        """
+        Call a function while holding the lock of its key unless a waited for result is available.
+
+        :param str path: the path of the files of the key without an extension
+        :param str lock_path: the path of the lock file
+        :param str wait_path: the path of the marker file of this call or None if it didn't wait
+        :param float started_at: the time at which the call started
+        :param function func: the function to call
+        :return: the result of the function
+        :rtype: CachedResponse
+        """
+        result_path = '{0}.json'.format(path)
+        result = None
+        computed = False
+        try:
+            if wait_path:
+                # If the result was written after this call started, another process got the lock
+                # first and its result is used
+                try:
+                    if os.path.getmtime(result_path) >= started_at:
+                        with open(result_path, 'r') as result_file:
+                            result = _load_cached_response(result_file.read())
+                except (IOError, OSError, ValueError):
+                    pass
+
+            if result is None:
+                computed = True
+                result = func()
+            return result
+        finally:
+            if wait_path:
+                _remove_file(wait_path)
+            if _has_waiting_calls(path):
+                if computed and result is not None:
+                    temp_path = '{0}.{1}.tmp'.format(result_path, os.getpid())
+                    with open(temp_path, 'w') as result_file:
+                        result_file.write(_dump_cached_response(result))
+                    os.rename(temp_path, result_path)
+            else:
+                _remove_file(result_path)
+                _remove_file(lock_path)
+
+
+def _remove_file(path):
+    """
+    Remove a file if it exists.
+
+    :param str path: the path of the file
+    """
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _has_waiting_calls(path):
+    """
+    Check if calls of other processes are waiting for the lock of a key.
+
+    The marker files left by processes that no longer exist are removed.
+
+    :param str path: the path of the files of the key without an extension
+    :return: True if a call is waiting
+    :rtype: bool
+    """
+    waiting = False
+    for wait_path in glob.glob('{0}.*.wait'.format(path)):
+        pid = int(wait_path[len(path) + 1:].split('-', 1)[0])
+        try:
+            os.kill(pid, 0)
+        except OSError as error:
+            if error.errno == errno.ESRCH:
+                _remove_file(wait_path)
+                continue
+        waiting = True
+    return waiting
+
+
+class _Call(object):
+    """A call in progress of SingleFlight."""
+
+    def __init__(self):
+        """Initialize the _Call class."""
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def _dump_cached_response(cached):
+    """
+    Serialize a cached response so that it can be shared with other processes.
+
+    :param CachedResponse cached: the cached response
+    :return: the JSON of the cached response
+    :rtype: str
+    """
+    if cached.error is not None:
+        return json.dumps({'error': cached.error})
+    return json.dumps({
+        'error': None,
+        'status': cached.status,
+        'headers': cached.headers,
+        'body': base64.b64encode(cached.body).decode('ascii'),
+    })
+
+
+def _load_cached_response(data):
+    """
+    Deserialize a cached response shared by another process.
+
+    :param str data: the JSON of the cached response
+    :return: the cached response
+    :rtype: CachedResponse
+    :raises ValueError: if the data is not a valid cached response
+    """
+    try:
+        loaded = json.loads(data)
+        if loaded['error'] is not None:
+            return CachedResponse(loaded['error'], None, None, None, None)
+        return CachedResponse(
+            None, loaded['status'], tuple(tuple(header) for header in loaded['headers']),
+            base64.b64decode(loaded['body']), {})
+    except (KeyError, TypeError) as error:
+        raise ValueError(error)
+
+
+def init_cache(app):
+    """
+    Create the response cache and the request coalescing of the application from its configuration.
+
+    :param flask.Flask app: a Flask application object
+    """
+    if app.config.get('RESPONSE_CACHE_MAX_SIZE'):
+        app.extensions['response_cache'] = ResponseCache(
+            app.config['RESPONSE_CACHE_MAX_SIZE'], app.config['RESPONSE_CACHE_TTL'],
+            app.config['GRAPH_GENERATION_CHECK_INTERVAL'])
+    if app.config.get('COALESCE_REQUESTS'):
+        lock_dir = app.config.get('COALESCE_LOCK_DIR')
+        if lock_dir and not os.path.isdir(lock_dir):
+            os.makedirs(lock_dir, 0o700)
+        app.extensions['single_flight'] = SingleFlight(lock_dir)
+
+
+def _get_cached_response_size(key, cached):
+    """
+    Get the approximate memory used by a cached response.
+
+    :param tuple key: the key of the cached response
+    :param CachedResponse cached: the cached response
+    :return: the size in bytes
+    :rtype: int
+    """
+    # The size of the key is included so that cached errors also count toward the limit
+    size = len(repr(key))
+    if cached.error is not None:
+        size += len(cached.error)
+    if cached.body is not None:
+        size += len(cached.body)
+        size += sum(len(body) for body in cached.compressed_bodies.values())
+    return size
+
+
+def cached_response(func):
+    """
+    Cache the responses of the decorated view function, including NotFound errors.
+
+    The responses are cached by endpoint, view arguments, query parameters and the response format
+    negotiated with the Accept header. Identical requests
+    made while the response is generated wait for it instead of generating it again. Streamed
+    responses aren't cached nor shared.
+
+    :param function func: the view function to decorate
+    :return: the decorated function
+    :rtype: function
+    """
+    @functools.wraps(func)
+    def _wrapper(*args, **kwargs):
+        cache = current_app.extensions.get('response_cache')
+        single_flight = current_app.extensions.get('single_flight')
+        if cache is None and single_flight is None:
+            return func(*args, **kwargs)
+
+        key = (request.endpoint, tuple(sorted(request.view_args.items())),
+               tuple(sorted(request.args.items(multi=True))), get_response_mimetype())
+        cached = None
+        if cache is not None:
+            cached = cache.get(key)
+
+        if cached is None:
+            streamed_responses = []
+
+            def _get_cached_response():
+                try:
+                    response = func(*args, **kwargs)
+                except NotFound as error:
+                    rv = CachedResponse(error.description, None, None, None, None)
+                else:
+                    if response.is_streamed:
+                        streamed_responses.append(response)
+                        return None
+                    if response.status_code == 200:
+                        # Compute the ETag once instead of on every cache hit
+                        response.add_etag()
+                    rv = CachedResponse(
+                        None, response.status_code, tuple(response.headers.items()),
+                        response.get_data(), {})
+
+                if cache is not None:
+                    cache.set(key, rv, _get_cached_response_size(key, rv))
+                return rv
+
+            if single_flight is not None:
+                cached = single_flight.do(key, _get_cached_response)
+            else:
+                cached = _get_cached_response()
+
+            if streamed_responses:
+                return streamed_responses[0]
+            elif cached is None:
+                # The response of the identical request was streamed, so it couldn't be shared
+                return func(*args, **kwargs)
+
+        if cached.error is not None:
+            raise NotFound(cached.error)
+
+        response = Response(cached.body, status=cached.status, headers=list(cached.headers))
+        encoding = None
+        if cached.status == 200:
+            if is_compressible(len(cached.body)):
+                response.vary.add('Accept-Encoding')
+            encoding = get_response_encoding(len(cached.body))
+        if encoding:
+            compressed_body = cached.compressed_bodies.get(encoding)
+            if compressed_body is None:
+                # Store the compressed body so that it's not compressed again on every cache hit
+                compressed_body = compress(cached.body, encoding)
+                cached.compressed_bodies[encoding] = compressed_body
+                if cache is not None:
+                    cache.update(key, cached, _get_cached_response_size(key, cached))
+            set_compressed_data(response, compressed_body, encoding)
+        return response
+
+    return _wrapper
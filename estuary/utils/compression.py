@@ -0,0 +1,70 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+import gzip
+import io
+import zlib
+
+from flask import current_app, request
+
+
+def is_compressible(size):
+    """
+    Determine if a response body is compressed when the client accepts a compressed response.
+
+    :param int size: the size of the uncompressed response body in bytes
+    :return: a boolean that determines if the response body is compressible
+    :rtype: bool
+    """
+    return bool(current_app.config['COMPRESSION_LEVEL']) and \
+        size >= current_app.config['COMPRESSION_MIN_SIZE']
+
+
+def get_response_encoding(size):
+    """
+    Get the content encoding to compress a response body with based on the Accept-Encoding header.
+
+    :param int size: the size of the uncompressed response body in bytes
+    :return: "gzip", "deflate" or None if the response shouldn't be compressed
+    :rtype: str
+    """
+    if not is_compressible(size):
+        return None
+    return request.accept_encodings.best_match(['gzip', 'deflate'])
+
+
+def compress(data, encoding):
+    """
+    Compress a response body.
+
+    :param bytes data: the response body to compress
+    :param str encoding: the content encoding to use, either "gzip" or "deflate"
+    :return: the compressed response body
+    :rtype: bytes
+    """
+    level = current_app.config['COMPRESSION_LEVEL']
+    if encoding == 'deflate':
+        return zlib.compress(data, level)
+
+    buf = io.BytesIO()
+    # The modification time is left out so that the same body is always compressed the same way
+    with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=level, mtime=0) as gzip_file:
+        gzip_file.write(data)
+    return buf.getvalue()
+
+
+def set_compressed_data(response, data, encoding):
+    """
+    Replace the body of a response with its compressed version.
+
+    :param flask.Response response: the response to modify
+    :param bytes data: the compressed response body
+    :param str encoding: the content encoding of the compressed response body
+    """
+    response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    etag, _ = response.get_etag()
+    if etag:
+        # Each representation of the resource must have its own strong ETag
+        response.set_etag('{0}-{1}'.format(etag, encoding))
@@ -1,14 +1,18 @@
 # SPDX-License-Identifier: GPL-3.0+
 
 from __future__ import unicode_literals
+import base64
+import binascii
 import re
 from datetime import datetime
-from six import text_type
+from types import GeneratorType
 
-from neomodel import UniqueIdProperty, db
+from neomodel import db
+from six import text_type, iteritems
 
 from estuary import log
 from estuary.error import ValidationError
+from estuary.utils.serialization import json_dumps
 
 
 def timestamp_to_datetime(timestamp):
@@ -68,12 +72,132 @@ def str_to_bool(item):
         return False
 
 
-def inflate_node(result):
+def str_to_int(item, name, min_value=0, max_value=None):
     """
-    Inflate a Neo4j result to a neomodel model object.
+    Convert a query parameter to an integer within a range.
+
+    :param str item: string to parse
+    :param str name: the name of the query parameter used in the error message
+    :kwarg int min_value: the minimum value allowed
+    :kwarg int max_value: the maximum value allowed or None if there is no maximum
+    :return: an integer equivalent
+    :rtype: int
+    :raises ValidationError: if the string isn't an integer within the range
+    """
+    if max_value is None:
+        error_msg = 'The {0} must be an integer greater than or equal to {1}'.format(
+            name, min_value)
+    else:
+        error_msg = 'The {0} must be an integer between {1} and {2}'.format(
+            name, min_value, max_value)
+
+    try:
+        value = int(item)
+    except (TypeError, ValueError):
+        raise ValidationError(error_msg)
+
+    if value < min_value or (max_value is not None and value > max_value):
+        raise ValidationError(error_msg)
+    return value
+
+
+def str_to_set(item, name, choices):
+    """
+    Convert a comma-separated query parameter to a set of values from a list of choices.
+
+    :param str item: string to parse
+    :param str name: the name of the query parameter used in the error message
+    :param choices: the values allowed
+    :return: the set of values, which is empty if the string is empty
+    :rtype: set
+    :raises ValidationError: if a value isn't one of the choices
+    """
+    values = set(value.strip() for value in item.split(',') if value.strip())
+    invalid_values = values - set(choices)
+    if invalid_values:
+        raise ValidationError('The {0} "{1}" are invalid. Choose from the following: {2}.'.format(
+            name, ', '.join(sorted(invalid_values)), join_choices(choices)))
+    return values
+
+
+def join_choices(choices):
+    """
+    Join the values allowed by a parameter to list them in an error message.
+
+    :param choices: the values allowed
+    :return: the sorted values in the "a, b, and c" format
+    :rtype: str
+    """
+    choices = sorted(choices)
+    if len(choices) == 1:
+        return choices[0]
+    return '{0}, and {1}'.format(', '.join(choices[:-1]), choices[-1])
+
+
+def encode_cursor(node_id):
+    """
+    Encode the internal Neo4j ID of a node to an opaque pagination cursor.
+
+    :param int node_id: the internal Neo4j ID of the last node of a page
+    :return: the cursor of the next page
+    :rtype: str
+    """
+    return base64.urlsafe_b64encode(text_type(node_id).encode('ascii')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    Decode a pagination cursor created by encode_cursor.
+
+    :param str cursor: the cursor of a page
+    :return: the internal Neo4j ID of the last node of the previous page
+    :rtype: int
+    :raises ValidationError: if the cursor is invalid
+    """
+    try:
+        return int(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (TypeError, ValueError, UnicodeError, binascii.Error):
+        raise ValidationError('The cursor is invalid')
+
+
+def iter_json(obj, depth=1):
+    """
+    Encode an object to JSON in chunks so that it can be streamed.
+
+    :param obj: the object to encode; lists may also be passed as generators
+    :kwarg int depth: how many levels of dictionaries and lists are split into separate chunks;
+    anything deeper is encoded in a single chunk
+    :return: a generator of bytes which together are the JSON encoding of the object in UTF-8
+    :rtype: generator
+    """
+    if depth > 0 and isinstance(obj, dict):
+        yield b'{'
+        for index, (key, value) in enumerate(sorted(iteritems(obj))):
+            if index:
+                yield b','
+            yield json_dumps(key) + b':'
+            for chunk in iter_json(value, depth - 1):
+                yield chunk
+        yield b'}'
+    elif depth > 0 and isinstance(obj, (list, tuple, GeneratorType)):
+        yield b'['
+        for index, value in enumerate(obj):
+            if index:
+                yield b','
+            for chunk in iter_json(value, depth - 1):
+                yield chunk
+        yield b']'
+    else:
+        yield json_dumps(obj)
+
+
+def get_node_model(result):
+    """
+    Get the neomodel model class of a Neo4j result.
 
     :param neo4j.v1.types.Node result: a node from a cypher query result
-    :return: a model (EstuaryStructuredNode) object
+    :return: a model (EstuaryStructuredNode) class
+    :raises RuntimeError: if the label of the node can't be mapped back to a neomodel class
     """
     # To prevent a ciruclar import, this must be imported here
     from estuary.models import names_to_model
@@ -87,34 +211,40 @@ def inflate_node(result):
         result_label = list(result.labels)[0]
 
     if result_label in names_to_model:
-        node_model = names_to_model[result_label]
+        return names_to_model[result_label]
     else:
         # This should never happen unless Neo4j returns labels that aren't associated with
         # classes in all_models
         raise RuntimeError('A StructuredNode couldn\'t be found from the labels: {0}'.format(
             ', '.join(result.labels)))
 
-    return node_model.inflate(result)
 
+def inflate_node(result):
+    """
+    Inflate a Neo4j result to a neomodel model object.
 
-def get_neo4j_node(resource_name, uid):
+    :param neo4j.v1.types.Node result: a node from a cypher query result
+    :return: a model (EstuaryStructuredNode) object
     """
-    Get a Neo4j node based on a label and unique identifier.
+    return get_node_model(result).inflate(result)
+
+
+def get_resource_model_info(resource_name):
+    """
+    Get the information about the model of a resource that can be requested in the API.
 
     :param str resource_name: a neomodel model label
-    :param str uid: a string of the unique identifier defined in the neomodel model
-    :return: a neomodel model object
+    :return: the information about the model
+    :rtype: estuary.models.base.ModelInfo
     :raises ValidationError: if the requested resource doesn't exist or doesn't have a
     UniqueIdProperty
     """
     # To prevent a ciruclar import, we must import this here
-    from estuary.models import all_models
+    from estuary.models import all_models, model_registry
 
-    for model in all_models:
-        if model.__label__.lower() == resource_name.lower():
-            for _, prop_def in model.__all_properties__:
-                if isinstance(prop_def, UniqueIdProperty):
-                    return model.nodes.get_or_none(**{prop_def.name: uid})
+    model_info = model_registry.get(resource_name.lower())
+    if model_info and model_info.uid_name:
+        return model_info
 
     # Some models don't have unique ID's and those should be skipped
     models_wo_uid = ('DistGitRepo', 'DistGitBranch')
@@ -125,251 +255,49 @@ def get_neo4j_node(resource_name, uid):
     raise ValidationError(error)
 
 
-def create_node_subquery(node_label, uid_name=None, uid=None):
-    """
-    Build part of a raw cypher query for a node label.
-
-    :param str node_label: a Neo4j node label
-    :kwarg str uid_name: name of node's UniqueIdProperty
-    :kwarg str uid: value of node's UniqueIdProperty
-    :return: the node represented in raw cypher
-    :rtype: str
-    """
-    if uid_name and uid:
-        return '({0}:{1} {{{2}:"{3}"}})'.format(node_label.lower(), node_label,
-                                                uid_name.rstrip('_'), uid)
-    return '({0}:{1})'.format(node_label.lower(), node_label)
-
-
-def create_story_query(item, uid_name, uid, reverse=False, limit=False):
-    """
-    Create a raw cypher query for story of an artifact.
-
-    :param node item: a Neo4j node whose story is requested by the user
-    :param str uid_name: name of node's UniqueIdProperty
-    :param str uid: value of node's UniqueIdProperty
-    :param bool reverse: boolean value to specify the direction to proceed
-    from current node corresponding to the story_flow
-    :return: a string containing raw cypher query to retrieve the story of an artifact from Neo4j
-    :rtype: str
-    """
-    # To avoid circular imports
-    from estuary.models import story_flow_list
-
-    query = ''
-
-    if reverse is True:
-        rel_label = 'backward_relationship'
-        node_label = 'backward_label'
-    else:
-        rel_label = 'forward_relationship'
-        node_label = 'forward_label'
-
-    curr_node_label = item.__label__
-    if curr_node_label not in story_flow_list:
-        raise ValidationError('The story is not available for this kind of resource')
-
-    while True:
-        curr_node_info = story_flow(curr_node_label)
-        if not curr_node_info:
-            break
-
-        if curr_node_label == item.__label__:
-            query = """\
-                MATCH ({var}:{label} {{{uid_name}:"{uid}"}})
-                CALL apoc.path.expandConfig({var}, {{sequence:\'{label}
-                """.format(var=curr_node_label.lower(),
-                           label=curr_node_label,
-                           uid_name=uid_name.rstrip('_'),
-                           uid=uid)
-
-        query += ', {0}, {1}'.format(curr_node_info[rel_label], curr_node_info[node_label])
-
-        curr_node_label = curr_node_info[node_label]
-
-    if query:
-        query += """\
-            \', minLevel:1}) YIELD path
-            RETURN path
-            ORDER BY length(path) DESC
-            """
-
-    if query and limit:
-        query += ' LIMIT 1'
-
-    return query
-
-
-def get_corelated_nodes(results):
-    """
-    Create a raw cypher query for story nodes and get a count of the nodes co-related to them.
-
-    :param dict results: a dictionary containing story nodes
-    :return: a dictionary containing counts of all co-related nodes from Neo4j
-    :rtype: dict
-    """
-    # To avoid circular imports
-    from estuary.models.bugzilla import BugzillaBug
-
-    nodes_count_dict = {}
-    curr_label = BugzillaBug.__label__
-    last = False
-    while not last:
-        node_count = 0
-        next_node_info = story_flow(curr_label)
-        forward_label = next_node_info['forward_label']
-        if forward_label in results:
-            query = 'MATCH '
-            # Only grab the first element since there will only be one
-            next_node = results[forward_label][0]
-            forward_rel = next_node_info['forward_relationship'][:-1]
-            uid_name = story_flow(forward_label)['uid_name']
-            node_subquery = create_node_subquery(curr_label)
-            next_node_subquery = create_node_subquery(forward_label, uid_name, next_node[uid_name])
-            query += '{0}-[:{1}]-{2}\n'.format(node_subquery, forward_rel, next_node_subquery)
-            query += 'RETURN COUNT({0}) AS count'.format(curr_label.lower())
-            node_count = get_node_count(query)
-
-        backward_label = next_node_info['backward_label']
-        # If this evaluates to true, then this is the end of the story for the node, so we get
-        # the backwards related nodes (e.g. all the ContainerBuild that were triggered by a
-        # Freshmaker event)
-        if (not forward_label or forward_label not in results) and backward_label:
-            last = True
-            if backward_label not in results:
-                continue
-            query = 'MATCH '
-            backward_node = results[backward_label][0]
-            backward_rel = next_node_info['backward_relationship'][:-1]
-            uid_name = story_flow(backward_label)['uid_name']
-            node_subquery = create_node_subquery(backward_label, uid_name, backward_node[uid_name])
-            next_node_subquery = create_node_subquery(curr_label)
-            query += '{0}-[:{1}]-{2}\n'.format(node_subquery, backward_rel, next_node_subquery)
-            query += 'RETURN COUNT({0}) AS count'.format(curr_label.lower())
-            node_count = get_node_count(query)
-
-        # If there are related nodes, then there always be at least a value of one because it
-        # includes the node already in the story. This is why we subtract here.
-        if node_count > 0:
-            nodes_count_dict[curr_label] = node_count - 1
-
-        curr_label = forward_label
-
-    return nodes_count_dict
-
-
-def get_node_count(query):
+def get_neo4j_node(resource_name, uid):
     """
-    Query Neo4j and return the count of results.
+    Get a Neo4j node based on a label and unique identifier.
 
-    :param str query: raw cypher query
-    :return: a dictionary containing the results count received from Neo4j.
-    :rtype: int
+    :param str resource_name: a neomodel model label
+    :param str uid: a string of the unique identifier defined in the neomodel model
+    :return: a neomodel model object
+    :raises ValidationError: if the requested resource doesn't exist or doesn't have a
+    UniqueIdProperty
     """
-    results_dict = {}
-    results, _ = db.cypher_query(query)
+    model_info = get_resource_model_info(resource_name)
+    return model_info.model.nodes.get_or_none(**{model_info.uid_name: uid})
 
-    if not results:
-        return results_dict
 
-    return results[0][0]
-
-
-def _order_story_results(result):
+def get_neo4j_nodes(resource_name, uids):
     """
-    Order results to follow the story flow sequence.
+    Get several Neo4j nodes with the same label based on their unique identifiers in one query.
 
-    :param dict results: contains serialized results from Neo4j
-    :return: a dict containing results ordered in the story flow sequence
+    :param str resource_name: a neomodel model label
+    :param list uids: the strings of the unique identifiers defined in the neomodel model
+    :return: a dictionary with the unique identifiers as keys and the nodes from the cypher query
+    result as values; the nodes that don't exist are left out
     :rtype: dict
+    :raises ValidationError: if the requested resource doesn't exist or doesn't have a
+    UniqueIdProperty
     """
-    results = {'data': [], 'meta': {'related_nodes': {}}}
-    curr_label = 'BugzillaBug'
-    while curr_label:
-        results['meta']['related_nodes'][curr_label] = 0
-        if curr_label in result:
-            results['data'].append(result[curr_label][0])
-
-        curr_label = story_flow(curr_label)['forward_label']
+    model_info = get_resource_model_info(resource_name)
+    results, _ = db.cypher_query(
+        'UNWIND $uids AS uid MATCH (n:{0} {{{1}: uid}}) RETURN uid, n'.format(
+            model_info.model.__label__, model_info.uid_db_property),
+        {'uids': list(uids)})
+    return dict(results)
 
-    results['meta']['related_nodes'].update(get_corelated_nodes(result))
 
-    return results
-
-
-def story_flow(label):
+def get_neo4j_nodes_by_id(node_ids):
     """
-    Get the next/previous node in a story flow/pipeline path.
+    Get several Neo4j nodes based on their internal Neo4j IDs in one query.
 
-    :param str label: Neo4j node label
-    :return: uid and relationship information in both forward and backward directions
+    :param node_ids: the internal Neo4j IDs of the nodes
+    :return: a dictionary with the internal Neo4j IDs as keys and the nodes from the cypher query
+    result as values; the nodes that don't exist are left out
     :rtype: dict
     """
-    # To avoid circular imports
-    from estuary.models.koji import ContainerKojiBuild, KojiBuild
-    from estuary.models.bugzilla import BugzillaBug
-    from estuary.models.distgit import DistGitCommit
-    from estuary.models.errata import Advisory
-    from estuary.models.freshmaker import FreshmakerEvent
-
-    if not label:
-        return
-
-    if label == BugzillaBug.__label__:
-        return {
-            'uid_name': BugzillaBug.id_.db_property or BugzillaBug.id.name,
-            'forward_relationship': '{0}<'.format(
-                BugzillaBug.resolved_by_commits.definition['relation_type']),
-            'forward_label': DistGitCommit.__label__,
-            'backward_relationship': None,
-            'backward_label': None
-        }
-    elif label == DistGitCommit.__label__:
-        return {
-            'uid_name': DistGitCommit.hash_.db_property or DistGitCommit.hash.name,
-            'forward_relationship': '{0}<'.format(
-                DistGitCommit.koji_builds.definition['relation_type']),
-            'forward_label': KojiBuild.__label__,
-            'backward_relationship': '{0}>'.format(
-                DistGitCommit.resolved_bugs.definition['relation_type']),
-            'backward_label': BugzillaBug.__label__
-        }
-    elif label == KojiBuild.__label__:
-        return {
-            'uid_name': KojiBuild.id_.db_property or KojiBuild.id.name,
-            'forward_relationship': '{0}<'.format(KojiBuild.advisories.definition['relation_type']),
-            'forward_label': Advisory.__label__,
-            'backward_relationship': '{0}>'.format(KojiBuild.commit.definition['relation_type']),
-            'backward_label': DistGitCommit.__label__
-        }
-    elif label == Advisory.__label__:
-        return {
-            'uid_name': Advisory.id_.db_property or Advisory.id.name,
-            'forward_relationship': '{0}<'.format(
-                Advisory.triggered_freshmaker_event.definition['relation_type']),
-            'forward_label': FreshmakerEvent.__label__,
-            'backward_relationship': '{0}>'.format(
-                Advisory.attached_builds.definition['relation_type']),
-            'backward_label': KojiBuild.__label__
-        }
-    elif label == FreshmakerEvent.__label__:
-        return {
-            'uid_name': FreshmakerEvent.id_.db_property or FreshmakerEvent.id.name,
-            'forward_relationship': '{0}>'.format(
-                FreshmakerEvent.triggered_container_builds.definition['relation_type']),
-            'forward_label': ContainerKojiBuild.__label__,
-            'backward_relationship': '{0}>'.format(FreshmakerEvent.triggered_by_advisory
-                                                   .definition['relation_type']),
-            'backward_label': Advisory.__label__
-        }
-    elif label == ContainerKojiBuild.__label__:
-        return {
-            'uid_name': KojiBuild.id_.db_property or KojiBuild.id.name,
-            'forward_relationship': None,
-            'forward_label': None,
-            'backward_relationship': '{0}<'.format(
-                ContainerKojiBuild.triggered_by_freshmaker_event.definition['relation_type']),
-            'backward_label': FreshmakerEvent.__label__
-        }
-    else:
-        raise ValueError('The label should belong to a Neo4j node class')
+    results, _ = db.cypher_query(
+        'MATCH (n) WHERE id(n) IN $node_ids RETURN id(n), n', {'node_ids': list(node_ids)})
+    return dict(results)
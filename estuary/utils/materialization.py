@@ -0,0 +1,114 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+import time
+
+from neomodel import db
+
+from estuary import log
+from estuary.models import story_flow_list
+from estuary.models.koji import ContainerKojiBuild, KojiBuild
+from estuary.utils.cache import get_graph_generation
+from estuary.utils.serialization import json_dumps
+from estuary.utils.story import get_batch_stories, story_flow_table
+
+
+def get_story_key(label, uid):
+    """
+    Get the key of the materialized story of an artifact.
+
+    :param str label: the label of the artifact
+    :param str uid: the value of the UniqueIdProperty of the artifact
+    :return: the key of the EstuaryStory node
+    :rtype: str
+    """
+    return '{0}:{1}'.format(label, uid)
+
+
+def get_materialized_story(label, uid):
+    """
+    Get the materialized story of an artifact if it's up to date.
+
+    :param str label: the label of the artifact
+    :param str uid: the value of the UniqueIdProperty of the artifact
+    :return: the story encoded in JSON or None if it wasn't materialized or the graph changed since
+    :rtype: bytes
+    """
+    results, _ = db.cypher_query(
+        'MATCH (s:EstuaryStory {key: $key}) OPTIONAL MATCH (m:EstuaryMetadata {name: "graph"}) '
+        'RETURN s.document, s.generation = coalesce(m.generation, 0)',
+        {'key': get_story_key(label, uid)})
+    if not results or not results[0][1]:
+        return None
+    return results[0][0].encode('utf-8')
+
+
+def materialize_stories(labels=None, batch_size=500, time_limit=None):
+    """
+    Compute the stories of all the artifacts and store them encoded in JSON in EstuaryStory nodes.
+
+    The stories are stamped with the graph generation at the time the materialization started, so
+    they are only used by the API until a scraper writes to Neo4j again. The stories of the
+    artifacts that no longer exist are removed.
+
+    Since any change to the graph can change the stories of all the connected artifacts, every
+    story is computed again on each run. This costs about as much as requesting the story of every
+    artifact and each stored story is as large as the response. The time limit bounds this cost,
+    and the stories that aren't materialized in time are computed on request instead.
+
+    :kwarg list labels: the labels of the artifacts whose stories are materialized or None for all
+    the labels that have a story
+    :kwarg int batch_size: the number of stories computed and stored per query
+    :kwarg int time_limit: the number of seconds after which no more batches are started or None
+    for no limit
+    :return: the number of stories materialized
+    :rtype: int
+    """
+    generation = get_graph_generation()
+    started_at = time.time()
+    count = 0
+    timed_out = False
+    for label in labels or story_flow_list:
+        uid_name = story_flow_table[label].uid_name
+        condition = 'id(n) > $after_id'
+        if label == KojiBuild.__label__:
+            # ContainerKojiBuild nodes also have the KojiBuild label, but their stories are
+            # materialized with the ContainerKojiBuild label. Their stories as a KojiBuild are
+            # computed on request instead of being stored twice.
+            condition += ' AND NOT n:{0}'.format(ContainerKojiBuild.__label__)
+        after_id = -1
+        while not timed_out:
+            results, _ = db.cypher_query(
+                'MATCH (n:{0}) WHERE {1} RETURN id(n), n.{2} ORDER BY id(n) '
+                'LIMIT $limit'.format(label, condition, uid_name),
+                {'after_id': after_id, 'limit': batch_size})
+            if not results:
+                break
+            after_id = results[-1][0]
+
+            stories = get_batch_stories(label, [uid for _, uid in results])
+            db.cypher_query(
+                'UNWIND $documents AS document MERGE (s:EstuaryStory {key: document.key}) '
+                'SET s.document = document.document, s.generation = $generation',
+                {
+                    'documents': [
+                        {
+                            'key': get_story_key(label, uid),
+                            'document': json_dumps(story).decode('utf-8'),
+                        }
+                        for uid, story in stories.items()
+                    ],
+                    'generation': generation,
+                })
+            count += len(stories)
+            timed_out = time_limit is not None and time.time() - started_at >= time_limit
+        if timed_out:
+            log.warning('Stopped materializing the stories after {0} seconds'.format(time_limit))
+            break
+        log.debug('Materialized the stories of the {0} nodes'.format(label))
+
+    if labels is None:
+        db.cypher_query(
+            'MATCH (s:EstuaryStory) WHERE s.generation <> $generation DELETE s',
+            {'generation': generation})
+    return count
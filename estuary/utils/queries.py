@@ -0,0 +1,307 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+import functools
+
+from estuary.error import ValidationError
+
+# A mapping of the arguments a query builder was called with to the query template it returned.
+# The templates only depend on the model definitions, so they are built once per process and
+# Neo4j is able to reuse its cached query plans since the values are passed as parameters.
+_query_templates = {}
+
+
+def cached_template(func):
+    """
+    Cache the query template returned by the decorated query builder based on its arguments.
+
+    :param function func: the query builder to decorate
+    :return: the decorated function
+    :rtype: function
+    """
+    @functools.wraps(func)
+    def _wrapper(*args, **kwargs):
+        key = (func.__name__, args, tuple(sorted(kwargs.items())))
+        try:
+            return _query_templates[key]
+        except KeyError:
+            template = func(*args, **kwargs)
+            _query_templates[key] = template
+            return template
+
+    return _wrapper
+
+
+def create_node_subquery(node_label, uid_name=None, uid_param='uid'):
+    """
+    Build part of a raw cypher query for a node label.
+
+    :param str node_label: a Neo4j node label
+    :kwarg str uid_name: name of node's UniqueIdProperty
+    :kwarg str uid_param: name of the query parameter containing the node's UniqueIdProperty value
+    :return: the node represented in raw cypher
+    :rtype: str
+    """
+    if uid_name:
+        return '({0}:{1} {{{2}:${3}}})'.format(node_label.lower(), node_label,
+                                               uid_name.rstrip('_'), uid_param)
+    return '({0}:{1})'.format(node_label.lower(), node_label)
+
+
+@cached_template
+def create_story_query(label, reverse=False, limit=False, paths_limit=False):
+    """
+    Create a raw cypher query template for the story of an artifact.
+
+    The value of the artifact's UniqueIdProperty must be passed as the "uid" parameter.
+
+    :param str label: the label of the node whose story is requested by the user
+    :kwarg bool reverse: boolean value to specify the direction to proceed
+    from current node corresponding to the story_flow
+    :kwarg bool limit: only return the longest path
+    :kwarg bool paths_limit: only return the number of longest paths passed as the "limit"
+    parameter
+    :return: a string containing raw cypher query to retrieve the story of an artifact from Neo4j
+    :rtype: str
+    :raises ValidationError: if the story is not available for the label
+    """
+    # To avoid circular imports
+    from estuary.models import story_flow_list
+    from estuary.utils.story import story_flow
+
+    query = ''
+
+    if reverse is True:
+        rel_label = 'backward_relationship'
+        node_label = 'backward_label'
+    else:
+        rel_label = 'forward_relationship'
+        node_label = 'forward_label'
+
+    curr_node_label = label
+    if curr_node_label not in story_flow_list:
+        raise ValidationError('The story is not available for this kind of resource')
+
+    while True:
+        curr_node_info = story_flow(curr_node_label)
+        if not curr_node_info:
+            break
+
+        if curr_node_label == label:
+            query = """\
+                MATCH {node}
+                CALL apoc.path.expandConfig({var}, {{sequence:\'{label}
+                """.format(node=create_node_subquery(label, curr_node_info.uid_name),
+                           var=label.lower(),
+                           label=label)
+
+        query += ', {0}, {1}'.format(getattr(curr_node_info, rel_label),
+                                     getattr(curr_node_info, node_label))
+
+        curr_node_label = getattr(curr_node_info, node_label)
+
+    if query:
+        query += """\
+            \', minLevel:1}) YIELD path
+            RETURN path
+            ORDER BY length(path) DESC
+            """
+
+    if query and limit:
+        query += ' LIMIT 1'
+    elif query and paths_limit:
+        query += ' LIMIT $limit'
+
+    return query
+
+
+def _create_story_paths_subquery(label, reverse=False):
+    """
+    Create a raw cypher expression that evaluates to the longest story path of a node.
+
+    The expression relies on the node being bound to the "item" variable.
+
+    :param str label: the label of the node whose story is requested
+    :kwarg bool reverse: boolean value to specify the direction to proceed
+    from current node corresponding to the story_flow
+    :return: a string containing the raw cypher expression
+    :rtype: str
+    """
+    # To avoid circular imports
+    from estuary.utils.story import story_flow_table
+
+    if reverse is True:
+        pattern_name = 'backward_pattern'
+        node_label = 'backward_label'
+    else:
+        pattern_name = 'forward_pattern'
+        node_label = 'forward_label'
+
+    patterns = []
+    pattern = '(item)'
+    curr_node_info = story_flow_table[label]
+    while getattr(curr_node_info, node_label):
+        pattern += getattr(curr_node_info, pattern_name)
+        patterns.append(pattern)
+        curr_node_info = story_flow_table[getattr(curr_node_info, node_label)]
+
+    if not patterns:
+        return 'null'
+
+    # The paths are listed from the longest to the shortest so that coalesce returns the
+    # longest path that exists
+    return 'coalesce({0})'.format(', '.join(
+        'head([p = {0} | p])'.format(pattern) for pattern in reversed(patterns)))
+
+
+def _create_story_count_expression(relationship, related_label):
+    """
+    Create a raw cypher expression that counts the neighbors of the node "n" in the story.
+
+    :param str relationship: the relationship type between the node and its neighbors
+    :param str related_label: the label of the neighbors
+    :return: a string containing the raw cypher expression
+    :rtype: str
+    """
+    return 'size((n)-[:{0}]-(:{1}))'.format(relationship, related_label)
+
+
+def _create_story_counts_set_clause(label):
+    """
+    Create a raw cypher SET clause that updates the story counters of the node "n".
+
+    :param str label: the label of the node in the story flow
+    :return: a string containing the raw cypher clause
+    :rtype: str
+    """
+    # To avoid circular imports
+    from estuary.utils.story import story_flow_table
+
+    node_info = story_flow_table[label]
+    assignments = []
+    for rel_type, node_label, count_property in (
+            (node_info.backward_rel_type, node_info.backward_label,
+             node_info.backward_count_property),
+            (node_info.forward_rel_type, node_info.forward_label,
+             node_info.forward_count_property)):
+        if node_label:
+            assignments.append('n.{0} = {1}'.format(
+                count_property, _create_story_count_expression(rel_type, node_label)))
+    return 'SET {0}'.format(', '.join(assignments))
+
+
+@cached_template
+def create_story_counts_query(label=None):
+    """
+    Create a raw cypher query template that updates the story counters of nodes.
+
+    Without a label, the internal Neo4j IDs of the nodes must be passed as the "node_ids"
+    parameter and the counters of all the story stages of their labels are updated. With a label,
+    only the counters of its stage are updated on the first nodes with the label, in the order of
+    their internal Neo4j ID, after the "after_id" parameter and up to the "limit" parameter. The
+    query then returns the greatest internal Neo4j ID of the updated nodes and their number.
+
+    :kwarg str label: the label of the nodes to update in batches
+    :return: a string containing the raw cypher query
+    :rtype: str
+    :raises ValidationError: if the label isn't part of the story flow
+    """
+    # To avoid circular imports
+    from estuary.models import story_flow_list
+
+    if label is not None:
+        if label not in story_flow_list:
+            raise ValidationError('The story is not available for this kind of resource')
+        return ('MATCH (n:{0}) WHERE id(n) > $after_id WITH n ORDER BY id(n) LIMIT $limit {1} '
+                'RETURN max(id(n)), count(n)'.format(label, _create_story_counts_set_clause(label)))
+
+    # A node can have several labels of the story flow, such as a ContainerKojiBuild node which
+    # also has the KojiBuild label
+    return 'MATCH (n) WHERE id(n) IN $node_ids {0}'.format(' '.join(
+        'FOREACH (_ IN CASE WHEN n:{0} THEN [1] ELSE [] END | {1})'.format(
+            curr_label, _create_story_counts_set_clause(curr_label))
+        for curr_label in story_flow_list))
+
+
+@cached_template
+def create_full_story_query(label, batch=False):
+    """
+    Create a raw cypher query template for the story of an artifact and its related node counts.
+
+    The value of the artifact's UniqueIdProperty must be passed as the "uid" parameter. The query
+    returns a single row containing the longest forward path, the longest backward path and, for
+    every node on these paths, a list in the format of
+    [label, uid, backward_siblings_count, forward_siblings_count].
+
+    :param str label: the label of the node whose story is requested by the user
+    :kwarg bool batch: get the stories of several artifacts instead; the values of their
+    UniqueIdProperty must be passed as the "uids" parameter and each row starts with the value of
+    the UniqueIdProperty and the artifact's node
+    :return: a string containing raw cypher query to retrieve the story of an artifact from Neo4j
+    :rtype: str
+    :raises ValidationError: if the story is not available for the label
+    """
+    # To avoid circular imports
+    from estuary.models import story_flow_list
+    from estuary.utils.story import story_flow_table
+
+    if label not in story_flow_list:
+        raise ValidationError('The story is not available for this kind of resource')
+
+    # ContainerKojiBuild nodes also have the KojiBuild label, so they must be matched first
+    sibling_counts_cases = []
+    for curr_label in reversed(story_flow_list):
+        node_info = story_flow_table[curr_label]
+        counts = []
+        for rel_type, node_label, count_property in (
+                (node_info.backward_rel_type, node_info.backward_label,
+                 node_info.backward_count_property),
+                (node_info.forward_rel_type, node_info.forward_label,
+                 node_info.forward_count_property)):
+            if node_label:
+                # The relationships are only counted if the story counter of the node isn't set
+                counts.append('coalesce(n.{0}, {1})'.format(
+                    count_property, _create_story_count_expression(rel_type, node_label)))
+            else:
+                counts.append('0')
+        sibling_counts_cases.append("WHEN n:{0} THEN ['{0}', n.{1}, {2}, {3}]".format(
+            curr_label, node_info.uid_name, counts[0], counts[1]))
+
+    if batch:
+        match = 'UNWIND $uids AS uid MATCH (item:{0} {{{1}:uid}})'
+        # The variables that are carried through the WITH clauses to be returned
+        carried = 'uid, item, '
+    else:
+        match = 'MATCH (item:{0} {{{1}:$uid}})'
+        carried = ''
+
+    return """\
+        {match}
+        WITH {carried}{forward_path} AS forward_path, {backward_path} AS backward_path
+        WITH {carried}forward_path, backward_path,
+            coalesce(nodes(forward_path), []) + coalesce(nodes(backward_path), []) AS story_nodes
+        RETURN {carried}forward_path, backward_path, [n IN story_nodes | CASE {cases} END]
+        """.format(match=match.format(label, story_flow_table[label].uid_name),
+                   carried=carried,
+                   forward_path=_create_story_paths_subquery(label),
+                   backward_path=_create_story_paths_subquery(label, reverse=True),
+                   cases=' '.join(sibling_counts_cases))
+
+
+@cached_template
+def create_node_count_query(node_label, relationship, related_label, related_uid_name):
+    """
+    Create a raw cypher query template that counts the nodes related to a node.
+
+    The value of the related node's UniqueIdProperty must be passed as the "uid" parameter.
+
+    :param str node_label: the label of the nodes to count
+    :param str relationship: the relationship type between the counted nodes and the related node
+    :param str related_label: the label of the related node
+    :param str related_uid_name: name of the related node's UniqueIdProperty
+    :return: a string containing raw cypher query to count the nodes
+    :rtype: str
+    """
+    return 'MATCH {0}-[:{1}]-{2}\nRETURN COUNT({3}) AS count'.format(
+        create_node_subquery(node_label), relationship,
+        create_node_subquery(related_label, related_uid_name), node_label.lower())
@@ -0,0 +1,138 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+from collections import namedtuple
+import re
+
+from neo4j.exceptions import CypherError
+from neomodel import db
+
+from estuary import log
+
+
+UniqueConstraint = namedtuple('UniqueConstraint', ['label', 'property'])
+Index = namedtuple('Index', ['label', 'properties'])
+
+# The nodes that aren't models but are looked up by the API, in the format of (label, property)
+_metadata_unique_constraints = (
+    # The node that stores the graph generation used to invalidate the API caches
+    ('EstuaryMetadata', 'name'),
+    # The nodes that store the materialized stories served by the API
+    ('EstuaryStory', 'key'),
+)
+
+_constraint_regex = re.compile(
+    r'^CONSTRAINT ON \( *`?\w+`?:`?(?P<label>\w+)`? *\) ASSERT `?\w+`?\.`?(?P<property>\w+)`? '
+    r'IS UNIQUE$')
+_index_regex = re.compile(r'^INDEX ON :`?(?P<label>\w+)`?\((?P<properties>[^)]+)\)$')
+
+
+def get_required_schema():
+    """
+    Get the uniqueness constraints and the indexes that the queries rely on.
+
+    They are derived from the models. Every UniqueIdProperty and unique_index property gets a
+    uniqueness constraint and every index property gets an index. The models without a unique
+    property get a composite index on their required properties since neomodel's get_or_create
+    and create_or_update merge the nodes on them.
+
+    :return: a set of UniqueConstraint and Index tuples
+    :rtype: set
+    """
+    # To avoid circular imports
+    from estuary.models import all_models
+
+    schema = set(
+        UniqueConstraint(label, property_name)
+        for label, property_name in _metadata_unique_constraints)
+    for model in all_models:
+        properties = model.defined_properties(aliases=False, rels=False)
+        has_unique_property = False
+        for property_name, prop_def in properties.items():
+            db_property = prop_def.db_property or property_name
+            if prop_def.unique_index:
+                has_unique_property = True
+                schema.add(UniqueConstraint(model.__label__, db_property))
+            elif prop_def.index:
+                schema.add(Index(model.__label__, (db_property,)))
+
+        if not has_unique_property and model.__required_properties__:
+            schema.add(Index(model.__label__, tuple(
+                properties[property_name].db_property or property_name
+                for property_name in model.__required_properties__)))
+
+    return schema
+
+
+def get_existing_schema():
+    """
+    Get the uniqueness constraints and the indexes that exist in Neo4j.
+
+    The indexes that back the uniqueness constraints are included as well.
+
+    :return: a set of UniqueConstraint and Index tuples
+    :rtype: set
+    """
+    schema = set()
+    results, _ = db.cypher_query('CALL db.constraints()')
+    for description, in results:
+        match = _constraint_regex.match(description)
+        if match:
+            schema.add(UniqueConstraint(match.group('label'), match.group('property')))
+
+    results, _ = db.cypher_query('CALL db.indexes() YIELD description RETURN description')
+    for description, in results:
+        match = _index_regex.match(description)
+        if match:
+            properties = tuple(
+                prop.strip().strip('`') for prop in match.group('properties').split(','))
+            schema.add(Index(match.group('label'), properties))
+
+    return schema
+
+
+def get_missing_schema():
+    """
+    Get the uniqueness constraints and the indexes that the queries rely on but don't exist.
+
+    :return: a sorted list of UniqueConstraint and Index tuples
+    :rtype: list
+    """
+    return sorted(get_required_schema() - get_existing_schema(), key=get_schema_query)
+
+
+def get_schema_query(item):
+    """
+    Get the query that creates a uniqueness constraint or an index.
+
+    :param tuple item: a UniqueConstraint or Index tuple
+    :return: the cypher query
+    :rtype: str
+    """
+    if isinstance(item, UniqueConstraint):
+        return 'CREATE CONSTRAINT ON (n:{0}) ASSERT n.{1} IS UNIQUE'.format(
+            item.label, item.property)
+    return 'CREATE INDEX ON :{0}({1})'.format(item.label, ', '.join(item.properties))
+
+
+def install_schema():
+    """
+    Create the uniqueness constraints and the indexes that the queries rely on but don't exist.
+
+    :return: a tuple of the list of the created UniqueConstraint and Index tuples and the list of
+    the ones that couldn't be created, such as a uniqueness constraint on duplicated values
+    :rtype: tuple
+    """
+    created = []
+    failed = []
+    for item in get_missing_schema():
+        query = get_schema_query(item)
+        try:
+            db.cypher_query(query)
+        except CypherError as error:
+            log.error('Failed to run "{0}": {1}'.format(query, error))
+            failed.append(item)
+        else:
+            log.info('Ran "{0}"'.format(query))
+            created.append(item)
+    return created, failed
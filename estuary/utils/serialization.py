@@ -0,0 +1,152 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+from datetime import date
+import json
+
+from flask import current_app, request, Response
+import pytz
+from six import text_type
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+
+JSON_MIMETYPE = 'application/json'
+MSGPACK_MIMETYPE = 'application/msgpack'
+CBOR_MIMETYPE = 'application/cbor'
+
+
+def _encode_default(obj):
+    """
+    Encode the values that the JSON backend doesn't support natively.
+
+    :param obj: the value to encode
+    :return: a value that the JSON backend supports
+    :raises TypeError: if the value can't be encoded
+    """
+    # This also covers datetime objects since datetime is a subclass of date
+    if isinstance(obj, date):
+        return obj.isoformat()
+    raise TypeError('{0!r} is not JSON serializable'.format(obj))
+
+
+def json_dumps(obj, indent=False):
+    """
+    Encode an object to JSON with the fastest JSON backend that is installed.
+
+    orjson is used when it's installed and the standard library otherwise. The keys of dictionaries
+    are sorted and datetime objects are encoded in the ISO 8601 format by both backends.
+
+    :param obj: the object to encode
+    :kwarg bool indent: indent the JSON for readability
+    :return: the JSON encoded in UTF-8
+    :rtype: bytes
+    """
+    if orjson is not None:
+        option = orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=_encode_default, option=option)
+
+    if indent:
+        rv = json.dumps(obj, default=_encode_default, sort_keys=True, ensure_ascii=False,
+                        indent=2, separators=(',', ': '))
+    else:
+        rv = json.dumps(obj, default=_encode_default, sort_keys=True, ensure_ascii=False,
+                        separators=(',', ':'))
+    if isinstance(rv, text_type):
+        rv = rv.encode('utf-8')
+    return rv
+
+
+def json_response(obj, status=200):
+    """
+    Create a JSON response, which is a faster replacement of flask.jsonify.
+
+    :param obj: the object to encode
+    :kwarg int status: the HTTP status code of the response
+    :return: a Flask JSON response
+    :rtype: flask.Response
+    """
+    # Like flask.jsonify, the JSON is indented when the application is in debug mode
+    return Response(json_dumps(obj, indent=current_app.debug), status=status,
+                    mimetype='application/json')
+
+
+def msgpack_dumps(obj):
+    """
+    Encode an object to MessagePack.
+
+    Like with JSON, datetime objects are encoded as strings in the ISO 8601 format.
+
+    :param obj: the object to encode
+    :return: the MessagePack data
+    :rtype: bytes
+    """
+    return msgpack.packb(obj, default=_encode_default, use_bin_type=True)
+
+
+def cbor_dumps(obj):
+    """
+    Encode an object to CBOR.
+
+    The keys of dictionaries are sorted and datetime objects are encoded with the standard CBOR
+    date/time tag. Naive datetime objects are considered to be in UTC.
+
+    :param obj: the object to encode
+    :return: the CBOR data
+    :rtype: bytes
+    """
+    return cbor2.dumps(obj, timezone=pytz.utc, canonical=True)
+
+
+def get_response_mimetype():
+    """
+    Get the format to encode the response in based on the Accept header.
+
+    MessagePack and CBOR are only offered when their library is installed. JSON is the default
+    when the client accepts any format or none of the supported formats.
+
+    :return: the mimetype of the format
+    :rtype: str
+    """
+    mimetypes = [JSON_MIMETYPE]
+    if msgpack is not None:
+        # application/x-msgpack is still commonly used since MessagePack has no registered mimetype
+        mimetypes.extend([MSGPACK_MIMETYPE, 'application/x-msgpack'])
+    if cbor2 is not None:
+        mimetypes.append(CBOR_MIMETYPE)
+    return request.accept_mimetypes.best_match(mimetypes, default=JSON_MIMETYPE)
+
+
+def negotiated_response(obj, status=200):
+    """
+    Create a response in the format requested by the Accept header, which is JSON by default.
+
+    :param obj: the object to encode
+    :kwarg int status: the HTTP status code of the response
+    :return: a Flask response
+    :rtype: flask.Response
+    """
+    mimetype = get_response_mimetype()
+    if mimetype == JSON_MIMETYPE:
+        response = json_response(obj, status=status)
+    elif mimetype == CBOR_MIMETYPE:
+        response = Response(cbor_dumps(obj), status=status, mimetype=mimetype)
+    else:
+        response = Response(msgpack_dumps(obj), status=status, mimetype=mimetype)
+    response.vary.add('Accept')
+    return response
@@ -0,0 +1,417 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+from array import array
+from bisect import bisect_left
+import threading
+import time
+
+from flask import current_app
+from neomodel import db
+
+from estuary import log
+from estuary.models import story_flow_list
+from estuary.utils.cache import get_graph_generation
+from estuary.utils.general import get_neo4j_nodes_by_id
+from estuary.utils.story import story_flow_table
+
+
+def _get_relationship_query(label, relationship, related_label):
+    """
+    Create a raw cypher query that returns the internal IDs of the nodes a relationship connects.
+
+    :param str label: the label of the nodes at the start of the story relationship
+    :param str relationship: an APOC relationship filter such as "RESOLVED<"
+    :param str related_label: the label of the nodes at the end of the story relationship
+    :return: the raw cypher query
+    :rtype: str
+    """
+    if relationship.endswith('<'):
+        rel_pattern = '<-[:{0}]-'
+    else:
+        rel_pattern = '-[:{0}]->'
+    return 'MATCH (a:{0}){1}(b:{2}) RETURN id(a), id(b)'.format(
+        label, rel_pattern.format(relationship[:-1]), related_label)
+
+
+def _create_csr(edges, num_nodes):
+    """
+    Create the compressed sparse row representation of the edges between two layers of nodes.
+
+    :param list edges: tuples of the index of the source node and the index of the target node
+    :param int num_nodes: the number of nodes in the source layer
+    :return: a tuple of the offsets, where the targets of the node at index i are at the indexes
+    offsets[i] to offsets[i + 1] of the targets, and the targets in ascending order per node
+    :rtype: tuple
+    """
+    edges = sorted(edges)
+    offsets = array('l', [0]) * (num_nodes + 1)
+    for source, _ in edges:
+        offsets[source + 1] += 1
+    for index in range(num_nodes):
+        offsets[index + 1] += offsets[index]
+    targets = array('l', (target for _, target in edges))
+    return offsets, targets
+
+
+class StorySnapshot(object):
+    """
+    An in-memory snapshot of the relationships that the stories follow.
+
+    Every stage of the story flow is a layer of nodes, which are stored as a sorted array of their
+    internal Neo4j IDs. The relationships between two consecutive layers are stored in the
+    compressed sparse row format over the indexes of the nodes in their layer in both directions,
+    so getting the neighbors of a node in a story is two array lookups. The node properties aren't
+    part of the snapshot and must be fetched from Neo4j.
+    """
+
+    def __init__(self, generation, layers, relationships):
+        """
+        Initialize the StorySnapshot class.
+
+        :param int generation: the graph generation the snapshot was loaded at
+        :param dict layers: a mapping of the labels in the story flow to the internal Neo4j IDs of
+        their nodes
+        :param dict relationships: a mapping of the labels in the story flow to the tuples of the
+        internal Neo4j IDs of the nodes connected by the relationship to the next stage
+        """
+        self.generation = generation
+        # The labels are in the order of the story flow, so the next stage is the next layer
+        self._labels = list(story_flow_list)
+        self._layers = [array('l', sorted(set(layers.get(label, ())))) for label in self._labels]
+        self._forward = [None] * len(self._labels)
+        self._backward = [None] * len(self._labels)
+        # The mappings of the internal Neo4j IDs to the indexes are only kept while building
+        indexes = [{node_id: index for index, node_id in enumerate(nodes)}
+                   for nodes in self._layers]
+        for index, label in enumerate(self._labels[:-1]):
+            sources = indexes[index]
+            targets = indexes[index + 1]
+            # The relationships of the nodes created after their layer was loaded are skipped
+            edges = [
+                (sources[node_id], targets[related_node_id])
+                for node_id, related_node_id in relationships.get(label, ())
+                if node_id in sources and related_node_id in targets
+            ]
+            self._forward[index] = _create_csr(edges, len(sources))
+            self._backward[index + 1] = _create_csr(
+                [(target, source) for source, target in edges], len(targets))
+
+    @classmethod
+    def load(cls, get_generation=get_graph_generation):
+        """
+        Load the snapshot from Neo4j.
+
+        :kwarg function get_generation: the function that returns the current graph generation
+        :return: the snapshot of the current graph
+        :rtype: StorySnapshot
+        """
+        generation = get_generation()
+        layers = {}
+        relationships = {}
+        for label in story_flow_list:
+            results, _ = db.cypher_query('MATCH (n:{0}) RETURN id(n)'.format(label))
+            layers[label] = [node_id for node_id, in results]
+            stage = story_flow_table[label]
+            if stage.forward_label:
+                results, _ = db.cypher_query(_get_relationship_query(
+                    label, stage.forward_relationship, stage.forward_label))
+                relationships[label] = [tuple(row) for row in results]
+
+        # If the scrapers changed the graph while it was loaded, the snapshot is already stale
+        if get_generation() != generation:
+            generation = None
+        log.debug('Loaded the story snapshot of the graph generation {0}'.format(generation))
+        return cls(generation, layers, relationships)
+
+    def _get_index(self, layer, node_id):
+        """
+        Get the index of a node in a layer.
+
+        :param int layer: the index of the layer
+        :param int node_id: the internal Neo4j ID of the node
+        :return: the index of the node or None if it's not in the layer
+        :rtype: int
+        """
+        nodes = self._layers[layer]
+        index = bisect_left(nodes, node_id)
+        if index < len(nodes) and nodes[index] == node_id:
+            return index
+        return None
+
+    def _get_neighbors(self, layer, index, reverse=False):
+        """
+        Get the neighbors of a node in the next layer of the story.
+
+        :param int layer: the index of the layer of the node
+        :param int index: the index of the node in its layer
+        :kwarg bool reverse: get the neighbors in the previous layer instead
+        :return: the indexes of the neighbors in their layer
+        :rtype: array.array
+        """
+        csr = self._backward[layer] if reverse else self._forward[layer]
+        if csr is None:
+            return ()
+        offsets, targets = csr
+        return targets[offsets[index]:offsets[index + 1]]
+
+    def has_node(self, label, node_id):
+        """
+        Check if a node is part of the snapshot.
+
+        :param str label: the label of the node in the story flow
+        :param int node_id: the internal Neo4j ID of the node
+        :return: a boolean determining if the node is in the snapshot
+        :rtype: bool
+        """
+        return self._get_index(self._labels.index(label), node_id) is not None
+
+    def get_path_labels(self, label, length, reverse=False):
+        """
+        Get the labels of the nodes of a story path in the story flow.
+
+        :param str label: the label of the first node of the path
+        :param int length: the number of nodes in the path
+        :kwarg bool reverse: the path goes backward in the story flow
+        :return: the labels in the order of the nodes of the path
+        :rtype: list
+        """
+        start = self._labels.index(label)
+        step = -1 if reverse else 1
+        return [self._labels[start + step * position] for position in range(length)]
+
+    def get_longest_path(self, label, node_id, reverse=False):
+        """
+        Get the longest story path of a node in one direction.
+
+        When several paths are the longest, the one with the lowest internal Neo4j IDs is returned.
+
+        :param str label: the label of the node in the story flow
+        :param int node_id: the internal Neo4j ID of the node
+        :kwarg bool reverse: get the path going backward in the story flow
+        :return: the internal Neo4j IDs of the nodes of the path starting with the node or None if
+        the node has no neighbors in that direction
+        :rtype: list
+        """
+        layer = self._labels.index(label)
+        index = self._get_index(layer, node_id)
+        if index is None:
+            return None
+        step = -1 if reverse else 1
+        # A mapping of (layer, index) to the number of relationships on the longest path from it
+        heights = {}
+
+        def _get_height(curr_layer, curr_index):
+            key = (curr_layer, curr_index)
+            if key not in heights:
+                heights[key] = max(
+                    [_get_height(curr_layer + step, neighbor) + 1
+                     for neighbor in self._get_neighbors(curr_layer, curr_index, reverse)] or [0])
+            return heights[key]
+
+        height = _get_height(layer, index)
+        if height == 0:
+            return None
+
+        path = [node_id]
+        for _ in range(height):
+            for neighbor in self._get_neighbors(layer, index, reverse):
+                if _get_height(layer + step, neighbor) == height - 1:
+                    break
+            layer += step
+            index = neighbor
+            height -= 1
+            path.append(self._layers[layer][index])
+        return path
+
+    def get_all_paths(self, label, node_id, reverse=False, limit=None):
+        """
+        Get all the story paths of a node in one direction, including the partial ones.
+
+        :param str label: the label of the node in the story flow
+        :param int node_id: the internal Neo4j ID of the node
+        :kwarg bool reverse: get the paths going backward in the story flow
+        :kwarg int limit: the maximum number of paths to return, which are then the shortest ones,
+        or None for no limit
+        :return: lists of the internal Neo4j IDs of the nodes of the paths starting with the node,
+        in ascending order of path length
+        :rtype: list
+        """
+        layer = self._labels.index(label)
+        index = self._get_index(layer, node_id)
+        if index is None:
+            return []
+        step = -1 if reverse else 1
+        paths = []
+        # Paths are extended one relationship at a time so that they are in ascending order
+        frontier = [(index, [node_id])]
+        while frontier:
+            next_frontier = []
+            for curr_index, path in frontier:
+                for neighbor in self._get_neighbors(layer, curr_index, reverse):
+                    next_path = path + [self._layers[layer + step][neighbor]]
+                    paths.append(next_path)
+                    if len(paths) == limit:
+                        return paths
+                    next_frontier.append((neighbor, next_path))
+            frontier = next_frontier
+            layer += step
+        return paths
+
+    def get_sibling_counts(self, label, node_id):
+        """
+        Get the number of neighbors of a node in the previous and the next stages of the story.
+
+        :param str label: the label of the node in the story flow
+        :param int node_id: the internal Neo4j ID of the node
+        :return: a tuple of the backward and forward counts
+        :rtype: tuple
+        """
+        layer = self._labels.index(label)
+        index = self._get_index(layer, node_id)
+        return (len(self._get_neighbors(layer, index, reverse=True)),
+                len(self._get_neighbors(layer, index)))
+
+
+class StorySnapshotManager(object):
+    """Keep a story snapshot of the current graph generation by reloading it in the background."""
+
+    def __init__(self, generation_check_interval, get_generation=get_graph_generation,
+                 load_snapshot=StorySnapshot.load):
+        """
+        Initialize the StorySnapshotManager class.
+
+        :param int generation_check_interval: the number of seconds between the checks of the
+        graph generation
+        :kwarg function get_generation: the function that returns the current graph generation
+        :kwarg function load_snapshot: the function that loads a StorySnapshot
+        """
+        self.generation_check_interval = generation_check_interval
+        self._get_generation = get_generation
+        self._load_snapshot = load_snapshot
+        self._snapshot = None
+        self._generation = None
+        self._generation_checked_at = 0
+        self._load_started_at = None
+        self._loading = False
+        self._lock = threading.Lock()
+
+    def get(self):
+        """
+        Get the snapshot if it's of the current graph generation.
+
+        When it's missing or stale, it's reloaded in a background thread.
+
+        :return: the snapshot or None if it's not available
+        :rtype: StorySnapshot
+        """
+        now = time.time()
+        if now - self._generation_checked_at >= self.generation_check_interval:
+            generation = self._get_generation()
+            with self._lock:
+                self._generation_checked_at = now
+                self._generation = generation
+
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.generation == self._generation:
+            return snapshot
+
+        with self._lock:
+            # A failed load is only retried after the graph generation check interval
+            retry_at = (self._load_started_at or 0) + self.generation_check_interval
+            if self._loading or (self._load_started_at is not None and now < retry_at):
+                return None
+            self._loading = True
+            self._load_started_at = now
+        thread = threading.Thread(target=self._load)
+        thread.daemon = True
+        thread.start()
+        return None
+
+    def _load(self):
+        """Load the snapshot and replace the current one."""
+        try:
+            self._snapshot = self._load_snapshot(self._get_generation)
+        except Exception:
+            log.exception('Failed to load the story snapshot')
+        finally:
+            with self._lock:
+                self._loading = False
+
+
+def init_story_snapshot(app):
+    """
+    Create the story snapshot manager of the application from its configuration.
+
+    The snapshot is loaded when it's first needed so that each worker process loads its own.
+
+    :param flask.Flask app: a Flask application object
+    """
+    if app.config.get('STORY_SNAPSHOT'):
+        app.extensions['story_snapshot'] = StorySnapshotManager(
+            app.config['GRAPH_GENERATION_CHECK_INTERVAL'])
+
+
+def get_story_snapshot():
+    """
+    Get the story snapshot of the current application if it's enabled and up to date.
+
+    :return: the snapshot or None if the stories must be queried from Neo4j
+    :rtype: StorySnapshot
+    """
+    manager = current_app.extensions.get('story_snapshot')
+    if manager is None:
+        return None
+    return manager.get()
+
+
+def get_snapshot_sibling_counts(snapshot, label, paths, nodes, reverse=False):
+    """
+    Get the counts of the nodes related to the nodes of story paths found in the story snapshot.
+
+    :param StorySnapshot snapshot: the story snapshot
+    :param str label: the label of the first node of the paths
+    :param list paths: lists of the internal Neo4j IDs of the nodes of the paths
+    :param dict nodes: a mapping of the internal Neo4j IDs to the nodes fetched from Neo4j
+    :kwarg bool reverse: the paths go backward in the story flow
+    :return: the sibling counts in the format of
+    {(label, uid): (backward_siblings_count, forward_siblings_count)}
+    :rtype: dict
+    """
+    sibling_counts = {}
+    for path in paths:
+        for node_id, node_label in zip(path, snapshot.get_path_labels(label, len(path), reverse)):
+            uid = nodes[node_id][story_flow_table[node_label].uid_name]
+            sibling_counts[(node_label, uid)] = snapshot.get_sibling_counts(node_label, node_id)
+    return sibling_counts
+
+
+def get_snapshot_story_paths(snapshot, item):
+    """
+    Get the longest story paths of an artifact and the counts of the nodes related to them.
+
+    :param StorySnapshot snapshot: the story snapshot
+    :param EstuaryStructuredNode item: the artifact
+    :return: a tuple of the nodes of the longest forward path or None, the nodes of the longest
+    backward path or None and the sibling counts in the format of
+    {(label, uid): (backward_siblings_count, forward_siblings_count)}, or None if the artifact isn't
+    in the snapshot
+    :rtype: tuple
+    """
+    label = item.__label__
+    if not snapshot.has_node(label, item.id):
+        return None
+
+    forward_path = snapshot.get_longest_path(label, item.id)
+    backward_path = snapshot.get_longest_path(label, item.id, reverse=True)
+    nodes = get_neo4j_nodes_by_id(set(forward_path or ()) | set(backward_path or ()))
+    sibling_counts = {}
+    rv = []
+    for path, reverse in ((forward_path, False), (backward_path, True)):
+        if path:
+            sibling_counts.update(
+                get_snapshot_sibling_counts(snapshot, label, [path], nodes, reverse))
+            rv.append([nodes[node_id] for node_id in path])
+        else:
+            rv.append(None)
+    return rv[0], rv[1], sibling_counts
@@ -0,0 +1,502 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+from bisect import bisect_right
+from collections import namedtuple
+
+from neomodel import db
+
+from estuary import log
+from estuary.models import story_flow_list
+from estuary.models.base import EstuaryStructuredNode
+from estuary.models.koji import ContainerKojiBuild, KojiBuild
+from estuary.models.bugzilla import BugzillaBug
+from estuary.models.distgit import DistGitCommit
+from estuary.models.errata import Advisory
+from estuary.models.freshmaker import FreshmakerEvent
+from estuary.utils.general import get_resource_model_info
+from estuary.utils.queries import (
+    create_node_count_query, create_full_story_query, create_story_counts_query)
+
+
+StoryStage = namedtuple('StoryStage', [
+    'label',
+    'uid_name',
+    'forward_relationship',
+    'forward_label',
+    'backward_relationship',
+    'backward_label',
+    # The relationship types without the APOC direction suffix
+    'forward_rel_type',
+    'backward_rel_type',
+    # The cypher pattern to get from this node to its neighbor in the story
+    # (e.g. "<-[:RESOLVED]-(:DistGitCommit)")
+    'forward_pattern',
+    'backward_pattern',
+    # The node properties that count the neighbors in the story, which are kept up to date when
+    # the relationships change (e.g. "resolved_distgitcommit_count")
+    'forward_count_property',
+    'backward_count_property',
+])
+
+
+def _create_relationship_pattern(relationship, label):
+    """
+    Convert an APOC relationship filter and a node label to a cypher pattern.
+
+    :param str relationship: an APOC relationship filter such as "RESOLVED<"
+    :param str label: the label of the node at the other end of the relationship
+    :return: the raw cypher pattern or None if there is no relationship
+    :rtype: str
+    """
+    if not relationship:
+        return None
+
+    if relationship.endswith('<'):
+        rel_pattern = '<-[:{0}]-'
+    else:
+        rel_pattern = '-[:{0}]->'
+    return '{0}(:{1})'.format(rel_pattern.format(relationship[:-1]), label)
+
+
+def _create_count_property(relationship, label):
+    """
+    Get the name of the node property that counts the neighbors of a node in the story.
+
+    :param str relationship: an APOC relationship filter such as "RESOLVED<"
+    :param str label: the label of the node at the other end of the relationship
+    :return: the name of the property or None if there is no relationship
+    :rtype: str
+    """
+    if not relationship:
+        return None
+    return '{0}_{1}_count'.format(relationship[:-1].lower(), label.lower())
+
+
+def _create_story_stage(label, uid_name, forward_relationship, forward_label,
+                        backward_relationship, backward_label):
+    """
+    Create an entry of the story flow table.
+
+    :param str label: the Neo4j node label of the stage
+    :param str uid_name: the name of the UniqueIdProperty in Neo4j
+    :param str forward_relationship: the APOC relationship filter to the next stage
+    :param str forward_label: the Neo4j node label of the next stage
+    :param str backward_relationship: the APOC relationship filter to the previous stage
+    :param str backward_label: the Neo4j node label of the previous stage
+    :return: the story stage
+    :rtype: StoryStage
+    """
+    return StoryStage(
+        label=label,
+        uid_name=uid_name,
+        forward_relationship=forward_relationship,
+        forward_label=forward_label,
+        backward_relationship=backward_relationship,
+        backward_label=backward_label,
+        forward_rel_type=forward_relationship[:-1] if forward_relationship else None,
+        backward_rel_type=backward_relationship[:-1] if backward_relationship else None,
+        forward_pattern=_create_relationship_pattern(forward_relationship, forward_label),
+        backward_pattern=_create_relationship_pattern(backward_relationship, backward_label),
+        forward_count_property=_create_count_property(forward_relationship, forward_label),
+        backward_count_property=_create_count_property(backward_relationship, backward_label),
+    )
+
+
+def _compile_story_flow():
+    """
+    Compile the story flow/pipeline from the model definitions.
+
+    :return: a dictionary with the node labels as keys and StoryStage objects as values
+    :rtype: dict
+    """
+    stages = (
+        _create_story_stage(
+            BugzillaBug.__label__,
+            BugzillaBug.get_model_info().uid_db_property,
+            '{0}<'.format(BugzillaBug.resolved_by_commits.definition['relation_type']),
+            DistGitCommit.__label__,
+            None,
+            None),
+        _create_story_stage(
+            DistGitCommit.__label__,
+            DistGitCommit.get_model_info().uid_db_property,
+            '{0}<'.format(DistGitCommit.koji_builds.definition['relation_type']),
+            KojiBuild.__label__,
+            '{0}>'.format(DistGitCommit.resolved_bugs.definition['relation_type']),
+            BugzillaBug.__label__),
+        _create_story_stage(
+            KojiBuild.__label__,
+            KojiBuild.get_model_info().uid_db_property,
+            '{0}<'.format(KojiBuild.advisories.definition['relation_type']),
+            Advisory.__label__,
+            '{0}>'.format(KojiBuild.commit.definition['relation_type']),
+            DistGitCommit.__label__),
+        _create_story_stage(
+            Advisory.__label__,
+            Advisory.get_model_info().uid_db_property,
+            '{0}<'.format(Advisory.triggered_freshmaker_event.definition['relation_type']),
+            FreshmakerEvent.__label__,
+            '{0}>'.format(Advisory.attached_builds.definition['relation_type']),
+            KojiBuild.__label__),
+        _create_story_stage(
+            FreshmakerEvent.__label__,
+            FreshmakerEvent.get_model_info().uid_db_property,
+            '{0}>'.format(FreshmakerEvent.triggered_container_builds.definition['relation_type']),
+            ContainerKojiBuild.__label__,
+            '{0}>'.format(FreshmakerEvent.triggered_by_advisory.definition['relation_type']),
+            Advisory.__label__),
+        _create_story_stage(
+            ContainerKojiBuild.__label__,
+            ContainerKojiBuild.get_model_info().uid_db_property,
+            None,
+            None,
+            '{0}<'.format(
+                ContainerKojiBuild.triggered_by_freshmaker_event.definition['relation_type']),
+            FreshmakerEvent.__label__),
+    )
+    return {stage.label: stage for stage in stages}
+
+
+# The story flow is static, so it's compiled once when the module is imported
+story_flow_table = _compile_story_flow()
+# A mapping of the resources that have a story to the name of their UniqueIdProperty
+story_resources = {label.lower(): story_flow_table[label].uid_name for label in story_flow_list}
+
+
+def story_flow(label):
+    """
+    Get the next/previous node in a story flow/pipeline path.
+
+    :param str label: Neo4j node label
+    :return: uid and relationship information in both forward and backward directions
+    :rtype: StoryStage
+    :raises ValueError: if the label isn't part of the story flow
+    """
+    if not label:
+        return
+
+    try:
+        return story_flow_table[label]
+    except KeyError:
+        raise ValueError('The label should belong to a Neo4j node class')
+
+
+def get_corelated_nodes(results, sibling_counts=None):
+    """
+    Create a raw cypher query for story nodes and get a count of the nodes co-related to them.
+
+    :param dict results: a dictionary containing story nodes
+    :kwarg dict sibling_counts: precomputed counts in the format of
+    {(label, uid): (backward_siblings_count, forward_siblings_count)}; the counts that aren't
+    present are queried from Neo4j
+    :return: a dictionary containing counts of all co-related nodes from Neo4j
+    :rtype: dict
+    """
+    nodes_count_dict = {}
+    curr_label = story_flow_list[0]
+    last = False
+    while not last:
+        node_count = 0
+        next_node_info = story_flow_table[curr_label]
+        forward_label = next_node_info.forward_label
+        if forward_label in results:
+            # Only grab the first element since there will only be one
+            next_node = results[forward_label][0]
+            uid_name = story_flow_table[forward_label].uid_name
+            count_key = (forward_label, next_node[uid_name])
+            if sibling_counts and count_key in sibling_counts:
+                node_count = sibling_counts[count_key][0]
+            else:
+                query = create_node_count_query(
+                    curr_label, next_node_info.forward_rel_type, forward_label, uid_name)
+                node_count = get_node_count(query, {'uid': next_node[uid_name]})
+
+        backward_label = next_node_info.backward_label
+        # If this evaluates to true, then this is the end of the story for the node, so we get
+        # the backwards related nodes (e.g. all the ContainerBuild that were triggered by a
+        # Freshmaker event)
+        if (not forward_label or forward_label not in results) and backward_label:
+            last = True
+            if backward_label not in results:
+                continue
+            backward_node = results[backward_label][0]
+            uid_name = story_flow_table[backward_label].uid_name
+            count_key = (backward_label, backward_node[uid_name])
+            if sibling_counts and count_key in sibling_counts:
+                node_count = sibling_counts[count_key][1]
+            else:
+                query = create_node_count_query(
+                    curr_label, next_node_info.backward_rel_type, backward_label, uid_name)
+                node_count = get_node_count(query, {'uid': backward_node[uid_name]})
+
+        # If there are related nodes, then there always be at least a value of one because it
+        # includes the node already in the story. This is why we subtract here.
+        if node_count > 0:
+            nodes_count_dict[curr_label] = node_count - 1
+
+        curr_label = forward_label
+
+    return nodes_count_dict
+
+
+def get_node_count(query, params=None):
+    """
+    Query Neo4j and return the count of results.
+
+    :param str query: raw cypher query
+    :kwarg dict params: the parameters of the cypher query
+    :return: a dictionary containing the results count received from Neo4j.
+    :rtype: int
+    """
+    results_dict = {}
+    results, _ = db.cypher_query(query, params)
+
+    if not results:
+        return results_dict
+
+    return results[0][0]
+
+
+def get_path_sibling_counts(label, path_nodes, reverse=False):
+    """
+    Get the counts of the nodes related to the nodes of a story path from their story counters.
+
+    :param str label: the label of the first node of the path
+    :param list path_nodes: the nodes of the path as returned by Neo4j
+    :kwarg bool reverse: the path goes backward in the story flow
+    :return: the sibling counts in the format of
+    {(label, uid): (backward_siblings_count, forward_siblings_count)}; the nodes whose story
+    counters aren't set are left out
+    :rtype: dict
+    """
+    if reverse is True:
+        node_label = 'backward_label'
+    else:
+        node_label = 'forward_label'
+
+    sibling_counts = {}
+    curr_label = label
+    for node in path_nodes:
+        node_info = story_flow_table[curr_label]
+        counts = []
+        for neighbor_label, count_property in (
+                (node_info.backward_label, node_info.backward_count_property),
+                (node_info.forward_label, node_info.forward_count_property)):
+            if neighbor_label:
+                counts.append(node.get(count_property))
+            else:
+                counts.append(0)
+        if None not in counts:
+            sibling_counts[(curr_label, node.get(node_info.uid_name))] = tuple(counts)
+        curr_label = getattr(node_info, node_label)
+    return sibling_counts
+
+
+def rebuild_story_counts(batch_size=10000):
+    """
+    Recompute the story counters of all the nodes of the story flow in batches.
+
+    :kwarg int batch_size: the number of nodes updated per query
+    :return: the number of nodes updated
+    :rtype: int
+    """
+    count = 0
+    for label in story_flow_list:
+        after_id = -1
+        while True:
+            results, _ = db.cypher_query(create_story_counts_query(label),
+                                         {'after_id': after_id, 'limit': batch_size})
+            if not results or results[0][0] is None:
+                break
+            after_id, batch_count = results[0]
+            count += batch_count
+        log.debug('Rebuilt the story counters of the {0} nodes'.format(label))
+    return count
+
+
+def _order_story_results(result, sibling_counts=None):
+    """
+    Order results to follow the story flow sequence.
+
+    :param dict results: contains serialized results from Neo4j
+    :kwarg dict sibling_counts: precomputed counts of the nodes co-related to the story nodes
+    :return: a dict containing results ordered in the story flow sequence
+    :rtype: dict
+    """
+    results = {'data': [], 'meta': {'related_nodes': {}}}
+    for label in story_flow_list:
+        results['meta']['related_nodes'][label] = 0
+        if label in result:
+            results['data'].append(result[label][0])
+
+    results['meta']['related_nodes'].update(get_corelated_nodes(result, sibling_counts))
+
+    return results
+
+
+def format_artifact_story(serialized, label):
+    """
+    Create the story of an artifact whose story isn't available, which only has the artifact.
+
+    :param dict serialized: the serialized form of the artifact with its relationships
+    :param str label: the label of the artifact
+    :return: a dict in the same format as the one returned by _order_story_results
+    :rtype: dict
+    """
+    serialized['resource_type'] = label
+    return {
+        'data': [serialized],
+        'meta': {'related_nodes': {key: 0 for key in story_flow_list}},
+    }
+
+
+def get_batch_stories(resource, uids, identity_map=None):
+    """
+    Get the stories of several artifacts of the same kind with a constant number of queries.
+
+    :param str resource: a resource name that maps to a neomodel class
+    :param uids: the values of the UniqueIdProperty of the artifacts
+    :kwarg dict identity_map: a dictionary shared by the calls made while handling a request so
+    that a node that is part of several stories is only serialized once
+    :return: a dictionary with the values of the UniqueIdProperty as keys and the stories in the
+    same format as the one returned by _order_story_results as values; the artifacts that don't
+    exist are left out
+    :rtype: dict
+    :raises ValidationError: if an invalid resource was requested or its story is not available
+    """
+    if identity_map is None:
+        identity_map = {}
+    label = get_resource_model_info(resource).model.__label__
+    results, _ = db.cypher_query(create_full_story_query(label, batch=True), {'uids': list(uids)})
+
+    paths = []
+    for _, _, forward_path, backward_path, _ in results:
+        paths.append(list(forward_path.nodes) if forward_path else [])
+        paths.append(list(backward_path.nodes) if backward_path else [])
+    # The paths of all the stories are serialized together so that the requested artifacts are
+    # expanded with a single query
+    inflated = EstuaryStructuredNode.inflate_results(paths, [label.lower()], identity_map)
+
+    stories = {}
+    # The artifacts without a story, keyed by the value of their UniqueIdProperty
+    artifacts = {}
+    for index, (uid, item, _, _, raw_sibling_counts) in enumerate(results):
+        results_unordered = _merge_story_results(inflated[index * 2], inflated[index * 2 + 1])
+        if not results_unordered:
+            artifacts[uid] = item
+            continue
+
+        sibling_counts = {
+            (node_label, node_uid): (backward_count, forward_count)
+            for node_label, node_uid, backward_count, forward_count in raw_sibling_counts
+        }
+        stories[uid] = _order_story_results(results_unordered, sibling_counts)
+
+    serialized_artifacts = EstuaryStructuredNode.serialize_nodes_all(list(artifacts.values()))
+    for uid, item in artifacts.items():
+        stories[uid] = format_artifact_story(serialized_artifacts[item.id], label)
+
+    return stories
+
+
+def _merge_story_results(result_forward, result_backward):
+    """
+    Combine the serialized results of a forward and a backward story path.
+
+    :param dict result_forward: the serialized results of the forward path
+    :param dict result_backward: the serialized results of the backward path
+    :return: a new dictionary containing the results of both paths
+    :rtype: dict
+    """
+    results = result_forward.copy()
+    results.update(result_backward)
+    return results
+
+
+def get_unique_path_indexes(paths):
+    """
+    Find the story paths that aren't a part of another path.
+
+    A path isn't unique if all its nodes are in a path that comes after it, which means they are
+    the same path except the other one is longer, or if a path that comes after it only has one
+    node that isn't in it, which means they are the same path but from the perspective of
+    different siblings. The last path is always unique.
+
+    :param list paths: lists of node IDs in ascending order of path length
+    :return: the indexes of the unique paths in ascending order
+    :rtype: list
+    """
+    # Map every node to the indexes of the paths it's in, in ascending order
+    node_paths = {}
+    path_sets = []
+    for index, path in enumerate(paths):
+        path_set = frozenset(path)
+        path_sets.append(path_set)
+        for node_id in path_set:
+            node_paths.setdefault(node_id, []).append(index)
+
+    unique_indexes = []
+    last_index = len(paths) - 1
+    for index, path_set in enumerate(path_sets[:-1]):
+        if len(path_set) < 2:
+            candidates = range(index + 1, len(paths))
+        else:
+            # Since the paths after this one are at least as long, a path that makes it not
+            # unique has all its nodes except at most one. That path must then contain at least
+            # one of its two least common nodes, so only the paths containing them are compared.
+            rarest_nodes = sorted(path_set, key=lambda node_id: len(node_paths[node_id]))[:2]
+            candidates = set()
+            for node_id in rarest_nodes:
+                indexes = node_paths[node_id]
+                candidates.update(indexes[bisect_right(indexes, index):])
+
+        unique = True
+        for candidate in candidates:
+            alternate_set = path_sets[candidate]
+            if path_set <= alternate_set or len(alternate_set - path_set) == 1:
+                unique = False
+                break
+        if unique:
+            unique_indexes.append(index)
+
+    if last_index >= 0:
+        unique_indexes.append(last_index)
+    return unique_indexes
+
+
+def get_story_graph(stories):
+    """
+    Convert a list of stories to a graph where the nodes shared by the stories are only listed once.
+
+    :param list stories: stories in the format returned by _order_story_results
+    :return: a dictionary with the unique nodes in "nodes", the pairs of indexes of the nodes
+    that follow each other in a story in "edges", and the stories in "stories" with the indexes of
+    their nodes in "nodes" instead of the nodes themselves
+    :rtype: dict
+    """
+    nodes = []
+    # A mapping of (resource_type, uid) to the index of the node in nodes
+    node_indexes = {}
+    edges = set()
+    graph_stories = []
+    for story in stories:
+        path = []
+        for node in story['data']:
+            node_label = node['resource_type']
+            key = (node_label, node[story_flow_table[node_label].uid_name])
+            index = node_indexes.get(key)
+            if index is None:
+                index = len(nodes)
+                node_indexes[key] = index
+                nodes.append(node)
+            if path:
+                edges.add((path[-1], index))
+            path.append(index)
+        graph_stories.append({'path': path, 'meta': story['meta']})
+
+    return {
+        'nodes': nodes,
+        'edges': [list(edge) for edge in sorted(edges)],
+        'stories': graph_stories,
+    }
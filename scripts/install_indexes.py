@@ -0,0 +1,45 @@
+#! /usr/bin/env python
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+import argparse
+import logging
+import sys
+import os
+# So we can import the estuary module
+sys.path.insert(1, os.path.abspath(os.path.join(sys.path[0], '..')))
+
+from neomodel import config as neomodel_config  # noqa: E402
+
+from estuary.utils.schema import get_missing_schema, get_schema_query, install_schema  # noqa: E402
+
+logging.basicConfig(format='[%(filename)s:%(lineno)s:%(funcName)s] %(message)s')
+log = logging.getLogger('estuary')
+log.setLevel(logging.INFO)
+
+parser = argparse.ArgumentParser(
+    description=('Create the uniqueness constraints and the indexes derived from the models that '
+                 'are missing in Neo4j'))
+parser.add_argument('--check', action='store_true',
+                    help='Only report the missing ones and exit with 1 if there are any')
+parser.add_argument('--neo4j-user', type=str, default='neo4j', help='The Neo4j user')
+parser.add_argument('--neo4j-password', type=str, default='neo4j', help='The Neo4j password')
+parser.add_argument('--neo4j-server', type=str, default='localhost',
+                    help='The FQDN to the Neo4j server')
+args = parser.parse_args()
+
+neomodel_config.DATABASE_URL = 'bolt://{user}:{password}@{server}:7687'.format(
+    user=args.neo4j_user, password=args.neo4j_password, server=args.neo4j_server)
+
+if args.check:
+    missing = get_missing_schema()
+    for item in missing:
+        log.warning('Missing: {0}'.format(get_schema_query(item)))
+    if missing:
+        sys.exit(1)
+    log.info('All the uniqueness constraints and indexes exist')
+else:
+    created, failed = install_schema()
+    log.info('Created {0} uniqueness constraints and indexes'.format(len(created)))
+    if failed:
+        sys.exit(1)
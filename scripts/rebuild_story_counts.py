@@ -0,0 +1,34 @@
+#! /usr/bin/env python
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+import argparse
+import logging
+import sys
+import os
+# So we can import the estuary module
+sys.path.insert(1, os.path.abspath(os.path.join(sys.path[0], '..')))
+
+from neomodel import config as neomodel_config  # noqa: E402
+
+from estuary.utils.story import rebuild_story_counts  # noqa: E402
+
+logging.basicConfig(format='[%(filename)s:%(lineno)s:%(funcName)s] %(message)s')
+log = logging.getLogger('estuary')
+log.setLevel(logging.INFO)
+
+parser = argparse.ArgumentParser(
+    description='Recompute the counters of the story neighbors stored on the nodes in Neo4j')
+parser.add_argument('--batch-size', type=int, default=10000,
+                    help='The number of nodes updated per query')
+parser.add_argument('--neo4j-user', type=str, default='neo4j', help='The Neo4j user')
+parser.add_argument('--neo4j-password', type=str, default='neo4j', help='The Neo4j password')
+parser.add_argument('--neo4j-server', type=str, default='localhost',
+                    help='The FQDN to the Neo4j server')
+args = parser.parse_args()
+
+neomodel_config.DATABASE_URL = 'bolt://{user}:{password}@{server}:7687'.format(
+    user=args.neo4j_user, password=args.neo4j_password, server=args.neo4j_server)
+
+count = rebuild_story_counts(args.batch_size)
+log.info('Rebuilt the story counters of {0} nodes'.format(count))
@@ -11,6 +11,9 @@ import os
 sys.path.insert(1, os.path.abspath(os.path.join(sys.path[0], '..')))
 
 from scrapers import all_scrapers  # noqa: E402
+from estuary.utils.cache import bump_graph_generation  # noqa: E402
+from estuary.utils.materialization import materialize_stories  # noqa: E402
+from estuary.utils.schema import install_schema  # noqa: E402
 
 logging.basicConfig(format='[%(filename)s:%(lineno)s:%(funcName)s] %(message)s')
 log = logging.getLogger('estuary')
@@ -30,6 +33,13 @@ parser.add_argument('--neo4j-user', type=str, default='neo4j', help='The Neo4j u
 parser.add_argument('--neo4j-password', type=str, default='neo4j', help='The Neo4j password')
 parser.add_argument('--neo4j-server', type=str, default='localhost',
                     help='The FQDN to the Neo4j server')
+# Materializing computes the story of every artifact, which costs about as much as requesting them
+# all from the API. Use the time limit or skip it when the scrapers run often on a large graph.
+parser.add_argument('--skip-materialization', action='store_true',
+                    help='Don\'t materialize the stories served by the API after scraping')
+parser.add_argument('--materialization-time-limit', type=int,
+                    help=('The number of seconds after which no more stories are materialized. '
+                          'The other stories are computed on request.'))
 parser.add_argument('--kerberos', action='store_true', help='Use Kerberos for authentication')
 args = parser.parse_args()
 
@@ -59,12 +69,25 @@ if not scraper_classes:
     log.error(error)
     raise RuntimeError(error)
 
-for scraper_class in scraper_classes:
-    scraper = scraper_class(
+scrapers = [
+    scraper_class(
         args.teiid_user, args.teiid_password, args.kerberos, args.neo4j_user, args.neo4j_password,
         args.neo4j_server)
+    for scraper_class in scraper_classes
+]
+# Without the uniqueness constraints and indexes, every MERGE of the scrapers is a label scan
+install_schema()
+
+for scraper in scrapers:
     since = args.since
     until = args.until
     if args.days_ago:
         since = (datetime.utcnow() - timedelta(days=args.days_ago)).strftime('%Y-%m-%d')
     scraper.run(since=since, until=args.until)
+    # Invalidate the cached API responses now that the scraper wrote to Neo4j
+    bump_graph_generation()
+
+if not args.skip_materialization:
+    # The API serves these instead of computing the stories until a scraper writes to Neo4j again
+    log.info('Materialized {0} stories'.format(materialize_stories(
+        time_limit=args.materialization_time_limit)))
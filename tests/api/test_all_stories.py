@@ -252,27 +252,6 @@ from estuary.models.freshmaker import FreshmakerEvent
                 },
                 {
                     'advisories': [
-                        {
-                            'actual_ship_date': None,
-                            'advisory_name': 'RHBA-2017:27760-01',
-                            'content_types': [
-                                'docker'
-                            ],
-                            'created_at':'2018-03-14T05:53:25+00:00',
-                            'id':'123456',
-                            'issue_date':'2018-03-14T05:53:25+00:00',
-                            'product_name':'Release End2End Test',
-                            'product_short_name':'release-e2e-test',
-                            'release_date':None,
-                            'security_impact':'None',
-                            'security_sla':None,
-                            'state':'DROPPED_NO_SHIP',
-                            'status_time':'2018-03-14T07:53:25+00:00',
-                            'synopsis':'This is a synopsis of a test advisory.',
-                            'type':None,
-                            'update_date':'2018-03-14T07:53:25+00:00',
-                            'updated_at':'2018-03-14T07:53:25+00:00'
-                        },
                         {
                             'actual_ship_date': '2017-08-01T15:43:51+00:00',
                             'advisory_name': 'RHBA-2017:2251-02',
@@ -293,6 +272,27 @@ from estuary.models.freshmaker import FreshmakerEvent
                             'type':'RHBA',
                             'update_date':'2017-08-01T07:16:00+00:00',
                             'updated_at':'2017-08-01T15:43:51+00:00'
+                        },
+                        {
+                            'actual_ship_date': None,
+                            'advisory_name': 'RHBA-2017:27760-01',
+                            'content_types': [
+                                'docker'
+                            ],
+                            'created_at':'2018-03-14T05:53:25+00:00',
+                            'id':'123456',
+                            'issue_date':'2018-03-14T05:53:25+00:00',
+                            'product_name':'Release End2End Test',
+                            'product_short_name':'release-e2e-test',
+                            'release_date':None,
+                            'security_impact':'None',
+                            'security_sla':None,
+                            'state':'DROPPED_NO_SHIP',
+                            'status_time':'2018-03-14T07:53:25+00:00',
+                            'synopsis':'This is a synopsis of a test advisory.',
+                            'type':None,
+                            'update_date':'2018-03-14T07:53:25+00:00',
+                            'updated_at':'2018-03-14T07:53:25+00:00'
                         }
                     ],
                     'commit':{
@@ -381,27 +381,6 @@ from estuary.models.freshmaker import FreshmakerEvent
                 },
                 {
                     'advisories': [
-                        {
-                            'actual_ship_date': None,
-                            'advisory_name': 'RHBA-2017:27760-01',
-                            'content_types': [
-                                'docker'
-                            ],
-                            'created_at':'2018-03-14T05:53:25+00:00',
-                            'id':'123456',
-                            'issue_date':'2018-03-14T05:53:25+00:00',
-                            'product_name':'Release End2End Test',
-                            'product_short_name':'release-e2e-test',
-                            'release_date':None,
-                            'security_impact':'None',
-                            'security_sla':None,
-                            'state':'DROPPED_NO_SHIP',
-                            'status_time':'2018-03-14T07:53:25+00:00',
-                            'synopsis':'This is a synopsis of a test advisory.',
-                            'type':None,
-                            'update_date':'2018-03-14T07:53:25+00:00',
-                            'updated_at':'2018-03-14T07:53:25+00:00'
-                        },
                         {
                             'actual_ship_date': '2017-08-01T15:43:51+00:00',
                             'advisory_name': 'RHBA-2017:2251-02',
@@ -422,6 +401,27 @@ from estuary.models.freshmaker import FreshmakerEvent
                             'type':'RHBA',
                             'update_date':'2017-08-01T07:16:00+00:00',
                             'updated_at':'2017-08-01T15:43:51+00:00'
+                        },
+                        {
+                            'actual_ship_date': None,
+                            'advisory_name': 'RHBA-2017:27760-01',
+                            'content_types': [
+                                'docker'
+                            ],
+                            'created_at':'2018-03-14T05:53:25+00:00',
+                            'id':'123456',
+                            'issue_date':'2018-03-14T05:53:25+00:00',
+                            'product_name':'Release End2End Test',
+                            'product_short_name':'release-e2e-test',
+                            'release_date':None,
+                            'security_impact':'None',
+                            'security_sla':None,
+                            'state':'DROPPED_NO_SHIP',
+                            'status_time':'2018-03-14T07:53:25+00:00',
+                            'synopsis':'This is a synopsis of a test advisory.',
+                            'type':None,
+                            'update_date':'2018-03-14T07:53:25+00:00',
+                            'updated_at':'2018-03-14T07:53:25+00:00'
                         }
                     ],
                     'commit':{
@@ -510,27 +510,6 @@ from estuary.models.freshmaker import FreshmakerEvent
                 },
                 {
                     'advisories': [
-                        {
-                            'actual_ship_date': None,
-                            'advisory_name': 'RHBA-2017:27760-01',
-                            'content_types': [
-                                'docker'
-                            ],
-                            'created_at':'2018-03-14T05:53:25+00:00',
-                            'id':'123456',
-                            'issue_date':'2018-03-14T05:53:25+00:00',
-                            'product_name':'Release End2End Test',
-                            'product_short_name':'release-e2e-test',
-                            'release_date':None,
-                            'security_impact':'None',
-                            'security_sla':None,
-                            'state':'DROPPED_NO_SHIP',
-                            'status_time':'2018-03-14T07:53:25+00:00',
-                            'synopsis':'This is a synopsis of a test advisory.',
-                            'type':None,
-                            'update_date':'2018-03-14T07:53:25+00:00',
-                            'updated_at':'2018-03-14T07:53:25+00:00'
-                        },
                         {
                             'actual_ship_date': '2017-08-01T15:43:51+00:00',
                             'advisory_name': 'RHBA-2017:2251-02',
@@ -551,6 +530,27 @@ from estuary.models.freshmaker import FreshmakerEvent
                             'type':'RHBA',
                             'update_date':'2017-08-01T07:16:00+00:00',
                             'updated_at':'2017-08-01T15:43:51+00:00'
+                        },
+                        {
+                            'actual_ship_date': None,
+                            'advisory_name': 'RHBA-2017:27760-01',
+                            'content_types': [
+                                'docker'
+                            ],
+                            'created_at':'2018-03-14T05:53:25+00:00',
+                            'id':'123456',
+                            'issue_date':'2018-03-14T05:53:25+00:00',
+                            'product_name':'Release End2End Test',
+                            'product_short_name':'release-e2e-test',
+                            'release_date':None,
+                            'security_impact':'None',
+                            'security_sla':None,
+                            'state':'DROPPED_NO_SHIP',
+                            'status_time':'2018-03-14T07:53:25+00:00',
+                            'synopsis':'This is a synopsis of a test advisory.',
+                            'type':None,
+                            'update_date':'2018-03-14T07:53:25+00:00',
+                            'updated_at':'2018-03-14T07:53:25+00:00'
                         }
                     ],
                     'commit':{
@@ -663,27 +663,6 @@ from estuary.models.freshmaker import FreshmakerEvent
                 },
                 {
                     'advisories': [
-                        {
-                            'actual_ship_date': None,
-                            'advisory_name': 'RHBA-2017:27760-01',
-                            'content_types': [
-                                'docker'
-                            ],
-                            'created_at':'2018-03-14T05:53:25+00:00',
-                            'id':'123456',
-                            'issue_date':'2018-03-14T05:53:25+00:00',
-                            'product_name':'Release End2End Test',
-                            'product_short_name':'release-e2e-test',
-                            'release_date':None,
-                            'security_impact':'None',
-                            'security_sla':None,
-                            'state':'DROPPED_NO_SHIP',
-                            'status_time':'2018-03-14T07:53:25+00:00',
-                            'synopsis':'This is a synopsis of a test advisory.',
-                            'type':None,
-                            'update_date':'2018-03-14T07:53:25+00:00',
-                            'updated_at':'2018-03-14T07:53:25+00:00'
-                        },
                         {
                             'actual_ship_date': '2017-08-01T15:43:51+00:00',
                             'advisory_name': 'RHBA-2017:2251-02',
@@ -704,6 +683,27 @@ from estuary.models.freshmaker import FreshmakerEvent
                             'type':'RHBA',
                             'update_date':'2017-08-01T07:16:00+00:00',
                             'updated_at':'2017-08-01T15:43:51+00:00'
+                        },
+                        {
+                            'actual_ship_date': None,
+                            'advisory_name': 'RHBA-2017:27760-01',
+                            'content_types': [
+                                'docker'
+                            ],
+                            'created_at':'2018-03-14T05:53:25+00:00',
+                            'id':'123456',
+                            'issue_date':'2018-03-14T05:53:25+00:00',
+                            'product_name':'Release End2End Test',
+                            'product_short_name':'release-e2e-test',
+                            'release_date':None,
+                            'security_impact':'None',
+                            'security_sla':None,
+                            'state':'DROPPED_NO_SHIP',
+                            'status_time':'2018-03-14T07:53:25+00:00',
+                            'synopsis':'This is a synopsis of a test advisory.',
+                            'type':None,
+                            'update_date':'2018-03-14T07:53:25+00:00',
+                            'updated_at':'2018-03-14T07:53:25+00:00'
                         }
                     ],
                     'commit':{
@@ -931,3 +931,102 @@ def test_all_stories(client, resource, uid, expected):
     pp = pprint.PrettyPrinter(indent=4)
     pp.pprint(json.loads(rv.data.decode('utf-8')))
     assert json.loads(rv.data.decode('utf-8')) == expected
+
+
+def test_all_stories_pagination(client):
+    """Test that the stories are paginated with the limit and cursor query parameters."""
+    advisory = Advisory.get_or_create({'id_': '27825', 'advisory_name': 'RHBA-2017:2251-02'})[0]
+    for i in range(2):
+        commit = DistGitCommit.get_or_create({'hash_': 'abc{0}'.format(i)})[0]
+        build = KojiBuild.get_or_create({'id_': str(i), 'name': 'slf4j'})[0]
+        commit.koji_builds.connect(build)
+        advisory.attached_builds.connect(build)
+        fm_event = FreshmakerEvent.get_or_create({'id_': str(i)})[0]
+        cb = ContainerKojiBuild.get_or_create({'id_': str(i + 10), 'name': 'slf4j_2'})[0]
+        fm_event.triggered_by_advisory.connect(advisory)
+        fm_event.triggered_container_builds.connect(cb)
+
+    rv = client.get('/api/v1/allstories/advisory/27825?limit=3')
+    assert rv.status_code == 200
+    assert len(json.loads(rv.data.decode('utf-8'))) == 3
+    assert rv.headers['X-Total-Count'] == '4'
+    assert rv.headers['Link'] == (
+        '</api/v1/allstories/advisory/27825?limit=3&cursor=3>; rel="next"')
+
+    rv = client.get('/api/v1/allstories/advisory/27825?limit=3&cursor=3')
+    assert rv.status_code == 200
+    assert len(json.loads(rv.data.decode('utf-8'))) == 1
+    assert rv.headers['X-Total-Count'] == '4'
+    assert 'Link' not in rv.headers
+
+
+def test_all_stories_max_paths(client):
+    """Test that an error is returned when the artifact has too many story paths."""
+    advisory = Advisory.get_or_create({'id_': '27825', 'advisory_name': 'RHBA-2017:2251-02'})[0]
+    for i in range(2):
+        commit = DistGitCommit.get_or_create({'hash_': 'abc{0}'.format(i)})[0]
+        build = KojiBuild.get_or_create({'id_': str(i), 'name': 'slf4j'})[0]
+        commit.koji_builds.connect(build)
+        advisory.attached_builds.connect(build)
+
+    # The backward paths are the two builds and the two commits
+    client.application.config['MAX_STORY_PATHS'] = 4
+    try:
+        rv = client.get('/api/v1/allstories/advisory/27825')
+        assert rv.status_code == 200
+        assert rv.headers['X-Total-Count'] == '2'
+        client.application.config['MAX_STORY_PATHS'] = 3
+        rv = client.get('/api/v1/allstories/advisory/27825')
+    finally:
+        client.application.config['MAX_STORY_PATHS'] = 10000
+    assert rv.status_code == 400
+    assert json.loads(rv.data.decode('utf-8'))['message'] == (
+        'The stories of this item can\'t be listed since it has more than 3 story paths in one '
+        'direction')
+
+
+def test_all_stories_graph(client):
+    """Test that the nodes shared by the stories are only returned once in the graph format."""
+    commit = DistGitCommit.get_or_create({'hash_': 'abc'})[0]
+    build = KojiBuild.get_or_create({'id_': '1', 'name': 'slf4j'})[0]
+    commit.koji_builds.connect(build)
+    for i in range(2):
+        advisory = Advisory.get_or_create({'id_': str(i), 'advisory_name': 'RHBA-{0}'.format(i)})[0]
+        advisory.attached_builds.connect(build)
+
+    rv = client.get('/api/v1/allstories/kojibuild/1?format=graph')
+    assert rv.status_code == 200
+    graph = json.loads(rv.data.decode('utf-8'))
+    assert [node['resource_type'] for node in graph['nodes']] == [
+        'DistGitCommit', 'KojiBuild', 'Advisory', 'Advisory']
+    assert graph['edges'] == [[0, 1], [1, 2], [1, 3]]
+    assert sorted(story['path'] for story in graph['stories']) == [[0, 1, 2], [0, 1, 3]]
+
+
+def test_all_stories_stream(client):
+    """Test that the streamed stories are the same as the ones returned all at once."""
+    commit = DistGitCommit.get_or_create({'hash_': 'abc'})[0]
+    build = KojiBuild.get_or_create({'id_': '1', 'name': 'slf4j'})[0]
+    commit.koji_builds.connect(build)
+    for i in range(2):
+        advisory = Advisory.get_or_create({'id_': str(i), 'advisory_name': 'RHBA-{0}'.format(i)})[0]
+        advisory.attached_builds.connect(build)
+
+    rv = client.get('/api/v1/allstories/kojibuild/1?stream=true')
+    assert rv.status_code == 200
+    assert rv.is_streamed
+    expected = client.get('/api/v1/allstories/kojibuild/1').data
+    assert json.loads(rv.data.decode('utf-8')) == json.loads(expected.decode('utf-8'))
+
+
+@pytest.mark.parametrize('query_string,error', [
+    ('limit=0', 'The limit must be an integer between 1 and 100'),
+    ('limit=101', 'The limit must be an integer between 1 and 100'),
+    ('cursor=abc', 'The cursor must be an integer greater than or equal to 0'),
+    ('format=xml', 'The format must be "list" or "graph"'),
+])
+def test_all_stories_invalid_pagination(client, query_string, error):
+    """Test that an error is returned when the pagination parameters are invalid."""
+    rv = client.get('/api/v1/allstories/advisory/27825?{0}'.format(query_string))
+    assert rv.status_code == 400
+    assert json.loads(rv.data.decode('utf-8'))['message'] == error
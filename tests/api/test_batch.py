@@ -0,0 +1,82 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+import json
+
+import pytest
+
+from estuary.models.distgit import DistGitCommit
+from estuary.models.errata import Advisory
+from estuary.models.koji import KojiBuild
+from estuary.models.user import User
+
+
+def _setup_graph():
+    """Create two builds of the same commit, one of which is attached to an advisory."""
+    commit = DistGitCommit.get_or_create({'hash_': 'abc'})[0]
+    build = KojiBuild.get_or_create({'id_': '1', 'name': 'slf4j'})[0]
+    build_two = KojiBuild.get_or_create({'id_': '2', 'name': 'slf4j'})[0]
+    advisory = Advisory.get_or_create({'id_': '27825', 'advisory_name': 'RHBA-2017:2251-02'})[0]
+    commit.koji_builds.connect(build)
+    commit.koji_builds.connect(build_two)
+    advisory.attached_builds.connect(build)
+    User.get_or_create({'username': 'tbrady'})
+
+
+@pytest.mark.parametrize('relationship', [True, False])
+def test_batch_resources(client, relationship):
+    """Test that the batch results are the same as the ones of the resource route."""
+    _setup_graph()
+    items = [
+        {'resource': 'kojibuild', 'uid': '1'},
+        {'resource': 'kojibuild', 'uid': '2'},
+        {'resource': 'kojibuild', 'uid': '3'},
+        {'resource': 'user', 'uid': 'tbrady'},
+    ]
+    body = {'items': items, 'relationship': relationship}
+    rv = client.post('/api/v1/batch', data=json.dumps(body), content_type='application/json')
+    assert rv.status_code == 200
+    results = json.loads(rv.data.decode('utf-8'))
+    assert results['kojibuild']['3'] is None
+    for item in items[:2] + items[3:]:
+        expected = client.get('/api/v1/{0}/{1}?relationship={2}'.format(
+            item['resource'], item['uid'], str(relationship).lower())).data
+        assert results[item['resource']][item['uid']] == json.loads(expected.decode('utf-8'))
+
+
+def test_batch_stories(client):
+    """Test that the batch stories are the same as the ones of the story route."""
+    _setup_graph()
+    items = [
+        {'resource': 'kojibuild', 'uid': '1'},
+        {'resource': 'kojibuild', 'uid': '2'},
+        {'resource': 'advisory', 'uid': '27825'},
+        {'resource': 'advisory', 'uid': '12345'},
+    ]
+    rv = client.post('/api/v1/batch', data=json.dumps({'items': items, 'story': True}),
+                     content_type='application/json')
+    assert rv.status_code == 200
+    results = json.loads(rv.data.decode('utf-8'))
+    assert results['advisory']['12345'] is None
+    for item in items[:3]:
+        expected = client.get('/api/v1/story/{0}/{1}'.format(item['resource'], item['uid'])).data
+        assert results[item['resource']][item['uid']] == json.loads(expected.decode('utf-8'))
+
+
+@pytest.mark.parametrize('body,error', [
+    ([], 'The request body must be a JSON object with an "items" list'),
+    ({'items': {}}, 'The request body must be a JSON object with an "items" list'),
+    ({'items': [{'resource': 'user'}]},
+     'Each item must be an object with the "resource" and "uid" keys as strings'),
+    ({'items': [{'resource': 'user', 'uid': 'tbrady'}], 'story': 'true'},
+     'The "story" and "relationship" keys must be booleans'),
+    ({'items': [{'resource': 'user', 'uid': 'tbrady'}], 'story': True},
+     'The story is not available for this kind of resource'),
+    ({'items': [{'resource': 'user', 'uid': 'tbrady'}] * 501},
+     'At most 500 items can be requested at once'),
+])
+def test_batch_invalid(client, body, error):
+    """Test that an error is returned when the batch request is invalid."""
+    rv = client.post('/api/v1/batch', data=json.dumps(body), content_type='application/json')
+    assert rv.status_code == 400
+    assert json.loads(rv.data.decode('utf-8')) == {'message': error, 'status': 400}
@@ -14,6 +14,7 @@ from estuary.models.distgit import DistGitPush, DistGitCommit
 from estuary.models.errata import Advisory, AdvisoryState
 from estuary.models.freshmaker import FreshmakerEvent
 from estuary.models.koji import KojiBuild, KojiTask, KojiTag, ContainerKojiBuild
+from estuary.utils.serialization import json_dumps
 
 
 def test_about(client):
@@ -126,7 +127,25 @@ def test_get_resource_relationship_false(client, model, resource, uid, test_inpu
     item = model.get_or_create(test_input)[0]
     rv = client.get('/api/v1/{0}/{1}?relationship=false'.format(resource, uid))
     assert rv.status_code == 200
-    assert json.loads(rv.data.decode('utf-8')) == item.serialized
+    expected = json.loads(json_dumps(item.serialized).decode('utf-8'))
+    assert json.loads(rv.data.decode('utf-8')) == expected
+
+
+def test_get_resource_msgpack(client):
+    """Test getting a resource encoded in MessagePack based on the Accept header."""
+    msgpack = pytest.importorskip('msgpack')
+    commit = DistGitCommit.get_or_create({
+        'author_date': datetime(2017, 4, 26, 11, 44, 38),
+        'hash_': '8a63adb248ba633e200067e1ad6dc61931727bad',
+        'log_message': 'Related: #12345 - fix xyz'
+    })[0]
+    rv = client.get('/api/v1/distgitcommit/{0}?relationship=false'.format(commit.hash_),
+                    headers={'Accept': 'application/msgpack'})
+    assert rv.status_code == 200
+    assert rv.mimetype == 'application/msgpack'
+    assert 'Accept' in rv.headers['Vary']
+    expected = json.loads(json_dumps(commit.serialized).decode('utf-8'))
+    assert msgpack.unpackb(rv.data, raw=False) == expected
 
 
 @pytest.mark.parametrize('resource', ['distgitrepo', 'distgitbranch'])
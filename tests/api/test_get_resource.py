@@ -66,17 +66,17 @@ from estuary.models.freshmaker import FreshmakerEvent
         },
         'resolution': '',
         'resolved_by_commits': [
-            {
-                'author_date': '2017-04-27T11:44:38+00:00',
-                'commit_date': '2017-04-27T11:44:38+00:00',
-                'hash': '1263adb248ba633e205067e1ad6dc61931727c2d',
-                'log_message': 'Related: #12345 - fix xz'
-            },
             {
                 'author_date': '2017-04-26T11:44:38+00:00',
                 'commit_date': '2017-04-26T11:44:38+00:00',
                 'hash': '8a63adb248ba633e200067e1ad6dc61931727bad',
                 'log_message': 'Related: #12345 - fix xyz'
+            },
+            {
+                'author_date': '2017-04-27T11:44:38+00:00',
+                'commit_date': '2017-04-27T11:44:38+00:00',
+                'hash': '1263adb248ba633e205067e1ad6dc61931727c2d',
+                'log_message': 'Related: #12345 - fix xz'
             }
         ],
         'reverted_by_commits': [
@@ -143,13 +143,13 @@ from estuary.models.freshmaker import FreshmakerEvent
             {
                 'classification': 'Red Hat',
                 'creation_time': '2017-04-02T19:39:06+00:00',
-                'id': '272895',
+                'id': '12345',
                 'modified_time': '2018-02-07T19:30:47+00:00',
-                'priority': 'low',
-                'product_name': 'Satellite',
-                'product_version': '3',
+                'priority': 'high',
+                'product_name': 'Red Hat Enterprise Linux',
+                'product_version': '7.5',
                 'resolution': '',
-                'severity': 'medium',
+                'severity': 'low',
                 'short_description': 'Some description',
                 'status': 'VERIFIED',
                 'target_milestone': 'rc',
@@ -158,13 +158,13 @@ from estuary.models.freshmaker import FreshmakerEvent
             {
                 'classification': 'Red Hat',
                 'creation_time': '2017-04-02T19:39:06+00:00',
-                'id': '12345',
+                'id': '272895',
                 'modified_time': '2018-02-07T19:30:47+00:00',
-                'priority': 'high',
-                'product_name': 'Red Hat Enterprise Linux',
-                'product_version': '7.5',
+                'priority': 'low',
+                'product_name': 'Satellite',
+                'product_version': '3',
                 'resolution': '',
-                'severity': 'low',
+                'severity': 'medium',
                 'short_description': 'Some description',
                 'status': 'VERIFIED',
                 'target_milestone': 'rc',
@@ -181,11 +181,11 @@ from estuary.models.freshmaker import FreshmakerEvent
             {
                 'classification': 'Red Hat',
                 'creation_time': '2017-04-02T19:39:06+00:00',
-                'id': '67890',
+                'id': '12345',
                 'modified_time': '2018-02-07T19:30:47+00:00',
-                'priority': 'medium',
+                'priority': 'high',
                 'product_name': 'Red Hat Enterprise Linux',
-                'product_version': '7.3',
+                'product_version': '7.5',
                 'resolution': '',
                 'severity': 'low',
                 'short_description': 'Some description',
@@ -196,11 +196,11 @@ from estuary.models.freshmaker import FreshmakerEvent
             {
                 'classification': 'Red Hat',
                 'creation_time': '2017-04-02T19:39:06+00:00',
-                'id': '12345',
+                'id': '67890',
                 'modified_time': '2018-02-07T19:30:47+00:00',
-                'priority': 'high',
+                'priority': 'medium',
                 'product_name': 'Red Hat Enterprise Linux',
-                'product_version': '7.5',
+                'product_version': '7.3',
                 'resolution': '',
                 'severity': 'low',
                 'short_description': 'Some description',
@@ -622,3 +622,98 @@ def test_get_resources(client, resource, uid, expected):
     rv = client.get('/api/v1/{0}/{1}'.format(resource, uid))
     assert rv.status_code == 200
     assert json.loads(rv.data.decode('utf-8')) == expected
+
+
+def test_get_resource_sparse(client):
+    """Test getting a resource with only some of its properties and relationships."""
+    build = KojiBuild.get_or_create({
+        'id_': '2345',
+        'name': 'slf4j',
+        'version': '1.7.4',
+        'release': '4.el7_4',
+    })[0]
+    commit = DistGitCommit.get_or_create({
+        'hash_': '8a63adb248ba633e200067e1ad6dc61931727bad',
+        'log_message': 'Related: #12345 - fix xyz'
+    })[0]
+    tag = KojiTag.get_or_create({'id_': '3456', 'name': 'some-tag'})[0]
+    build.commit.connect(commit)
+    build.tags.connect(tag)
+
+    rv = client.get('/api/v1/kojibuild/2345?fields=id,name&include=commit,advisories')
+    assert rv.status_code == 200
+    assert json.loads(rv.data.decode('utf-8')) == {
+        'id': '2345',
+        'name': 'slf4j',
+        'commit': {
+            'author_date': None,
+            'commit_date': None,
+            'hash': '8a63adb248ba633e200067e1ad6dc61931727bad',
+            'log_message': 'Related: #12345 - fix xyz'
+        },
+        'advisories': [],
+    }
+
+    rv = client.get('/api/v1/kojibuild/2345?fields=name&include=')
+    assert json.loads(rv.data.decode('utf-8')) == {'name': 'slf4j'}
+
+    # Streaming only applies to /allstories
+    rv = client.get('/api/v1/kojibuild/2345?fields=name&include=&stream=true')
+    assert not rv.is_streamed
+    assert json.loads(rv.data.decode('utf-8')) == {'name': 'slf4j'}
+
+
+@pytest.mark.parametrize('query_string,error', [
+    ('fields=id,nvr', ('The fields "nvr" are invalid. Choose from the following: '
+                       'completion_time, creation_time, epoch, extra, id, name, release, '
+                       'start_time, state, and version.')),
+    ('include=builds', ('The include "builds" are invalid. Choose from the following: '
+                        'advisories, commit, owner, tags, and tasks.')),
+    ('relationship=false&include=tags',
+     'The include parameter can\'t be used with relationship=false'),
+])
+def test_get_resource_sparse_invalid(client, query_string, error):
+    """Test that an error is returned when the fields or include query parameter is invalid."""
+    KojiBuild.get_or_create({'id_': '2345', 'name': 'slf4j'})
+    rv = client.get('/api/v1/kojibuild/2345?{0}'.format(query_string))
+    assert rv.status_code == 400
+    assert json.loads(rv.data.decode('utf-8')) == {'message': error, 'status': 400}
+
+
+def test_get_resource_relationship(client):
+    """Test paging through the nodes of a relationship of a resource."""
+    tag = KojiTag.get_or_create({'id_': '3456', 'name': 'some-tag'})[0]
+    for build_id in range(5):
+        tag.builds.connect(KojiBuild.get_or_create({'id_': str(build_id), 'name': 'slf4j'})[0])
+
+    rv = client.get('/api/v1/kojitag/3456?limit=2')
+    assert rv.status_code == 200
+    rv_json = json.loads(rv.data.decode('utf-8'))
+    assert [build['id'] for build in rv_json['builds']] == ['0', '1']
+    assert rv_json['meta']['relationships']['builds']['total'] == 5
+
+    next_url = rv_json['meta']['relationships']['builds']['next']
+    build_ids = []
+    while next_url:
+        rv = client.get(next_url)
+        assert rv.status_code == 200
+        assert rv.headers['X-Total-Count'] == '5'
+        build_ids.extend(build['id'] for build in json.loads(rv.data.decode('utf-8')))
+        next_url = None
+        if 'Link' in rv.headers:
+            next_url = rv.headers['Link'].split('>')[0][1:]
+    assert build_ids == ['2', '3', '4']
+
+
+@pytest.mark.parametrize('path,error', [
+    ('/api/v1/kojitag/3456/commits',
+     'The requested relationship "commits" is invalid. Choose from the following: builds.'),
+    ('/api/v1/kojitag/3456/builds?cursor=abc', 'The cursor is invalid'),
+    ('/api/v1/kojitag/3456/builds?limit=0', 'The limit must be an integer between 1 and 100'),
+])
+def test_get_resource_relationship_invalid(client, path, error):
+    """Test that an error is returned when the relationship or pagination is invalid."""
+    KojiTag.get_or_create({'id_': '3456', 'name': 'some-tag'})
+    rv = client.get(path)
+    assert rv.status_code == 400
+    assert json.loads(rv.data.decode('utf-8')) == {'message': error, 'status': 400}
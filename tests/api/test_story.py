@@ -4,6 +4,8 @@ from __future__ import unicode_literals
 import json
 from datetime import datetime
 
+import mock
+from neomodel import db
 import pytest
 
 from estuary.models.koji import KojiBuild, ContainerKojiBuild
@@ -12,6 +14,9 @@ from estuary.models.distgit import DistGitCommit
 from estuary.models.errata import Advisory
 from estuary.models.freshmaker import FreshmakerEvent
 from estuary.models.user import User
+from estuary.utils.cache import bump_graph_generation
+from estuary.utils.materialization import get_materialized_story, materialize_stories
+from estuary.utils.snapshot import StorySnapshot
 
 
 @pytest.mark.parametrize('resource,uid,expected', [
@@ -1048,3 +1053,132 @@ def test_get_stories_just_artifact(client):
     rv = client.get('/api/v1/story/advisory/27825')
     assert rv.status_code == 200
     assert json.loads(rv.data.decode('utf-8')) == expected
+
+
+def test_get_story_materialized(client):
+    """Test that the materialized stories are served until the graph changes."""
+    bug = BugzillaBug.get_or_create({
+        'id_': '12345',
+        'severity': 'low',
+        'short_description': 'Some description',
+        'status': 'VERIFIED'
+    })[0]
+    commit = DistGitCommit.get_or_create({
+        'author_date': datetime(2017, 4, 26, 11, 44, 38),
+        'commit_date': datetime(2017, 4, 26, 11, 44, 38),
+        'hash_': '8a63adb248ba633e200067e1ad6dc61931727bad',
+        'log_message': 'Related: #12345 - fix xyz'
+    })[0]
+    commit.related_bugs.connect(bug)
+    ContainerKojiBuild.get_or_create({'id_': '710', 'name': 'slf4j_2'})
+    rv = client.get('/api/v1/story/distgitcommit/8a63adb248ba633e200067e1ad6dc61931727bad')
+    live = json.loads(rv.data.decode('utf-8'))
+    rv = client.get('/api/v1/story/kojibuild/710')
+    live_container = json.loads(rv.data.decode('utf-8'))
+
+    assert materialize_stories() == 3
+    results, _ = db.cypher_query('MATCH (s:EstuaryStory) RETURN s.key ORDER BY s.key')
+    # The story of the container build is only materialized with the ContainerKojiBuild label
+    assert results == [
+        ['BugzillaBug:12345'], ['ContainerKojiBuild:710'],
+        ['DistGitCommit:8a63adb248ba633e200067e1ad6dc61931727bad']]
+    rv = client.get('/api/v1/story/kojibuild/710')
+    assert rv.status_code == 200
+    assert json.loads(rv.data.decode('utf-8')) == live_container
+    assert get_materialized_story('DistGitCommit', '8a63adb248ba633e200067e1ad6dc61931727bad')
+    rv = client.get('/api/v1/story/distgitcommit/8a63adb248ba633e200067e1ad6dc61931727bad')
+    assert rv.status_code == 200
+    assert json.loads(rv.data.decode('utf-8')) == live
+
+    # Once a scraper writes to Neo4j, the story is computed again
+    bump_graph_generation()
+    assert get_materialized_story(
+        'DistGitCommit', '8a63adb248ba633e200067e1ad6dc61931727bad') is None
+    rv = client.get('/api/v1/story/distgitcommit/8a63adb248ba633e200067e1ad6dc61931727bad')
+    assert json.loads(rv.data.decode('utf-8')) == live
+
+
+def test_materialize_stories_time_limit(client):
+    """Test that no more stories are materialized once the time limit is reached."""
+    for id_ in ('12345', '67890'):
+        BugzillaBug.get_or_create({'id_': id_, 'short_description': 'Some description'})
+    # With no time left, only the first batch is materialized
+    assert materialize_stories(batch_size=1, time_limit=0) == 1
+    results, _ = db.cypher_query('MATCH (s:EstuaryStory) RETURN count(s)')
+    assert results == [[1]]
+    # The story that wasn't materialized is computed on request
+    assert get_materialized_story('BugzillaBug', '67890') is None
+    rv = client.get('/api/v1/story/bugzillabug/67890')
+    assert rv.status_code == 200
+
+
+@pytest.mark.parametrize('module,mimetype', [
+    ('msgpack', 'application/msgpack'),
+    ('cbor2', 'application/cbor'),
+])
+def test_get_story_materialized_formats(client, module, mimetype):
+    """Test that the stories in other formats than JSON are the same with a materialized story."""
+    pytest.importorskip(module)
+    bug = BugzillaBug.get_or_create({
+        'id_': '12345',
+        'creation_time': datetime(2017, 4, 2, 19, 39, 6),
+        'short_description': 'Some description',
+    })[0]
+    commit = DistGitCommit.get_or_create({
+        'author_date': datetime(2017, 4, 26, 11, 44, 38),
+        'commit_date': datetime(2017, 4, 26, 11, 44, 38),
+        'hash_': '8a63adb248ba633e200067e1ad6dc61931727bad',
+    })[0]
+    commit.resolved_bugs.connect(bug)
+    url = '/api/v1/story/bugzillabug/12345'
+    live = client.get(url, headers={'Accept': mimetype})
+    assert live.mimetype == mimetype
+
+    assert materialize_stories() == 2
+    rv = client.get(url, headers={'Accept': mimetype})
+    assert rv.status_code == 200
+    assert rv.mimetype == mimetype
+    # The datetimes are encoded the same way, such as with the CBOR date/time tag
+    assert rv.data == live.data
+
+
+def test_get_story_snapshot(client):
+    """Test that the stories found in the story snapshot are the same as the ones from Neo4j."""
+    bug = BugzillaBug.get_or_create({
+        'id_': '12345',
+        'severity': 'low',
+        'short_description': 'Some description',
+        'status': 'VERIFIED'
+    })[0]
+    commit = DistGitCommit.get_or_create({
+        'author_date': datetime(2017, 4, 26, 11, 44, 38),
+        'commit_date': datetime(2017, 4, 26, 11, 44, 38),
+        'hash_': '8a63adb248ba633e200067e1ad6dc61931727bad',
+        'log_message': 'Related: #12345 - fix xyz'
+    })[0]
+    build = KojiBuild.get_or_create({
+        'completion_time': datetime(2017, 4, 2, 19, 39, 6),
+        'creation_time': datetime(2017, 4, 2, 19, 39, 6),
+        'epoch': '0',
+        'id_': '2345',
+        'name': 'slf4j',
+        'release': '4.el7_4',
+        'start_time': datetime(2017, 4, 2, 19, 39, 6),
+        'state': 1,
+        'version': '1.7.4'
+    })[0]
+    commit.resolved_bugs.connect(bug)
+    build.commit.connect(commit)
+
+    urls = [
+        '/api/v1/story/bugzillabug/12345',
+        '/api/v1/story/kojibuild/2345',
+        '/api/v1/allstories/distgitcommit/8a63adb248ba633e200067e1ad6dc61931727bad',
+    ]
+    live = [json.loads(client.get(url).data.decode('utf-8')) for url in urls]
+    # The stories go through the bug, the commit and the build
+    assert [len(story['data']) for story in live[:2]] == [3, 3]
+    snapshot = StorySnapshot.load()
+    assert snapshot.get_longest_path('BugzillaBug', bug.id) == [bug.id, commit.id, build.id]
+    with mock.patch('estuary.api.v1.get_story_snapshot', return_value=snapshot):
+        assert [json.loads(client.get(url).data.decode('utf-8')) for url in urls] == live
@@ -2,13 +2,18 @@
 
 from __future__ import unicode_literals
 
+from datetime import datetime
+
 import pytest
-from neomodel import UniqueIdProperty, One, RelationshipTo
+from neomodel import UniqueIdProperty, One, RelationshipTo, INCOMING, ZeroOrMore, db
 
 from estuary.models.base import EstuaryStructuredNode
 from estuary.models.errata import Advisory
 from estuary.models.user import User
 from estuary.models.bugzilla import BugzillaBug
+from estuary.models.distgit import DistGitCommit
+from estuary.models.koji import ContainerKojiBuild, KojiBuild, KojiTag
+from estuary.utils.general import get_node_model
 
 
 def test_conditional_connect_zero_or_one():
@@ -58,3 +63,200 @@ def test_conditional_connect_one():
     with pytest.raises(NotImplementedError)as exc_info:
         EstuaryStructuredNode.conditional_connect(test.owner, thanks)
     assert 'conditional_connect doesn\'t support cardinality of one' == str(exc_info.value)
+
+
+@pytest.mark.parametrize('model,uid_name,uid_db_property', [
+    (Advisory, 'id_', 'id'),
+    (BugzillaBug, 'id_', 'id'),
+    (User, 'username', 'username'),
+])
+def test_get_model_info(model, uid_name, uid_db_property):
+    """Test that the model information is computed once and includes the unique ID property."""
+    model_info = model.get_model_info()
+    assert model_info is model.get_model_info()
+    assert model_info.model is model
+    assert model_info.uid_name == uid_name
+    assert model_info.uid_db_property == uid_db_property
+    assert model_info.db_properties[uid_name] == uid_db_property
+
+
+def test_get_relationship_info():
+    """Test that the relationship information is computed once per model class."""
+    bug = BugzillaBug(id_='2345').save()
+    relationship_info = bug.get_relationship_info()
+    assert relationship_info is BugzillaBug.get_relationship_info()
+    assert relationship_info.single_property_names == {'assignee', 'qa_contact', 'reporter'}
+    assert 'resolved_by_commits' in relationship_info.property_names
+    assert relationship_info.relationship_map['DistGitCommit']['RESOLVED'] == {
+        INCOMING: ('resolved_by_commits', ZeroOrMore)
+    }
+
+
+def test_serialize_raw_node():
+    """Test that serializing a node returned by Neo4j matches serializing the model object."""
+    adv = Advisory(id_='12345', advisory_name='RHBA-2017:27760-01',
+                   created_at=datetime(2017, 4, 2, 19, 39, 6)).save()
+    bug = BugzillaBug(id_='2345', votes=3).save()
+    adv.attached_bugs.connect(bug)
+
+    results, _ = db.cypher_query('MATCH (n) RETURN n ORDER BY n.id')
+    for node, in results:
+        node_model = get_node_model(node)
+        item = node_model.inflate(node)
+        assert node_model.serialize_raw_node(node) == item.serialized
+        assert node_model.serialize_raw_node(node, relationships=True) == item.serialized_all
+
+
+def test_inflate_results_identity_map():
+    """Test that a node shared by several results is only serialized once."""
+    adv = Advisory(id_='12345', advisory_name='RHBA-2017:27760-01').save()
+    bug = BugzillaBug(id_='2345').save()
+    bug_two = BugzillaBug(id_='3456').save()
+    adv.attached_bugs.connect(bug)
+    adv.attached_bugs.connect(bug_two)
+
+    results, _ = db.cypher_query(
+        'MATCH (advisory:Advisory)-[:ATTACHED]->(bug:BugzillaBug) RETURN advisory, bug')
+    identity_map = {}
+    inflated = EstuaryStructuredNode.inflate_results(results, ['advisory'], identity_map)
+    assert len(inflated) == 2
+    assert inflated[0]['Advisory'][0] is inflated[1]['Advisory'][0]
+    assert inflated[0]['Advisory'][0]['resource_type'] == 'Advisory'
+    assert len(inflated[0]['Advisory'][0]['attached_bugs']) == 2
+    assert len(identity_map) == 3
+
+
+def test_serialize_nodes_all():
+    """Test that serializing several nodes at once matches their serialized_all property."""
+    adv = Advisory(id_='12345', advisory_name='RHBA-2017:27760-01').save()
+    bug = BugzillaBug(id_='2345').save()
+    bug_two = BugzillaBug(id_='3456').save()
+    adv.attached_bugs.connect(bug)
+    adv.attached_bugs.connect(bug_two)
+
+    results, _ = db.cypher_query('MATCH (n) RETURN n')
+    nodes = [node for node, in results] + [adv]
+    serialized_nodes = EstuaryStructuredNode.serialize_nodes_all(nodes)
+    assert set(serialized_nodes.keys()) == {adv.id, bug.id, bug_two.id}
+    for item in (adv, bug, bug_two):
+        assert serialized_nodes[item.id] == item.serialized_all
+    assert EstuaryStructuredNode.serialize_nodes_all([]) == {}
+
+
+def test_serialize_sparse():
+    """Test serializing a node with only some of its properties and relationships."""
+    build = KojiBuild(id_='2345', name='slf4j', version='1.7.4', release='4.el7_4').save()
+    commit = DistGitCommit(hash_='8a63adb248ba633e200067e1ad6dc61931727bad').save()
+    tag = KojiTag(id_='3456', name='some-tag').save()
+    adv = Advisory(id_='12345', advisory_name='RHBA-2017:27760-01').save()
+    build.commit.connect(commit)
+    build.tags.connect(tag)
+    adv.attached_builds.connect(build)
+
+    assert build.serialize_sparse() == build.serialized_all
+    assert build.serialize_sparse(include=set()) == build.serialized
+    assert build.serialize_sparse({'id', 'name'}, {'commit', 'advisories'}) == {
+        'id': '2345',
+        'name': 'slf4j',
+        'commit': commit.serialized,
+        'advisories': [adv.serialized],
+    }
+
+
+def test_get_relationships_query():
+    """Test that the relationships that aren't included are left out of the query."""
+    query = KojiBuild._get_relationships_query({'commit', 'advisories'})
+    assert query == (
+        'MATCH (a) WHERE id(a)=$node_id MATCH (a)-[r:ATTACHED|BUILT_FROM]-(all) WHERE '
+        '(type(r) = "ATTACHED" AND all:Advisory AND endNode(r) = a) OR '
+        '(type(r) = "BUILT_FROM" AND all:DistGitCommit AND startNode(r) = a) RETURN r, all')
+    assert KojiTag._get_relationships_query({'builds'}) == (
+        'MATCH (a) WHERE id(a)=$node_id MATCH (a)-[r:CONTAINS]-(all) WHERE '
+        '(type(r) = "CONTAINS" AND all:KojiBuild AND NOT all:ContainerKojiBuild AND '
+        'startNode(r) = a) RETURN r, all')
+
+
+def test_serialize_sparse_limit():
+    """Test that the nodes of each relationship are limited and the truncation is reported."""
+    tag = KojiTag(id_='3456', name='some-tag').save()
+    builds = []
+    for build_id in range(5):
+        build = KojiBuild(id_=str(build_id), name='slf4j').save()
+        tag.builds.connect(build)
+        builds.append(build)
+    # The container builds aren't part of the builds relationship of a tag, just like in
+    # serialized_all
+    tag.builds.connect(ContainerKojiBuild(id_='5', name='slf4j-container').save())
+
+    truncated = {}
+    serialized = tag.serialize_sparse(limit=2, truncated=truncated)
+    assert serialized['builds'] == [builds[0].serialized, builds[1].serialized]
+    assert truncated == {'builds': builds[1].id}
+    assert tag.count_related(['builds']) == {'builds': 5}
+    assert tag.get_related_page('builds', 10)[1:] == (5, None)
+
+    truncated = {}
+    assert tag.serialize_sparse(limit=5, truncated=truncated) == tag.serialized_all
+    assert truncated == {}
+    assert tag.serialize_sparse(include={'builds'}) == tag.serialize_sparse(
+        limit=5, include={'builds'})
+
+
+def test_get_related_page():
+    """Test paging through the nodes of a relationship with a keyset cursor."""
+    tag = KojiTag(id_='3456', name='some-tag').save()
+    builds = []
+    for build_id in range(5):
+        build = KojiBuild(id_=str(build_id), name='slf4j').save()
+        tag.builds.connect(build)
+        builds.append(build)
+
+    nodes, total, after_id = tag.get_related_page('builds', 2)
+    assert nodes == [builds[0].serialized, builds[1].serialized]
+    assert total == 5
+    assert after_id == builds[1].id
+    nodes, total, after_id = tag.get_related_page('builds', 2, builds[3].id)
+    assert nodes == [builds[4].serialized]
+    assert total == 5
+    assert after_id is None
+
+
+def test_story_counts():
+    """Test that the story counters are kept up to date and can be rebuilt."""
+    # To avoid circular imports
+    from estuary.utils.story import rebuild_story_counts
+
+    def _get_counts(node):
+        results, _ = db.cypher_query(
+            'MATCH (n) WHERE id(n) = $node_id RETURN n.resolved_bugzillabug_count, '
+            'n.built_from_kojibuild_count, n.resolved_distgitcommit_count',
+            {'node_id': node.id})
+        return tuple(results[0])
+
+    commit = DistGitCommit(hash_='8a63adb248ba633e200067e1ad6dc61931727bad').save()
+    bug = BugzillaBug(id_='2345').save()
+    bug_two = BugzillaBug(id_='3456').save()
+    build = KojiBuild(id_='2345', name='slf4j', version='1.7.4', release='4.el7_4').save()
+    build_two = KojiBuild(id_='3456', name='slf4j', version='1.7.4', release='5.el7_4').save()
+
+    commit.resolved_bugs.connect(bug)
+    EstuaryStructuredNode.conditional_connect(commit.resolved_bugs, bug_two)
+    build.commit.connect(commit)
+    assert _get_counts(commit) == (2, 1, None)
+    assert _get_counts(bug)[2] == 1
+
+    # Replacing the commit of the build updates the counters of the old commit
+    commit_two = DistGitCommit(hash_='e2e4f2c4a16c1b5d3be1c4a8b0ba2ae47bbba6bc').save()
+    EstuaryStructuredNode.conditional_connect(build_two.commit, commit)
+    EstuaryStructuredNode.conditional_connect(build_two.commit, commit_two)
+    assert _get_counts(commit)[1] == 1
+    assert _get_counts(commit_two)[1] == 1
+
+    bug.resolved_by_commits.disconnect(commit)
+    assert _get_counts(commit)[0] == 1
+    assert _get_counts(bug)[2] == 0
+
+    db.cypher_query('MATCH (n) REMOVE n.resolved_bugzillabug_count')
+    assert _get_counts(commit)[0] is None
+    assert rebuild_story_counts() == 6
+    assert _get_counts(commit) == (1, 1, None)
@@ -1,6 +1,13 @@
 # SPDX-License-Identifier: GPL-3.0+
 
 from __future__ import unicode_literals
+import gzip
+import io
+import zlib
+
+import pytest
+
+from estuary.models.distgit import DistGitCommit
 
 
 def test_insert_headers(client):
@@ -9,3 +16,67 @@ def test_insert_headers(client):
     assert 'Access-Control-Allow-Origin: *' in str(rv.headers)
     assert 'Access-Control-Allow-Headers: Content-Type' in str(rv.headers)
     assert 'Access-Control-Allow-Method: GET, OPTIONS' in str(rv.headers)
+
+
+def test_insert_cache_headers(client):
+    """Test that the ETag and Cache-Control headers are inserted and If-None-Match is handled."""
+    rv = client.get('/api/v1/about')
+    assert rv.status_code == 200
+    assert rv.headers['Cache-Control'] == 'no-cache'
+    etag = rv.headers['ETag']
+
+    rv = client.get('/api/v1/about', headers={'If-None-Match': etag})
+    assert rv.status_code == 304
+    assert rv.data == b''
+
+    rv = client.get('/api/v1/about', headers={'If-None-Match': '"something-else"'})
+    assert rv.status_code == 200
+    assert rv.headers['ETag'] == etag
+
+
+def test_insert_cache_headers_max_age(client):
+    """Test that the Cache-Control max-age is set per resource type."""
+    DistGitCommit.get_or_create({'hash_': 'abc'})
+    client.application.config['CACHE_CONTROL_MAX_AGE'] = {'distgitcommit': 86400}
+    try:
+        rv = client.get('/api/v1/distgitcommit/abc')
+        assert rv.status_code == 200
+        assert rv.headers['Cache-Control'] == 'public, max-age=86400'
+        # Errors are never cached by clients
+        rv = client.get('/api/v1/distgitcommit/def')
+        assert rv.status_code == 404
+        assert 'Cache-Control' not in rv.headers
+    finally:
+        client.application.config['CACHE_CONTROL_MAX_AGE'] = {}
+
+
+@pytest.mark.parametrize('accept_encoding,expected_encoding', [
+    ('gzip, deflate', 'gzip'),
+    ('deflate', 'deflate'),
+    ('gzip;q=0, deflate', 'deflate'),
+    ('identity', None),
+])
+def test_compress_response(client, accept_encoding, expected_encoding):
+    """Test that the responses are compressed based on the Accept-Encoding header."""
+    expected = client.get('/api/v1/about').data
+    client.application.config['COMPRESSION_MIN_SIZE'] = 0
+    try:
+        rv = client.get('/api/v1/about', headers={'Accept-Encoding': accept_encoding})
+    finally:
+        client.application.config['COMPRESSION_MIN_SIZE'] = 1024
+    assert rv.headers.get('Content-Encoding') == expected_encoding
+    # The uncompressed response also depends on the Accept-Encoding header
+    assert 'Accept-Encoding' in rv.vary
+    if expected_encoding == 'gzip':
+        assert gzip.GzipFile(fileobj=io.BytesIO(rv.data)).read() == expected
+    elif expected_encoding == 'deflate':
+        assert zlib.decompress(rv.data) == expected
+    else:
+        assert rv.data == expected
+
+
+def test_compress_response_min_size(client):
+    """Test that the responses smaller than the minimum size aren't compressed."""
+    rv = client.get('/api/v1/about', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in rv.headers
+    assert 'Accept-Encoding' not in rv.vary
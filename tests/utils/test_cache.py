@@ -0,0 +1,188 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import hashlib
+import threading
+import time
+
+from flask import Flask, Response
+import mock
+import pytest
+from werkzeug.exceptions import NotFound
+
+from estuary.utils.cache import ResponseCache, SingleFlight, CachedResponse, cached_response
+
+
+def test_response_cache_lru():
+    """Test that the least recently used values are evicted when the cache is full."""
+    cache = ResponseCache(10, 300, 60, get_generation=lambda: 0)
+    cache.set('a', 'value_a', 4)
+    cache.set('b', 'value_b', 4)
+    assert cache.get('a') == 'value_a'
+    cache.set('c', 'value_c', 4)
+    assert cache.get('b') is None
+    assert cache.get('a') == 'value_a'
+    assert cache.get('c') == 'value_c'
+    # Values bigger than the cache are never cached
+    cache.set('d', 'value_d', 11)
+    assert cache.get('d') is None
+    assert cache.get('a') == 'value_a'
+
+
+def test_response_cache_ttl():
+    """Test that the values expire after the TTL."""
+    cache = ResponseCache(10, 300, 600, get_generation=lambda: 0)
+    with mock.patch('estuary.utils.cache.time.time', return_value=1000):
+        cache.set('a', 'value_a', 4)
+    with mock.patch('estuary.utils.cache.time.time', return_value=1299):
+        assert cache.get('a') == 'value_a'
+    with mock.patch('estuary.utils.cache.time.time', return_value=1301):
+        assert cache.get('a') is None
+
+
+def test_response_cache_generation():
+    """Test that the cache is cleared when the graph generation changes."""
+    generation = [1]
+    cache = ResponseCache(10, 300, 0, get_generation=lambda: generation[0])
+    cache.set('a', 'value_a', 4)
+    assert cache.get('a') == 'value_a'
+    generation[0] = 2
+    assert cache.get('a') is None
+
+
+def _get_slow_response(calls):
+    """Return a function that counts its calls and is slow enough for the calls to overlap."""
+    def _get_response():
+        calls.append(None)
+        time.sleep(0.2)
+        return CachedResponse(None, 200, (('Content-Type', 'application/json'),), b'{}', {})
+    return _get_response
+
+
+@pytest.mark.parametrize('use_lock_dir', [False, True])
+def test_single_flight(tmpdir, use_lock_dir):
+    """Test that concurrent identical calls are coalesced, including across processes."""
+    calls = []
+    get_response = _get_slow_response(calls)
+    if use_lock_dir:
+        # Each SingleFlight object acts like a different worker process
+        single_flights = [SingleFlight(str(tmpdir)) for _ in range(5)]
+    else:
+        single_flights = [SingleFlight()] * 5
+    results = []
+    threads = [
+        threading.Thread(target=lambda sf=sf: results.append(sf.do(('key',), get_response)))
+        for sf in single_flights
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert len(results) == 5
+    assert all(result.body == b'{}' for result in results)
+
+    # A call made after the others finished isn't coalesced
+    single_flights[0].do(('key',), get_response)
+    assert len(calls) == 2
+    # The lock and result files are removed once no call is waiting for them
+    assert tmpdir.listdir() == []
+
+
+def test_single_flight_no_waiting_call(tmpdir):
+    """Test that the result is only shared through a file when another call is waiting for it."""
+    single_flight = SingleFlight(str(tmpdir))
+    written = []
+
+    def _get_response():
+        written.extend(tmpdir.listdir())
+        return CachedResponse(None, 200, (), b'{}', {})
+
+    # A marker file of a process that no longer exists is ignored and removed
+    tmpdir.join('{0}.999999999-1.wait'.format(
+        hashlib.sha1(repr(('key',)).encode('utf-8')).hexdigest())).write('')
+    assert single_flight.do(('key',), _get_response).body == b'{}'
+    assert sorted(path.ext for path in written) == ['.lock', '.wait']
+    assert tmpdir.listdir() == []
+
+
+def test_cached_response_not_found():
+    """Test that a cached NotFound error is raised as a new exception on every cache hit."""
+    app = Flask(__name__)
+    app.extensions['response_cache'] = ResponseCache(1024, 300, 0, get_generation=lambda: 1)
+    app.extensions['single_flight'] = SingleFlight()
+    calls = []
+
+    @app.route('/<uid>')
+    @cached_response
+    def _get_resource(uid):
+        calls.append(None)
+        raise NotFound('This item does not exist')
+
+    errors = []
+    for _ in range(2):
+        with app.test_request_context('/1'):
+            with pytest.raises(NotFound) as exc_info:
+                _get_resource('1')
+            errors.append(exc_info.value)
+    assert len(calls) == 1
+    assert errors[0] is not errors[1]
+    assert errors[1].description == 'This item does not exist'
+
+
+@pytest.mark.parametrize('min_size,accept_encoding,expected_encoding,expected_vary', [
+    (0, 'gzip', 'gzip', True),
+    (0, 'identity', None, True),
+    (1024, 'gzip', None, False),
+])
+def test_cached_response_vary(min_size, accept_encoding, expected_encoding, expected_vary):
+    """Test that the cached responses that can be compressed vary on the Accept-Encoding header."""
+    app = Flask(__name__)
+    app.config['COMPRESSION_LEVEL'] = 6
+    app.config['COMPRESSION_MIN_SIZE'] = min_size
+    app.extensions['response_cache'] = ResponseCache(1024, 300, 0, get_generation=lambda: 1)
+
+    @app.route('/<uid>')
+    @cached_response
+    def _get_resource(uid):
+        return Response('some data', mimetype='application/json')
+
+    for _ in range(2):
+        headers = {'Accept-Encoding': accept_encoding}
+        with app.test_request_context('/1', headers=headers):
+            rv = _get_resource('1')
+    assert rv.headers.get('Content-Encoding') == expected_encoding
+    assert ('Accept-Encoding' in rv.vary) is expected_vary
+
+
+def test_single_flight_error():
+    """Test that the calls waiting for a call that failed each raise their own exception."""
+    single_flight = SingleFlight()
+    started = threading.Event()
+
+    def _fail():
+        started.set()
+        time.sleep(0.2)
+        raise NotFound('This item does not exist')
+
+    errors = []
+
+    def _do():
+        try:
+            single_flight.do(('key',), _fail)
+        except NotFound as error:
+            errors.append(error)
+
+    leader = threading.Thread(target=_do)
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=_do) for _ in range(3)]
+    for thread in followers:
+        thread.start()
+    for thread in [leader] + followers:
+        thread.join()
+    assert len(errors) == 4
+    assert len(set(id(error) for error in errors)) == 4
+    assert all(error.description == 'This item does not exist' for error in errors)
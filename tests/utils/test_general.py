@@ -5,7 +5,10 @@ from datetime import datetime, date
 
 import pytest
 
-from estuary.utils.general import timestamp_to_datetime, timestamp_to_date
+from estuary.error import ValidationError
+from estuary.utils.general import (
+    timestamp_to_datetime, timestamp_to_date, str_to_int, str_to_set, iter_json, encode_cursor,
+    decode_cursor)
 
 
 @pytest.mark.parametrize('input_dt,expected_dt', [
@@ -54,3 +57,69 @@ def test_timestamp_to_datetime_invalid(input_dt):
     with pytest.raises(ValueError)as exc_info:
         timestamp_to_datetime(input_dt)
     assert 'The timestamp "{0}" is an invalid format'.format(input_dt) == str(exc_info.value)
+
+
+@pytest.mark.parametrize('item,min_value,max_value,expected', [
+    ('0', 0, None, 0),
+    ('25', 1, 100, 25),
+    ('100', 1, 100, 100),
+])
+def test_str_to_int(item, min_value, max_value, expected):
+    """Test that a query parameter can be converted to an integer."""
+    assert str_to_int(item, 'limit', min_value, max_value) == expected
+
+
+@pytest.mark.parametrize('item,max_value,error', [
+    ('abc', 100, 'The limit must be an integer between 1 and 100'),
+    ('0', 100, 'The limit must be an integer between 1 and 100'),
+    ('101', 100, 'The limit must be an integer between 1 and 100'),
+    ('-1', None, 'The limit must be an integer greater than or equal to 1'),
+])
+def test_str_to_int_invalid(item, max_value, error):
+    """Test that an error is raised when the query parameter is an invalid integer."""
+    with pytest.raises(ValidationError) as exc_info:
+        str_to_int(item, 'limit', 1, max_value)
+    assert error == str(exc_info.value)
+
+
+@pytest.mark.parametrize('item,expected', [
+    ('commit', {'commit'}),
+    (' commit, advisories,,commit', {'commit', 'advisories'}),
+    ('', set()),
+])
+def test_str_to_set(item, expected):
+    """Test that a comma-separated query parameter can be converted to a set."""
+    assert str_to_set(item, 'include', ['advisories', 'commit', 'tags']) == expected
+
+
+def test_str_to_set_invalid():
+    """Test that an error is raised when the query parameter has values that aren't allowed."""
+    with pytest.raises(ValidationError) as exc_info:
+        str_to_set('commit,builds,owner', 'include', ['advisories', 'commit', 'tags'])
+    assert str(exc_info.value) == ('The include "builds, owner" are invalid. Choose from the '
+                                   'following: advisories, commit, and tags.')
+
+
+def test_cursor():
+    """Test that a pagination cursor can be decoded back to the internal Neo4j ID."""
+    assert decode_cursor(encode_cursor(12345)) == 12345
+
+
+@pytest.mark.parametrize('cursor', ['!!', 'YWJj', ''])
+def test_decode_cursor_invalid(cursor):
+    """Test that an error is raised when the pagination cursor is invalid."""
+    with pytest.raises(ValidationError) as exc_info:
+        decode_cursor(cursor)
+    assert str(exc_info.value) == 'The cursor is invalid'
+
+
+@pytest.mark.parametrize('obj,depth,expected', [
+    ({'b': [1, {'x': 2}], 'a': None}, 2,
+     [b'{', b'"a":', b'null', b',', b'"b":', b'[', b'1', b',', b'{"x":2}', b']', b'}']),
+    ((story for story in [{'data': []}, {'data': [1]}]), 1,
+     [b'[', b'{"data":[]}', b',', b'{"data":[1]}', b']']),
+    ([], 1, [b'[', b']']),
+])
+def test_iter_json(obj, depth, expected):
+    """Test that an object is encoded to JSON in chunks."""
+    assert list(iter_json(obj, depth)) == expected
@@ -0,0 +1,76 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import pytest
+
+from estuary.error import ValidationError
+from estuary.utils.queries import (
+    create_node_subquery, create_story_query, create_full_story_query, create_node_count_query,
+    create_story_counts_query)
+
+
+@pytest.mark.parametrize('label,uid_name,expected', [
+    ('KojiBuild', None, '(kojibuild:KojiBuild)'),
+    ('KojiBuild', 'id_', '(kojibuild:KojiBuild {id:$uid})'),
+    ('DistGitCommit', 'hash', '(distgitcommit:DistGitCommit {hash:$uid})'),
+])
+def test_create_node_subquery(label, uid_name, expected):
+    """Test that the node subquery uses a parameter for the UniqueIdProperty value."""
+    assert create_node_subquery(label, uid_name) == expected
+
+
+@pytest.mark.parametrize('builder,args', [
+    (create_story_query, ('Advisory',)),
+    (create_story_query, ('Advisory', True, True)),
+    (create_full_story_query, ('DistGitCommit',)),
+    (create_node_count_query, ('BugzillaBug', 'RESOLVED', 'DistGitCommit', 'hash')),
+])
+def test_query_templates_cached(builder, args):
+    """Test that the query templates are parameterized and only built once."""
+    query = builder(*args)
+    assert '$uid' in query
+    assert builder(*args) is query
+
+
+@pytest.mark.parametrize('builder', [
+    create_story_query, create_full_story_query, create_story_counts_query])
+def test_query_templates_invalid_label(builder):
+    """Test that an error is raised when the story is not available for the label."""
+    with pytest.raises(ValidationError) as exc_info:
+        builder('User')
+    assert 'The story is not available for this kind of resource' == str(exc_info.value)
+
+
+def test_create_full_story_query_batch():
+    """Test that the batch story query gets the stories of the UIDs in the uids parameter."""
+    query = create_full_story_query('KojiBuild', batch=True)
+    assert 'UNWIND $uids AS uid MATCH (item:KojiBuild {id:uid})' in query
+    assert '$uid}' not in query
+    assert 'RETURN uid, item, forward_path, backward_path' in query
+    assert create_full_story_query('KojiBuild', batch=True) is query
+
+
+def test_create_story_query_paths_limit():
+    """Test that the number of longest paths can be limited with the limit parameter."""
+    query = create_story_query('DistGitCommit', paths_limit=True)
+    assert query.rstrip().endswith('LIMIT $limit')
+    assert '$limit' not in create_story_query('DistGitCommit')
+
+
+def test_create_story_counts_query():
+    """Test that the story counters of all the labels of the nodes are updated."""
+    query = create_story_counts_query()
+    assert query.startswith('MATCH (n) WHERE id(n) IN $node_ids ')
+    assert ('FOREACH (_ IN CASE WHEN n:DistGitCommit THEN [1] ELSE [] END | '
+            'SET n.resolved_bugzillabug_count = size((n)-[:RESOLVED]-(:BugzillaBug)), '
+            'n.built_from_kojibuild_count = size((n)-[:BUILT_FROM]-(:KojiBuild)))') in query
+    assert ('FOREACH (_ IN CASE WHEN n:ContainerKojiBuild THEN [1] ELSE [] END | '
+            'SET n.triggered_freshmakerevent_count = size((n)-[:TRIGGERED]-(:FreshmakerEvent)))'
+            ) in query
+
+    query = create_story_counts_query('BugzillaBug')
+    assert query == (
+        'MATCH (n:BugzillaBug) WHERE id(n) > $after_id WITH n ORDER BY id(n) LIMIT $limit '
+        'SET n.resolved_distgitcommit_count = size((n)-[:RESOLVED]-(:DistGitCommit)) '
+        'RETURN max(id(n)), count(n)')
@@ -0,0 +1,61 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import mock
+
+from estuary.utils.schema import (
+    get_required_schema, get_existing_schema, get_missing_schema, UniqueConstraint, Index)
+
+
+def test_get_required_schema():
+    """Test that the constraints and indexes are derived from the models."""
+    schema = get_required_schema()
+    assert UniqueConstraint('KojiBuild', 'id') in schema
+    assert UniqueConstraint('ContainerKojiBuild', 'id') in schema
+    assert UniqueConstraint('DistGitCommit', 'hash') in schema
+    assert UniqueConstraint('User', 'username') in schema
+    assert UniqueConstraint('EstuaryMetadata', 'name') in schema
+    assert UniqueConstraint('EstuaryStory', 'key') in schema
+    # The models without a unique property are merged on their required properties
+    assert Index('DistGitRepo', ('name', 'namespace')) in schema
+    assert Index('DistGitBranch', ('name', 'repo_name', 'repo_namespace')) in schema
+    # The models with a unique property only need the uniqueness constraint
+    assert not any(item.label == 'KojiTask' for item in schema if isinstance(item, Index))
+
+
+def _mock_cypher_query(query, params=None):
+    """Return the constraints and indexes in the format of Neo4j 3.3."""
+    if query.startswith('CALL db.constraints()'):
+        return [
+            ['CONSTRAINT ON ( kojibuild:KojiBuild ) ASSERT kojibuild.id IS UNIQUE'],
+            ['CONSTRAINT ON ( user:User ) ASSERT user.username IS UNIQUE'],
+        ], None
+    return [
+        ['INDEX ON :KojiBuild(id)'],
+        ['INDEX ON :User(username)'],
+        ['INDEX ON :DistGitRepo(name, namespace)'],
+    ], None
+
+
+@mock.patch('estuary.utils.schema.db.cypher_query', side_effect=_mock_cypher_query)
+def test_get_existing_schema(mock_cypher_query):
+    """Test that the descriptions of the constraints and indexes returned by Neo4j are parsed."""
+    assert get_existing_schema() == {
+        UniqueConstraint('KojiBuild', 'id'),
+        UniqueConstraint('User', 'username'),
+        Index('KojiBuild', ('id',)),
+        Index('User', ('username',)),
+        Index('DistGitRepo', ('name', 'namespace')),
+    }
+
+
+@mock.patch('estuary.utils.schema.db.cypher_query', side_effect=_mock_cypher_query)
+def test_get_missing_schema(mock_cypher_query):
+    """Test that only the constraints and indexes that don't exist are reported as missing."""
+    missing = get_missing_schema()
+    assert UniqueConstraint('KojiBuild', 'id') not in missing
+    assert Index('DistGitRepo', ('name', 'namespace')) not in missing
+    assert UniqueConstraint('DistGitCommit', 'hash') in missing
+    assert Index('DistGitBranch', ('name', 'repo_name', 'repo_namespace')) in missing
+    assert len(missing) == len(get_required_schema()) - 3
@@ -0,0 +1,96 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+from datetime import datetime, date
+
+from flask import Flask
+import mock
+import pytest
+import pytz
+
+from estuary.utils.serialization import (
+    json_dumps, msgpack_dumps, cbor_dumps, negotiated_response)
+
+
+@pytest.mark.parametrize('use_orjson', [True, False])
+def test_json_dumps(use_orjson):
+    """Test that both JSON backends encode the same way, including datetime values."""
+    obj = {
+        'b': [1, 2.5, None, True],
+        'a': 'résumé',
+        'creation_time': datetime(2017, 4, 2, 19, 39, 6, tzinfo=pytz.utc),
+        'completion_time': datetime(2017, 4, 2, 19, 39, 6, 123456),
+        'date': date(2017, 4, 2),
+    }
+    expected = ('{"a":"résumé","b":[1,2.5,null,true],'
+                '"completion_time":"2017-04-02T19:39:06.123456",'
+                '"creation_time":"2017-04-02T19:39:06+00:00","date":"2017-04-02"}')
+    if use_orjson:
+        pytest.importorskip('orjson')
+        assert json_dumps(obj) == expected.encode('utf-8')
+    else:
+        with mock.patch('estuary.utils.serialization.orjson', None):
+            assert json_dumps(obj) == expected.encode('utf-8')
+
+
+@pytest.mark.parametrize('use_orjson', [True, False])
+def test_json_dumps_invalid(use_orjson):
+    """Test that an error is raised when the object can't be encoded to JSON."""
+    if use_orjson:
+        pytest.importorskip('orjson')
+        with pytest.raises(TypeError):
+            json_dumps({'a': object()})
+    else:
+        with mock.patch('estuary.utils.serialization.orjson', None):
+            with pytest.raises(TypeError):
+                json_dumps({'a': object()})
+
+
+def test_msgpack_dumps():
+    """Test that datetime values are encoded to MessagePack as ISO 8601 strings."""
+    msgpack = pytest.importorskip('msgpack')
+    obj = {'a': [1, None], 'creation_time': datetime(2017, 4, 2, 19, 39, 6, tzinfo=pytz.utc)}
+    assert msgpack.unpackb(msgpack_dumps(obj), raw=False) == {
+        'a': [1, None], 'creation_time': '2017-04-02T19:39:06+00:00'}
+
+
+def test_cbor_dumps():
+    """Test that datetime values are encoded to CBOR with the date/time tag, naive ones in UTC."""
+    cbor2 = pytest.importorskip('cbor2')
+    obj = {
+        'creation_time': datetime(2017, 4, 2, 19, 39, 6, tzinfo=pytz.utc),
+        'completion_time': datetime(2017, 4, 2, 19, 39, 6),
+    }
+    expected = datetime(2017, 4, 2, 19, 39, 6, tzinfo=pytz.utc)
+    assert cbor2.loads(cbor_dumps(obj)) == {'creation_time': expected, 'completion_time': expected}
+
+
+@pytest.mark.parametrize('accept,expected_mimetype', [
+    (None, 'application/json'),
+    ('*/*', 'application/json'),
+    ('text/html', 'application/json'),
+    ('application/msgpack', 'application/msgpack'),
+    ('application/x-msgpack', 'application/x-msgpack'),
+    ('application/json;q=0.5, application/cbor', 'application/cbor'),
+])
+def test_negotiated_response(accept, expected_mimetype):
+    """Test that the response format is negotiated with the Accept header."""
+    pytest.importorskip('msgpack')
+    pytest.importorskip('cbor2')
+    headers = {}
+    if accept:
+        headers['Accept'] = accept
+    with Flask(__name__).test_request_context(headers=headers):
+        rv = negotiated_response({'a': 1})
+    assert rv.mimetype == expected_mimetype
+    assert rv.headers['Vary'] == 'Accept'
+
+
+def test_negotiated_response_not_installed():
+    """Test that JSON is returned when the library of the requested format isn't installed."""
+    with mock.patch('estuary.utils.serialization.msgpack', None):
+        headers = {'Accept': 'application/msgpack'}
+        with Flask(__name__).test_request_context(headers=headers):
+            rv = negotiated_response({'a': 1})
+    assert rv.mimetype == 'application/json'
+    assert rv.data == b'{"a":1}'
@@ -0,0 +1,103 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import threading
+import time
+
+from estuary.utils.snapshot import StorySnapshot, StorySnapshotManager
+
+
+def _create_snapshot(generation=1):
+    """Create a snapshot where the KojiBuild 22 is also a ContainerKojiBuild."""
+    layers = {
+        'BugzillaBug': [1, 2],
+        'DistGitCommit': [10, 11],
+        'KojiBuild': [20, 21, 22],
+        'Advisory': [30],
+        'FreshmakerEvent': [40],
+        'ContainerKojiBuild': [22, 50],
+    }
+    relationships = {
+        'BugzillaBug': [(1, 10), (1, 11), (2, 11)],
+        'DistGitCommit': [(10, 20), (11, 21), (11, 22)],
+        'KojiBuild': [(21, 30)],
+        'Advisory': [(30, 40)],
+        # The relationships to nodes that aren't in the snapshot are skipped
+        'FreshmakerEvent': [(40, 50), (40, 60)],
+    }
+    return StorySnapshot(generation, layers, relationships)
+
+
+def test_story_snapshot_longest_path():
+    """Test that the longest paths are found in both directions."""
+    snapshot = _create_snapshot()
+    assert snapshot.get_longest_path('BugzillaBug', 1) == [1, 11, 21, 30, 40, 50]
+    assert snapshot.get_longest_path('BugzillaBug', 1, reverse=True) is None
+    assert snapshot.get_longest_path('DistGitCommit', 11) == [11, 21, 30, 40, 50]
+    # When several paths are the longest, the one with the lowest IDs is returned
+    assert snapshot.get_longest_path('DistGitCommit', 11, reverse=True) == [11, 1]
+    assert snapshot.get_longest_path('ContainerKojiBuild', 50, reverse=True) == [
+        50, 40, 30, 21, 11, 1]
+    assert snapshot.get_longest_path('KojiBuild', 22) is None
+    assert snapshot.get_longest_path('ContainerKojiBuild', 22, reverse=True) is None
+    assert snapshot.get_longest_path('Advisory', 31) is None
+
+
+def test_story_snapshot_all_paths():
+    """Test that all the paths, including the partial ones, are in ascending order of length."""
+    snapshot = _create_snapshot()
+    assert snapshot.get_all_paths('BugzillaBug', 2) == [
+        [2, 11],
+        [2, 11, 21],
+        [2, 11, 22],
+        [2, 11, 21, 30],
+        [2, 11, 21, 30, 40],
+        [2, 11, 21, 30, 40, 50],
+    ]
+    assert snapshot.get_all_paths('KojiBuild', 21, reverse=True) == [
+        [21, 11], [21, 11, 1], [21, 11, 2]]
+    assert snapshot.get_all_paths('ContainerKojiBuild', 50) == []
+    # Only the shortest paths are enumerated with a limit
+    assert snapshot.get_all_paths('BugzillaBug', 2, limit=3) == [
+        [2, 11], [2, 11, 21], [2, 11, 22]]
+
+
+def test_story_snapshot_nodes():
+    """Test the sibling counts, the path labels and the membership of the nodes."""
+    snapshot = _create_snapshot()
+    assert snapshot.get_sibling_counts('DistGitCommit', 11) == (2, 2)
+    assert snapshot.get_sibling_counts('BugzillaBug', 1) == (0, 2)
+    assert snapshot.get_sibling_counts('ContainerKojiBuild', 50) == (1, 0)
+    assert snapshot.get_path_labels('KojiBuild', 3, reverse=True) == [
+        'KojiBuild', 'DistGitCommit', 'BugzillaBug']
+    assert snapshot.has_node('KojiBuild', 22)
+    assert snapshot.has_node('ContainerKojiBuild', 22)
+    assert not snapshot.has_node('ContainerKojiBuild', 21)
+
+
+def test_story_snapshot_manager():
+    """Test that the snapshot is loaded in the background and only used while it's up to date."""
+    generation = [1]
+    loaded = threading.Event()
+
+    def _load_snapshot(get_generation):
+        snapshot = _create_snapshot(get_generation())
+        loaded.set()
+        return snapshot
+
+    manager = StorySnapshotManager(0, lambda: generation[0], _load_snapshot)
+    assert manager.get() is None
+    loaded.wait(5)
+    # Wait for the load to be marked as done
+    while manager._loading:
+        time.sleep(0.01)
+    assert manager.get().generation == 1
+
+    generation[0] = 2
+    loaded.clear()
+    assert manager.get() is None
+    loaded.wait(5)
+    while manager._loading:
+        time.sleep(0.01)
+    assert manager.get().generation == 2
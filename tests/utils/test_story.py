@@ -0,0 +1,93 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import pytest
+
+from estuary.models import story_flow_list
+from estuary.utils.story import (
+    story_flow, story_flow_table, get_unique_path_indexes, get_story_graph,
+    get_path_sibling_counts)
+
+
+@pytest.mark.parametrize('label,forward_pattern,backward_pattern', [
+    ('BugzillaBug', '<-[:RESOLVED]-(:DistGitCommit)', None),
+    ('DistGitCommit', '<-[:BUILT_FROM]-(:KojiBuild)', '-[:RESOLVED]->(:BugzillaBug)'),
+    ('KojiBuild', '<-[:ATTACHED]-(:Advisory)', '-[:BUILT_FROM]->(:DistGitCommit)'),
+    ('Advisory', '<-[:TRIGGERED_BY]-(:FreshmakerEvent)', '-[:ATTACHED]->(:KojiBuild)'),
+    ('FreshmakerEvent', '-[:TRIGGERED]->(:ContainerKojiBuild)', '-[:TRIGGERED_BY]->(:Advisory)'),
+    ('ContainerKojiBuild', None, '<-[:TRIGGERED]-(:FreshmakerEvent)'),
+])
+def test_story_flow_patterns(label, forward_pattern, backward_pattern):
+    """Test that the story flow table contains the pre-rendered cypher patterns."""
+    stage = story_flow(label)
+    assert stage.forward_pattern == forward_pattern
+    assert stage.backward_pattern == backward_pattern
+
+
+def test_story_flow_order():
+    """Test that following the story flow forward visits the labels in order."""
+    labels = []
+    label = story_flow_list[0]
+    while label:
+        labels.append(label)
+        label = story_flow_table[label].forward_label
+    assert labels == story_flow_list
+
+
+def test_get_path_sibling_counts():
+    """Test that the sibling counts are read from the story counters of the path nodes."""
+    path = [
+        {'id': '1', 'resolved_distgitcommit_count': 2},
+        {'hash': 'a', 'resolved_bugzillabug_count': 1, 'built_from_kojibuild_count': 3},
+        # The story counters of this node aren't set yet
+        {'id': '2', 'built_from_distgitcommit_count': 1},
+    ]
+    assert get_path_sibling_counts('BugzillaBug', path) == {
+        ('BugzillaBug', '1'): (0, 2),
+        ('DistGitCommit', 'a'): (1, 3),
+    }
+    assert get_path_sibling_counts('DistGitCommit', path[1:2], reverse=True) == {
+        ('DistGitCommit', 'a'): (1, 3)}
+
+
+def test_story_flow_invalid_label():
+    """Test that an error is raised when the label isn't part of the story flow."""
+    assert story_flow(None) is None
+    with pytest.raises(ValueError) as exc_info:
+        story_flow('User')
+    assert 'The label should belong to a Neo4j node class' == str(exc_info.value)
+
+
+@pytest.mark.parametrize('paths,expected', [
+    ([], []),
+    ([[1, 2]], [0]),
+    # The shorter paths are part of the longest one
+    ([[1, 2], [1, 2, 3], [1, 2, 3, 4]], [2]),
+    # The paths only differ by a sibling
+    ([[1, 2, 3], [1, 2, 4]], [1]),
+    # The paths fork before their last node
+    ([[1, 2], [1, 3], [1, 2, 4, 6], [1, 3, 5, 7]], [2, 3]),
+    ([[1], [2, 3]], [0, 1]),
+])
+def test_get_unique_path_indexes(paths, expected):
+    """Test that the paths that are part of another path are eliminated."""
+    assert get_unique_path_indexes(paths) == expected
+
+
+def test_get_story_graph():
+    """Test that the nodes shared by several stories are only listed once in the story graph."""
+    bug = {'id': '1', 'resource_type': 'BugzillaBug'}
+    commit = {'hash': 'abc', 'resource_type': 'DistGitCommit'}
+    build = {'id': '1', 'resource_type': 'KojiBuild'}
+    build_two = {'id': '2', 'resource_type': 'KojiBuild'}
+    meta = {'related_nodes': {}}
+    stories = [
+        {'data': [bug, commit, build], 'meta': meta},
+        {'data': [dict(bug), dict(commit), build_two], 'meta': meta},
+    ]
+    assert get_story_graph(stories) == {
+        'nodes': [bug, commit, build, build_two],
+        'edges': [[0, 1], [1, 2], [1, 3]],
+        'stories': [{'path': [0, 1, 2], 'meta': meta}, {'path': [0, 1, 3], 'meta': meta}],
+    }